@@ -10,6 +10,9 @@ Gregor Dederichs, EPFL School of Life Sciences
 
 import time
 import os
+import functools
+import gc
+import concurrent.futures
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import (QLineEdit,
                             QLabel,
@@ -20,18 +23,28 @@ from PyQt6.QtWidgets import (QLineEdit,
                             QComboBox)
 import pyqtgraph as pg
 
-from nidaqmx.constants import AcquisitionType
 
 import numpy as np
-import pandas as pd
 
 import util
 import fbase
-import iTBS
-import cTBS
-import TBS_ctrl
-import TI
+import segments
 import GUI_worker
+import stream
+import cache
+import lod_plot
+import control
+import generation
+import sample_format
+import channels
+import session_log
+import schedule
+import startup
+import waveforms
+import protocols
+import rate_planner
+import monitor
+import tracing
 
 
 class MainWindow(QWidget):
@@ -58,8 +71,10 @@ class MainWindow(QWidget):
         self.layout.setColumnStretch(0, 0)
         
         # State settings
-        self.update_request = False
-        self.stop_request = False
+        self.control = control.StimulationControl() # update/stop requests to worker thread
+        self.written_signals = None # signals in the buffer of the current task
+        self.requested_values = None # values of the GUI fields when the last update was requested
+        self.waveform_lines = True # whether lines are plotted around the waveform being created (see create_waveform)
         self.running = False
 
 
@@ -71,7 +86,7 @@ class MainWindow(QWidget):
         # choose stim type
         self.drop_stim_select = QComboBox()
         self.drop_stim_select.setFixedWidth(300)
-        self.drop_stim_select.addItems(["Select Stimulation","iTBS","cTBS","TBS_control","TI"])
+        self.drop_stim_select.addItems(["Select Stimulation"] + protocols.names())
         self.drop_stim_select.currentTextChanged.connect(self.stim_selected)
         self.layout.addWidget(self.drop_stim_select,1,0)
 
@@ -161,6 +176,10 @@ class MainWindow(QWidget):
         self.rep_num_edit = QLineEdit(str(util.rep_num))
         self.layout.addWidget(self.rep_num_edit, 9, 3)
 
+        # sample rate of the waveform (see rate_planner.py)
+        self.rate_label = QLabel("")
+        self.layout.addWidget(self.rate_label, 10, 2, 1, 2)
+
 
         # ======== BUTTON FIELDS ========
         # reset (default set in util.py)
@@ -171,9 +190,7 @@ class MainWindow(QWidget):
         # create signals/waveforms
         self.btn_create_signals = QPushButton("Create Waveform")
         self.btn_create_signals.setEnabled(False)
-        self.btn_create_signals.clicked.connect(lambda: self.create_signals(rampup=True))
-        self.btn_create_signals.clicked.connect(lambda: self.graph_waveform())
-        self.btn_create_signals.clicked.connect(lambda: self.btn_run_stimulation.setEnabled(True)) #enable run button
+        self.btn_create_signals.clicked.connect(self.create_waveform) #created in background, enables run button when ready
         self.layout.addWidget(self.btn_create_signals,1,2,1,2)
 
         # run stimulation
@@ -248,15 +265,50 @@ class MainWindow(QWidget):
         self.layout.addWidget(self.box_save,3,1, alignment=Qt.AlignmentFlag.AlignBottom)       
 
 
+        startup.checkpoint("widgets and schedule")
+
+        # ======== WAVEFORM CREATION ========
+        self.waveform_cache = cache.WaveformCache()
+        self.generator = generation.WaveformGenerator()
+        self.generator.progress.connect(self.waveform_progress)
+        self.generator.finished.connect(self.waveform_ready)
+        self.generator.failed.connect(self.waveform_failed)
+        self.swap_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1) # hot-swaps, never queued behind waveforms of the plot
+
+        # ======== PARAMETER SAVING ========
+        self.session_log = session_log.SessionLog() # written in the background
+        self.log_target = None #(directory, subject, session), read from widgets in the GUI thread
+
+
+        startup.checkpoint("waveform cache, generator and log")
+
         # ======== GRAPH FIELDS ========
-        self.dt = [0,1]
-        self.TBS_signals = np.zeros((2,2))
+        self.dt = segments.TimeAxis(1, 2, zeros=0)
+        self.TBS_signals = np.zeros((channels.count(),2)) #np.array, or segments.Program when streamed (see create_signals)
         self.plot_waveform = pg.PlotWidget()
+        self.plot_waveform.plotItem.setMouseEnabled(y=False) # Only allow zoom in X-axis
         self.plot_waveform.getAxis("bottom").setLabel("Time", units="s")
         self.plot_waveform.getAxis("left").setLabel("Amplitude", units="mA")
-        self.plot_waveform.plot(self.dt, self.TBS_signals[0]+self.TBS_signals[1])
+        self.waveform_plot = lod_plot.LODPlot(self.plot_waveform) # reused for every waveform
+        self.waveform_plot.set_signals(self.dt, self.TBS_signals, lod_plot.pyramid(self.TBS_signals))
+        self.plot_lines = []
         self.layout.addWidget(self.plot_waveform,2,2,2,2)
 
+        # ======== READ-BACK MONITOR ========
+        self.monitor = None
+        if util.monitor:
+            self.monitor = monitor.Monitor() # started by the worker thread for each run
+            self.plot_monitor = pg.PlotWidget()
+            self.plot_monitor.plotItem.setMouseEnabled(x=False, y=False)
+            self.plot_monitor.getAxis("bottom").setLabel("Time", units="s")
+            self.plot_monitor.getAxis("left").setLabel("Read-back", units="V")
+            self.layout.addWidget(self.plot_monitor,4,2,3,2)
+            self.monitor_label = QLabel("Read-back: not running")
+            self.layout.addWidget(self.monitor_label,7,2,1,2)
+            self.monitor_view = monitor.LiveView(self.monitor, self.plot_monitor, self.monitor_label)
+
+
+        startup.checkpoint("plot")
 
         # ======== LABEL FIELDS ========
         self.run_status = QLabel("Select Stimulation")
@@ -285,6 +337,8 @@ class MainWindow(QWidget):
         # choose which window to open on start
         if util.default_mode=="Blind":
             self.blind_mode.setCheckState(Qt.CheckState.Checked)
+        startup.checkpoint("layout and show")
+        startup.interactive() # once the event loop runs; then preloads nidaqmx in the background
 
 
 
@@ -306,25 +360,83 @@ class MainWindow(QWidget):
         self.rep_num_edit.setText(str(util.rep_num))
     
 
-    def assign_values(self):
+    def read_values(self):
+        """
+        Description
+        -----------
+        Reads values from GUI fields (to be called in the GUI thread, eg. when an update is requested)
+
+        Returns
+        -------
+        dict
+            the text of each field, and the selected stimulation type
+        """
+        values = {name: getattr(self, name+"_edit").text()
+                  for name in ("total_TBS_time", "freq_of_pulse", "burst_freq", "carrier_f", "A_sum", "A_ratio",
+                               "ramp_up_time", "ramp_down_time", "rep_num")}
+        values["stim_type"] = self.drop_stim_select.currentText()
+        return values
+
+
+    @staticmethod
+    def parse_values(values):
+        """
+        Description
+        -----------
+        Converts values read from GUI fields into the settings of a stimulation, without storing them
+
+        Parameters
+        ----------
+        values : dict
+            values read from the fields (see read_values)
+
+        Returns
+        -------
+        dict
+            the settings, named as the attributes of the GUI (see assign_values)
+        """
+        A_sum = float(values["A_sum"])
+        A_ratio = float(values["A_ratio"])
+        return {"stim_type": values["stim_type"],
+                "total_TBS_time": int(values["total_TBS_time"]),
+                "train_stim_time": util.train_stim_time,
+                "train_break_time": util.train_break_time,
+                "freq_of_pulse": int(values["freq_of_pulse"]),
+                "burst_freq": int(values["burst_freq"]),
+                "carrier_f": int(values["carrier_f"]),
+                "A_sum": A_sum,
+                "A_ratio": A_ratio,
+                "A1": A_sum/(1+A_ratio),
+                "A2": A_ratio*A_sum/(1+A_ratio),
+                "ramp_up_time": float(values["ramp_up_time"]),
+                "ramp_down_time": float(values["ramp_down_time"]),
+                "rep_num": int(values["rep_num"])}
+
+
+    def assign_values(self, values=None):
         """
         Description
         -----------
         Read values from GUI fields and store them
+
+        Parameters
+        ----------
+        values : dict
+            values already read from the fields (see read_values), eg. by the GUI thread for updates
+            created in the worker thread; None to read them now
         """
-        self.total_TBS_time = int(self.total_TBS_time_edit.text())
-        self.train_stim_time = util.train_stim_time
-        self.train_break_time = util.train_break_time
-        self.freq_of_pulse = int(self.freq_of_pulse_edit.text())
-        self.burst_freq = int(self.burst_freq_edit.text())
-        self.carrier_f = int(self.carrier_f_edit.text())
-        self.A_sum = float(self.A_sum_edit.text())
-        self.A_ratio = float(self.A_ratio_edit.text())
-        self.A1 = self.A_sum/(1+self.A_ratio)
-        self.A2 = self.A_ratio*self.A_sum/(1+self.A_ratio)
-        self.ramp_up_time = float(self.ramp_up_time_edit.text())
-        self.ramp_down_time = float(self.ramp_down_time_edit.text())
-        self.rep_num = int(self.rep_num_edit.text())
+        values = self.read_values() if values is None else values
+        for name, value in self.parse_values(values).items():
+            setattr(self, name, value)
+
+
+    def settings(self):
+        """
+        Description
+        -----------
+        Returns the stored settings of the stimulation type and its signals (see parse_values)
+        """
+        return {name: getattr(self, name) for name in ["stim_type", *waveforms.default_params()]}
 
 
     def graph_waveform(self, lines=True):
@@ -340,12 +452,14 @@ class MainWindow(QWidget):
         """
         #only plot waveform if mode is not blind
         if self.blind_mode.checkState() == Qt.CheckState.Unchecked:
-            self.plot_waveform = pg.PlotWidget()
-            self.plot_waveform.plotItem.setMouseEnabled(y=False) # Only allow zoom in X-axis
-            self.plot_waveform.plot(self.dt,self.TBS_signals[0]+self.TBS_signals[1],)
+            # level of detail of the plot adapts to the visible range (pyramid built in the background, see create_waveform)
+            self.waveform_plot.set_signals(self.dt, self.TBS_signals, lod_plot.pyramid(self.TBS_signals))
             self.plot_waveform.setYRange(-self.A_sum,self.A_sum)
-            self.plot_waveform.getAxis("bottom").setLabel("Time", units="s")
-            self.plot_waveform.getAxis("left").setLabel("Amplitude", units="mA")
+
+            # remove lines of previous waveform
+            for line in self.plot_lines:
+                self.plot_waveform.removeItem(line)
+            self.plot_lines = []
 
             #plot lines surrounding main signal (exclude ramps)
             if lines:
@@ -353,86 +467,238 @@ class MainWindow(QWidget):
                 self.ramp_down_line = pg.InfiniteLine(pos=self.total_TBS_time+self.ramp_up_time, angle=90, movable=False)
                 self.plot_waveform.addItem(self.ramp_up_line)
                 self.plot_waveform.addItem(self.ramp_down_line)
+                self.plot_lines = [self.ramp_up_line, self.ramp_down_line]
+
+            # sample rate, with its reconstruction error and the size of the signals
+            stim_type = self.drop_stim_select.currentText()
+            if protocols.get(stim_type) is None:
+                self.rate_label.setText("")
+            else:
+                params = {name: getattr(self, name) for name in waveforms.default_params()}
+                self.rate_label.setText(str(rate_planner.plan(stim_type, params, rate=self.dt.rate)))
+
 
-            # update graph widget
-            self.layout.addWidget(self.plot_waveform,2,2,2,2)
+    def running_rate(self):
+        """
+        Description
+        -----------
+        Returns the sample rate imposed on new signals: a continuous task keeps its sample rate, so that updates
+        are spliced in at the rate of the running signals (None if no continuous task is running)
+        """
+        return self.dt.rate if self.running and self.worker_thread.streamed else None
 
 
-    def create_signals(self, rampup=True):
+    def waveform_job(self, settings, rampup=True, rate=None, compiled=False):
         """
         Description
         -----------
-        Creates signals from GUI values (calls assign_values() before running)
-        and selected stimulation type, and stores signals
+        Describes the signals of stimulation settings
 
         Parameters
         ----------
+        settings : dict
+            the stimulation type and its parameters (see settings, parse_values)
+
         rampup: bool
             decides whether a ramping signal with no shift is added to the main signal
+
+        rate : float
+            imposed sample rate (see running_rate); None for the rate of the stimulation
+
+        compiled : bool
+            True for the function compiling the signals only (see waveforms.program)
+
+        Returns
+        -------
+        tuple[tuple, callable]
+            the key identifying the signals (for caching), and the function creating them
+            (None if no stimulation is selected)
         """
+        params = {name: settings[name] for name in waveforms.default_params()}
+        key, generate = waveforms.job(settings["stim_type"], params, rampup, self.waveform_cache.files, rate)
+        if compiled and generate is not None:
+            generate = functools.partial(waveforms.program, settings["stim_type"], params, rampup, rate)
+        return key, generate
+
+
+    @tracing.traced("create_signals")
+    def make_signals(self, settings, rampup=True, rate=None, compiled=False):
+        """
+        Description
+        -----------
+        Creates the signals of stimulation settings without storing them, so that it can run in any thread
+        (eg. while the worker thread streams the current signals, see hot_swap)
+
+        Parameters
+        ----------
+        settings, rampup, rate, compiled :
+            as for waveform_job
+
+        Returns
+        -------
+        tuple[segments.TimeAxis, np.array or segments.Program]
+            the time points and the signals (eg. signal 1 is signals[0])
+        """
+        key, generate = self.waveform_job(settings, rampup, rate, compiled)
+
+        # blank signal
+        if generate is None:
+            return segments.TimeAxis(1, 2, zeros=0), np.zeros((channels.count(),2))
+
+        if compiled:
+            return generate() # (compiled plans are reused by protocols.plan)
+
+        # reuse waveform if already created with the same parameters
+        cached = self.waveform_cache.get(key)
+        if cached is not None:
+            return cached
+
+        dt, signals = generate()
+        self.waveform_cache.put(key, dt, signals)
+        return dt, signals
+
+
+    def create_signals(self, rampup=True, values=None, compiled=False):
+        """
+        Description
+        -----------
+        Creates signals from GUI values and selected stimulation type, and stores signals and values
+
+        Parameters
+        ----------
+        rampup: bool
+            decides whether a ramping signal with no shift is added to the main signal
+
+        values : dict
+            values read from the GUI fields (see read_values); None to read them now (GUI thread only)
+
+        compiled : bool
+            True to store the compiled signals only (segments.Program), for streamed tasks: their samples are
+            evaluated chunk by chunk while the task runs, so that no complete signal is ever created
+        """
+        values = self.read_values() if values is None else values
+        dt, signals = self.make_signals(self.parse_values(values), rampup, self.running_rate(), compiled)
+        self.assign_values(values)
+        self.dt, self.TBS_signals = dt, signals
+
+
+    def create_waveform(self, lines=True):
+        """
+        Description
+        -----------
+        Creates signals (with ramp-up) in the background and plots them once ready ("Create Waveform" button).
+        The pyramid drawn by the plot is built in the background as well (see lod_plot.with_pyramid).
+        Supersedes any creation still ongoing. The run button is enabled once the signals are ready
+
+        Parameters
+        ----------
+        lines : bool
+            decides whether lines are plotted around the main signal (see graph_waveform)
+        """
+        self.btn_run_stimulation.setEnabled(False)
         self.assign_values()
+        self.waveform_lines = lines
+        key, generate = self.waveform_job(self.settings(), rampup=True, rate=self.running_rate())
+
+        # blank signal, or already created and plotted
+        cached = None if generate is None else self.waveform_cache.get(key)
+        if generate is None or (cached is not None and lod_plot.has_pyramid(cached[1])):
+            self.generator.cancel()
+            if generate is None:
+                self.create_signals(rampup=True)
+            else:
+                self.dt, self.TBS_signals = cached
+            self.graph_waveform(lines)
+            self.btn_run_stimulation.setEnabled(not self.running and generate is not None)
+            return
+
+        if cached is not None:
+            generate = lambda progress=None: cached # (eg. loaded from the disk cache: only its pyramid is built)
+        self.generator.submit(key, functools.partial(lod_plot.with_pyramid, generate))
+        if not self.running:
+            self.run_status.setText("Creating Waveform")
+            self.run_status.setStyleSheet("color: orange; font-weight: bold;")
+
+
+    def waveform_progress(self, request, fraction):
+        """
+        Description
+        -----------
+        Shows the progress of the background creation of signals
+        """
+        if self.generator.is_current(request) and not self.running:
+            self.run_status.setText("Creating Waveform ({:.0f}%)".format(100*fraction))
+
+
+    def waveform_ready(self, request, key, result):
+        """
+        Description
+        -----------
+        Stores and plots signals created in the background, and enables the run button
+        """
+        if not self.generator.is_current(request):
+            return # superseded by a newer request
+        self.waveform_cache.put(key, *result)
+        self.dt, self.TBS_signals = result
+        self.graph_waveform(self.waveform_lines)
+        if not self.running:
+            self.btn_run_stimulation.setEnabled(True)
+            self.run_status.setText("Ready")
+            self.run_status.setStyleSheet("color: green; font-weight: bold;")
+
+
+    def waveform_failed(self, request, message):
+        """
+        Description
+        -----------
+        Reports an error during the background creation of signals
+        """
+        if self.generator.is_current(request) and not self.running:
+            self.run_status.setText("Waveform not created: {}".format(message))
+            self.run_status.setStyleSheet("color: red; font-weight: bold;")
 
-        # signal for iTBS
-        if self.drop_stim_select.currentText() == "iTBS":
-            self.dt, self.TBS_signals = iTBS.iTBS(self.total_TBS_time,
-                                        self.train_stim_time,
-                                        self.train_break_time,
-                                        self.freq_of_pulse,
-                                        self.burst_freq,
-                                        self.carrier_f,
-                                        self.A1, self.A2,
-                                        self.ramp_up_time,
-                                        self.ramp_down_time,
-                                        rampup=rampup)
-        # signal for cTBS    
-        elif self.drop_stim_select.currentText() == "cTBS":
-            self.dt, self.TBS_signals = cTBS.cTBS(self.total_TBS_time,
-                                        self.freq_of_pulse,
-                                        self.burst_freq,
-                                        self.carrier_f,
-                                        self.A1, self.A2,
-                                        self.ramp_up_time,
-                                        self.ramp_down_time,
-                                        rampup=rampup)
-        # signal for TBS_control
-        elif self.drop_stim_select.currentText() == "TBS_control":
-            self.dt, self.TBS_signals = TBS_ctrl.TBS_control(self.total_TBS_time,
-                                                             self.carrier_f,
-                                                             self.A1,
-                                                             self.A2,
-                                                             self.ramp_up_time,
-                                                             self.ramp_down_time,
-                                                             rampup=rampup)
-        # signal for TI
-        elif self.drop_stim_select.currentText() == "TI":
-            self.dt, self.TBS_signals = TI.TI(self.total_TBS_time,
-                                              self.freq_of_pulse,
-                                              self.carrier_f,
-                                              self.A1,
-                                              self.A2,
-                                              self.ramp_up_time,
-                                              self.ramp_down_time,
-                                              rampup=rampup)
-        # blank signal    
-        else:
-            self.dt = [0,1]
-            self.TBS_signals = np.zeros((2,2))
-            
                
+    @staticmethod
+    @tracing.traced("create_stop_signal")
+    def make_stop_signal(settings, rate):
+        """
+        Description
+        -----------
+        Creates a ramp down signal with null envelope, without storing it (may run in any thread, see hot_swap)
+
+        Parameters
+        ----------
+        settings : dict
+            the settings of the running signals (see settings)
+
+        rate : float
+            the sample rate of the running signals
+
+        Returns
+        -------
+        np.array
+            the signals (eg. signal 1 is signals[0])
+        """
+        protocol = protocols.get(settings["stim_type"])
+        return fbase.ramp(direction="down",
+                          carrier_f=settings["carrier_f"],
+                          ramp_time=settings["ramp_down_time"],
+                          A1_max=settings["A1"],
+                          A2_max=settings["A2"],
+                          rate=rate,
+                          shape=None if protocol is None else protocol.ramp) # (envelope tables shared across stops)
+
+
     def create_stop_signal(self):
         """
         Description
         -----------
-        Creates a ramp down signal with null envelope
+        Creates a ramp down signal with null envelope, from the stored settings of the running signals
         """
         #named TBS_signals for code usability, 
         #but is simply high f signals,
         #with decreasing amplitude and null envelope
-        self.TBS_signals = fbase.ramp(direction="down",
-                                 carrier_f=self.carrier_f,
-                                 ramp_time=self.ramp_down_time,
-                                 A1_max=self.A1,
-                                 A2_max=self.A2)
+        self.TBS_signals = self.make_stop_signal(self.settings(), self.dt.rate)
         
 
     def stim_selected(self):
@@ -442,10 +708,8 @@ class MainWindow(QWidget):
         Updates information label when stimulation type is selected
         """
         if not self.running:
-            if (self.drop_stim_select.currentText()=="iTBS" 
-                or self.drop_stim_select.currentText()=="cTBS"
-                or self.drop_stim_select.currentText() == "TBS_control"
-                or self.drop_stim_select.currentText() == "TI"):
+            protocol = protocols.get(self.drop_stim_select.currentText())
+            if protocol is not None:
                 self.run_status.setText("Ready")
                 self.run_status.setStyleSheet("color: green; font-weight: bold;")
                 self.btn_create_signals.setEnabled(True)
@@ -454,13 +718,13 @@ class MainWindow(QWidget):
                 self.run_status.setStyleSheet("color: orange; font-weight: bold;")
                 self.btn_create_signals.setEnabled(False)
 
-            #special labels for TI
-            if self.drop_stim_select.currentText() == "TI":
-                self.pulse_freq_label.setText("Shift Frequency (Hz)")
-                self.burst_freq_edit.setEnabled(False)
-            else:
-                self.pulse_freq_label.setText("Pulse Frequency (Hz)")
-                self.burst_freq_edit.setEnabled(True)
+            #special labels and unused fields of the stimulation (eg. shift frequency of TI)
+            labels = protocol.labels if protocol is not None else {}
+            disabled = protocol.disabled if protocol is not None else ()
+            self.pulse_freq_label.setText(labels.get("freq_of_pulse", "Pulse Frequency (Hz)"))
+            for name in waveforms.default_params():
+                if hasattr(self, name+"_edit"):
+                    getattr(self, name+"_edit").setEnabled(name not in disabled)
 
 
 
@@ -476,70 +740,44 @@ class MainWindow(QWidget):
             name of the file storing protocol information; the file should contain a 3xN matrix. 
             Column 1 contains subject ID. Column 2 contains protocol of session T3. Column 3 contains protocol of session T5.
         """
-        parent_dir = os.getcwd()
-        path = os.path.join(parent_dir,"HummelGUI", util.excel_file_name) 
-
-        # check path
-        if not os.path.exists(path):
-            self.run_status.setText("File not found")
+        # schedule parsed once, reloaded only if the file changed (see schedule.py)
+        try:
+            sched = schedule.load(util.excel_file_name)
+        except ValueError as error:
             self.run_status.setStyleSheet("color: red; font-weight: bold;")
-        else: # (if path exists)
-            try:
-                df = pd.read_excel(path)
-            except:
-                self.run_status.setText("Check filename")
-                self.run_status.setStyleSheet("color: red; font-weight: bold;")
-                self.btn_create_signals.setEnabled(False)
-                self.btn_run_stimulation.setEnabled(False)
-                return # quit function if filename does not exist
-            
-            # read session information
-            session = self.session_edit.currentText()
-            subject = self.subject_edit.currentText()
-            df.index = df["Subj"]
-            try:
-                stim_type = df.at[subject, session]
-            except:
-                self.run_status.setText("Check session and subject ID")
-                self.run_status.setStyleSheet("color: red; font-weight: bold;")
-                self.btn_create_signals.setEnabled(False)
-                self.btn_run_stimulation.setEnabled(False)
+            if str(error) == "File not found":
+                self.run_status.setText("File not found")
                 return
-
-            # select stim type from file
-            if stim_type == "iTBS":
-                self.drop_stim_select.setCurrentText("iTBS")
-                if self.blind_mode.isChecked():
-                    # in blind mode, signals are auto-created
-                    self.btn_run_stimulation.setEnabled(True)
-                self.stim_selected()
-
-            elif stim_type == "cTBS":
-                self.drop_stim_select.setCurrentText("cTBS")
-                if self.blind_mode.isChecked():
-                    # in blind mode, signals are auto-created
-                    self.btn_run_stimulation.setEnabled(True)
-                self.stim_selected()
-
-            elif stim_type == "TBS_control":
-                self.drop_stim_select.setCurrentText("TBS_control")
-                if self.blind_mode.isChecked():
-                    # in blind mode, signals are auto-created
-                    self.btn_run_stimulation.setEnabled(True)
-                self.stim_selected()
-
-            elif stim_type == "TI":
-                self.drop_stim_select.setCurrentText("TI")
-                if self.blind_mode.isChecked():
-                    # in blind mode, signals are auto-created
-                    self.btn_run_stimulation.setEnabled(True)
-                self.stim_selected()
-                
-            else:
-                self.run_status.setText("Stimulation type ({}) not recognised".format(stim_type))
-                self.run_status.setStyleSheet("color: red; font-weight: bold;")
-                self.btn_create_signals.setEnabled(False)
-                self.btn_run_stimulation.setEnabled(False)
+            self.run_status.setText("Check filename")
+            self.btn_create_signals.setEnabled(False)
+            self.btn_run_stimulation.setEnabled(False)
+            return # quit function if file is not readable
+
+        # read session information
+        session = self.session_edit.currentText()
+        subject = self.subject_edit.currentText()
+        try:
+            stim_type = sched.lookup(subject, session)
+        except KeyError:
+            self.run_status.setText("Check session and subject ID")
+            self.run_status.setStyleSheet("color: red; font-weight: bold;")
+            self.btn_create_signals.setEnabled(False)
+            self.btn_run_stimulation.setEnabled(False)
+            return
+
+        # select stim type from file
+        if protocols.get(stim_type) is not None:
+            self.drop_stim_select.setCurrentText(stim_type)
+            if self.blind_mode.isChecked():
+                # in blind mode, signals are auto-created
+                self.btn_run_stimulation.setEnabled(True)
+            self.stim_selected()
+            
+        else:
+            self.run_status.setText("Stimulation type ({}) not recognised".format(stim_type))
+            self.run_status.setStyleSheet("color: red; font-weight: bold;")
+            self.btn_create_signals.setEnabled(False)
+            self.btn_run_stimulation.setEnabled(False)
 
 
     def run_stimulation(self):
@@ -548,59 +786,230 @@ class MainWindow(QWidget):
         -----------
         Triggers the start of the stimulation by starting worker thread
         """
-        # in blind mode, signals are auto-created by running
+        # in blind mode, signals are auto-created by running (compiled only if streamed)
         if self.blind_mode.isChecked():
-            self.create_signals()
+            self.create_signals(compiled=util.streaming)
 
+        self.log_target = self.read_log_target()
         self.worker_thread = GUI_worker.WorkerThread(self)
+        self.worker_thread.signals.finished.connect(self.stimulation_finished)
         self.worker_thread.start()
 
 
+    def stimulation_finished(self, error):
+        """
+        Description
+        -----------
+        Resets the controls once the worker thread has run all repetitions, or was aborted by an error
+        (eg. buffer underflow of the DAQ), which is then reported
+
+        Parameters
+        ----------
+        error : str
+            the error that aborted the stimulation, empty if it ended normally
+        """
+        self.btn_update.setEnabled(False)
+        self.btn_stop.setEnabled(False)
+        self.stim_selected()
+        if error:
+            self.run_status.setText("Stimulation aborted: {}".format(error))
+            self.run_status.setStyleSheet("color: red; font-weight: bold;")
+        self.run_status.setAlignment(Qt.AlignmentFlag.AlignRight)
+
+
+    def streaming(self):
+        """
+        Description
+        -----------
+        Checks whether the signals are streamed to the DAQ in chunks: in streaming mode (see util.streaming),
+        or if they are held in a file (see util.memmap_min_bytes), so that they are never loaded in memory at once
+        """
+        return util.streaming or (isinstance(self.TBS_signals, np.memmap) and
+                                  self.TBS_signals.nbytes >= util.memmap_min_bytes)
+
+
     def send_signal(self):
         """
         Description
         -----------
         Sends signal to DAQ, usually called by worker thread to avoid GUI freezing
         """
-        self.task.write(self.TBS_signals)
-        self.task.start()
+        if self.worker_thread.streamed:
+            self.stream_signal()
+            return
+
+        # a persistent task keeps its buffer between repetitions if the waveform is unchanged
+        if self.TBS_signals is not self.written_signals:
+            sample_format.SampleWriter(self.task).write(self.TBS_signals)
+            self.written_signals = self.TBS_signals
+        with tracing.span("task.start"):
+            self.task.start()
+        self.control.task_started()
         self.running = True
         
-        while not self.task.is_task_done():
-            # continuously checks for update or stop request while task is running
-            if self.update_request or self.stop_request:
-                self.task.stop()
+        while True:
+            # sleeps until task is done, or update or stop is requested
+            command = self.control.wait()
+            if command is None or command == control.DONE:
+                if self.task.is_task_done():
+                    break
+                continue # timeout, or done event of a stopped task
+
+            self.control.begin(command)
+            with tracing.span(command): # handling of the request, until the new signal is sent
+                with tracing.span("task.stop"):
+                    self.task.stop()
                 if self.use_trigger: #trigger disable necessary before updating task to avoid DAQ overload and spike
                     self.task.triggers.start_trigger.disable_start_trig()
-                
+                    self.worker_thread.trigger_configured = False
+
                 # update
-                if self.update_request:
-                    self.create_signals(rampup=False)
+                if command == control.UPDATE:
+                    self.create_signals(rampup=False, values=self.requested_values)
 
                 # stop
-                else: #self.stop_request:
+                else: #command == control.STOP
                     self.create_stop_signal()
 
-                self.task.timing.cfg_samp_clk_timing(rate=util.sampling_f, sample_mode=AcquisitionType.FINITE, samps_per_chan=np.shape(self.TBS_signals)[1])
+                from nidaqmx.constants import AcquisitionType # (loaded on first use, see startup.py)
+                with tracing.span("cfg_samp_clk_timing", streamed=False):
+                    self.task.timing.cfg_samp_clk_timing(rate=self.dt.rate, sample_mode=AcquisitionType.FINITE, samps_per_chan=np.shape(self.TBS_signals)[1])
+                self.written_signals = None
+            self.worker_thread.update()
+            return
+
+
+    def stream_signal(self):
+        """
+        Description
+        -----------
+        Streams signal to DAQ chunk by chunk (streaming mode, see util.streaming), 
+        usually called by worker thread to avoid GUI freezing.
+        Update and stop requests are checked between chunks.
+        Compiled signals (see create_signals) are evaluated chunk by chunk, arrays (eg. created for the plot) are read
+        """
+        rate = self.dt.rate # (kept by the continuous task)
+        settings = self.settings() # of the streamed signals (see hot_swap)
+        # full garbage collections take milliseconds with the objects of the GUI: one is done before streaming
+        # (compiled signals only allocate while streaming, see create_signals)
+        gc.collect()
+        self.streamer = stream.SignalStreamer(self.task, stream.SignalChunks(self.TBS_signals, rate=rate), channels=len(self.task.ao_channels))
+        with tracing.span("stream.prime"):
+            self.streamer.prime()
+        with tracing.span("task.start"):
+            self.task.start()
+        self.control.task_started()
+        self.running = True
+
+        switch = None # sample at which hot-swapped signals start playing, until generated
+        while not self.streamer.is_done():
+            # request acknowledged once the DAQ plays the new signals (after the write-ahead window)
+            if switch is not None and self.streamer.generated() >= switch:
+                self.control.task_started(late=(self.streamer.generated()-switch)/rate)
+                switch = None
+
+            # checks for update or stop request between chunks (hot-swaps: once the previous one plays)
+            command = self.control.command()
+            if command is not None and util.hot_swap and switch is None:
+                self.control.begin(command)
+                handled = self.streamer.generated()
+                with tracing.span("hot_swap", command=command):
+                    switch, settings = self.hot_swap(command, settings)
+                self.control.switch_latencies.append(switch-handled)
+                self.worker_thread.update(send=False)
+
+            elif command is not None and not util.hot_swap:
+                self.control.begin(command)
+                with tracing.span(command): # handling of the request, until the new signal is sent
+                    with tracing.span("task.stop"):
+                        self.task.stop()
+                    if self.use_trigger: #trigger disable necessary before updating task to avoid DAQ overload and spike
+                        self.task.triggers.start_trigger.disable_start_trig()
+                        self.worker_thread.trigger_configured = False
+
+                    # update
+                    if command == control.UPDATE:
+                        self.create_signals(rampup=False, values=self.requested_values, compiled=True)
+
+                    # stop
+                    else: #command == control.STOP
+                        self.create_stop_signal()
+
                 self.worker_thread.update()
+                return
+
+            self.streamer.write_next()
+
+        if switch is not None:
+            self.control.task_started(late=(self.streamer.generated()-switch)/rate)
+        # continuous task only ends when stopped
+        self.task.stop()
+
+
+    def hot_swap(self, command, settings):
+        """
+        Description
+        -----------
+        Splices updated signals (or the stop signal) into the running stream, without stopping the task.
+        The current signals keep streaming while the new ones are created (on a thread of their own, not
+        queued behind waveforms created for the plot), and the switch keeps carrier phase (on every channel)
+        and amplitude continuous (see stream.SignalChunks.splice).
+        The new signals and their values are stored once spliced
+
+        Parameters
+        ----------
+        command : str
+            control.UPDATE or control.STOP
+
+        settings : dict
+            the settings of the current signals (see settings)
+
+        Returns
+        -------
+        tuple[int, dict]
+            the sample of the task at which the new signals start playing, once the write-ahead window
+            already written is generated, and the settings of the new signals
+        """
+        rate = self.streamer.chunks.rate
+        if command == control.UPDATE:
+            values = self.requested_values # read by the GUI thread on request (see request_update)
+            new_settings = self.parse_values(values)
+            creation = self.swap_pool.submit(self.make_signals, new_settings, False, rate, True)
+        else: #command == control.STOP
+            new_settings = settings
+            creation = self.swap_pool.submit(self.make_stop_signal, settings, rate)
+        while not creation.done():
+            self.streamer.write_next()
+        result = creation.result() # raises errors of the creation, if any
+        signals = result[1] if command == control.UPDATE else result
+
+        switch = self.streamer.splice(signals, min(settings["carrier_f"], new_settings["carrier_f"]))
+        if command == control.UPDATE:
+            self.assign_values(values)
+            self.dt = result[0]
+        self.TBS_signals = signals
+        return switch, new_settings
             
     
     def request_update(self):
         """
         Description
         -----------
-        Changes the update request to True
+        Requests an update of the running stimulation to the worker thread
         """
-        self.update_request = True
+        self.log_target = self.read_log_target()
+        self.requested_values = self.read_values() # (the update is created in the worker thread)
+        self.control.request_update()
 
 
     def request_stop(self):
         """
         Description
         -----------
-        Changes the stop request to True
+        Requests the stop of the running stimulation to the worker thread
         """
-        self.stop_request = True
+        self.log_target = self.read_log_target()
+        self.control.request_stop()
 
 
     def toggle_mode(self):
@@ -654,9 +1063,8 @@ class MainWindow(QWidget):
                 for drops in self.subject_edit.findChildren(QWidget):
                     drops.setVisible(False)
 
-            # recall graphing to show signals in Testing mode        
-            self.create_signals()
-            self.graph_waveform(lines=False)
+            # recall graphing to show signals in Testing mode (created in the background)
+            self.create_waveform(lines=False)
         
         # handling view toggle of ComboBox
         for drops in self.drop_stim_select.findChildren(QWidget):
@@ -678,50 +1086,58 @@ class MainWindow(QWidget):
             self.use_trigger = False
 
 
-    def save_params(self, directory="parameter_history"):
+    def read_log_target(self):
         """
         Description
         -----------
-        Handles saving of parameters to a CSV file at the end of a stimulation.
-        A directory called "parameter_history" is created in the working directory.
-        The file is created inside "parameter_history".
-        If the file already exists in "parameter_history", new data are appended to the end of the existing file, without overwriting.
+        Reads where parameters are saved from the widgets (to be called in the GUI thread)
+
+        Returns
+        -------
+        tuple[str, str, str]
+            the directory, subject and session, or None if parameters are not saved
+        """
+        if self.box_save.checkState() != Qt.CheckState.Checked:
+            return None
+        directory = os.path.join(os.getcwd(), self.save_edit.text() or "parameter_history")
+        return directory, self.subject_edit.currentText(), self.session_edit.currentText()
+
+
+    def save_params(self, event="repetition", **fields):
+        """
+        Description
+        -----------
+        Handles saving of parameters at the start of a stimulation, and on update or stop.
+        Records are queued to the session log, and written in the background (see session_log.py)
+        to a file per subject and session, in "parameter_history" (in the working directory) 
+        or in the directory entered in the GUI.
+        If the file already exists, new data are appended to the end of the existing file, without overwriting.
 
         Parameters
         ----------
-        directory : string
-            name of the diectory to save data (if other than paramter_history)
-        """
-        #only save if box is checked
-        if self.box_save.checkState() == Qt.CheckState.Checked:
-            parent_dir = os.getcwd()
-            path = os.path.join(parent_dir, directory) 
-
-            if not os.path.exists(path):
-                os.makedirs(path)
-
-            file_name = os.path.join(path, 
-                                    self.subject_edit.currentText()+
-                                    "_"+
-                                    self.session_edit.currentText()+
-                                    ".csv") 
-            
-            with open(file_name, 'a', newline='') as file:
-                file.write("\ntime,"+str(time.ctime(time.time())))
-                file.write("\n"+self.subject_edit.currentText()+','+self.session_edit.currentText())
-                file.write("\ntotal_time,"+str(self.total_TBS_time))
-                file.write("\ntrain_stim_time,"+str(self.train_stim_time))
-                file.write("\ntrain_break_time,"+str(self.train_break_time))
-                file.write("\npulse_freq,"+str(self.freq_of_pulse))
-                file.write("\nburst_freq,"+str(self.burst_freq))
-                file.write("\ncarrier_freq,"+str(self.carrier_f))
-                file.write("\nampl_sum,"+str(self.A_sum))
-                file.write("\nampl_ratio,"+str(self.A_ratio))
-                file.write("\nampl1,"+str(self.A1))
-                file.write("\nampl2,"+str(self.A2))
-                file.write("\nramp_up_time,"+str(self.ramp_up_time))
-                file.write("\nramp_down_time,"+str(self.ramp_down_time))
-                file.write("\n")
+        event : str
+            "repetition" (start of a repetition), "update" or "stop"
+
+        fields : dict
+            additional fields of the record (eg. repetition number)
+        """
+        #only save if box is checked (see read_log_target)
+        if self.log_target is None:
+            return
+        directory, subject, session = self.log_target
+        params = {"total_time": self.total_TBS_time,
+                  "train_stim_time": self.train_stim_time,
+                  "train_break_time": self.train_break_time,
+                  "pulse_freq": self.freq_of_pulse,
+                  "burst_freq": self.burst_freq,
+                  "carrier_freq": self.carrier_f,
+                  "ampl_sum": self.A_sum,
+                  "ampl_ratio": self.A_ratio,
+                  "ampl1": self.A1,
+                  "ampl2": self.A2,
+                  "ramp_up_time": self.ramp_up_time,
+                  "ramp_down_time": self.ramp_down_time}
+        self.session_log.log(directory, subject, session, event, params, **fields)
 
 
     def keyPressEvent(self, event):
@@ -1,16 +1,24 @@
 import threading
-import nidaqmx.constants
+import time
 import numpy as np
 
-import nidaqmx
-from nidaqmx.constants import AcquisitionType
-from nidaqmx.constants import WAIT_INFINITELY as inf
-from nidaqmx.constants import Edge
-from nidaqmx.constants import Slope
-
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QObject, pyqtSignal
 
 import util
+import daq
+import stream
+import control
+import channels
+import tracing
+
+class WorkerSignals(QObject):
+    """
+    Description
+    -----------
+    Qt signals of the worker thread, delivered in the GUI thread (widgets are only reset there)
+    """
+    finished = pyqtSignal(str) #error message that aborted the run, empty if it ended normally
+
 
 class WorkerThread(threading.Thread):
     """
@@ -22,24 +30,56 @@ class WorkerThread(threading.Thread):
         super().__init__()
         self.parent = parent #access to main window's attributes/functions
         self.exit_repetitions = False
+        self.trigger_configured = False
+        self.streamed = util.streaming #whether the task streams signals in chunks (decided by new_task)
+        self.signals = WorkerSignals() # (created in the GUI thread, see MainWindow.run_stimulation)
+        self.error = "" #error that aborted the run, if any
 
-    def update(self):
+    def update(self, send=True):
         """
         Description
         -----------
         Run the update triggered by parent. Notably resets request values and sends new signal to DAQ
+
+        Parameters
+        ----------
+        send : bool
+            False if the new signal is already sent (eg. spliced into a running stream)
         """
-        #reset requests
-        if self.parent.update_request == True:
-            self.parent.update_request = False
-        if self.parent.stop_request == True:
-            self.parent.stop_request = False
+        # requests are acknowledged once the new signal is sent
+        stop = self.parent.control.handling() == control.STOP
+        if stop:
             self.exit_repetitions = True
             self.parent.run_status.setText("Ramping Down")
             self.parent.run_status.setStyleSheet("color: orange; font-weight: bold;")
             self.parent.run_status.setAlignment(Qt.AlignmentFlag.AlignLeft)
-        self.parent.save_params(directory=self.parent.save_edit.text())
-        self.parent.send_signal()
+        self.parent.save_params(event="stop" if stop else "update")
+        if send:
+            self.parent.send_signal()
+
+    def new_task(self):
+        """
+        Description
+        -----------
+        Creates a task with all output channels and its timing (trigger: see run).
+        Channels of several devices are in the same task, so that they share its sample clock and start
+        """
+        from nidaqmx.constants import AcquisitionType # (loaded on first use, see startup.py)
+        with tracing.span("task.create"):
+            task = daq.new_task()
+        task.register_done_event(self.parent.control.done_callback) # wakes up send_signal
+        with tracing.span("add_ao_voltage_chan", channels=len(channels.layout().names)):
+            for name in channels.layout().names:
+                task.ao_channels.add_ao_voltage_chan(name)
+        self.streamed = self.parent.streaming()
+        with tracing.span("cfg_samp_clk_timing", streamed=self.streamed):
+            if self.streamed:
+                stream.configure_task(task, rate=self.parent.dt.rate)
+            else:
+                task.timing.cfg_samp_clk_timing(rate=self.parent.dt.rate,sample_mode=AcquisitionType.FINITE,samps_per_chan=np.shape(self.parent.TBS_signals)[1])
+        self.parent.written_signals = None
+        self.trigger_configured = False
+        return task
 
     def run(self):
         """
@@ -47,23 +87,62 @@ class WorkerThread(threading.Thread):
         -----------
         Run and send signals to DAQ, as triggered by parent. 
         Runs the number of specified times (by parent = GUI).
-        Each run is on a new Task
+        Each run is on a new Task, or on the same committed task if util.persistent_task.
+        If an error aborts the run (eg. buffer underflow or write timeout of the DAQ), the task is still
+        stopped and closed, and the error is reported to the GUI (see WorkerSignals)
+        """
+        self.parent.control.reset()
+        self.parent.task = None
+        tracing.reset() # one trace per run
+        error = ""
+        try:
+            if self.parent.monitor is not None:
+                self.parent.monitor.start(self.parent.dt.rate) # before the output: clocked by its sample clock
+            self.run_repetitions()
+        except Exception as exception:
+            error = str(exception).splitlines()[0] if str(exception) else type(exception).__name__
+        finally:
+            self.close_task()
+            if self.parent.monitor is not None:
+                self.parent.monitor.stop()
+            if util.trace:
+                target = self.parent.log_target
+                tracing.export(name="_".join(target[1:]) if target is not None else "session")
+            self.parent.running = False
+            self.error = error
+            self.signals.finished.emit(error) # controls are reset by the GUI
+
+    def run_repetitions(self):
+        """
+        Description
+        -----------
+        Runs the repetitions of the stimulation (see run)
         """
+        from nidaqmx.constants import AcquisitionType, Edge, TaskMode # (loaded on first use, see startup.py)
+        from nidaqmx.constants import WAIT_INFINITELY as inf
         for rep_counter in range(self.parent.rep_num):
 
             # task handling/settings
-            self.parent.task = nidaqmx.Task()
-            self.parent.task.ao_channels.add_ao_voltage_chan(util.device+"/ao0")
-            self.parent.task.ao_channels.add_ao_voltage_chan(util.device+"/ao1")
-            self.parent.task.timing.cfg_samp_clk_timing(rate=util.sampling_f,sample_mode=AcquisitionType.FINITE,samps_per_chan=np.shape(self.parent.TBS_signals)[1])
+            setup_start = time.perf_counter()
+            if self.parent.task is None or not util.persistent_task:
+                self.parent.task = self.new_task()
+            elif not self.streamed and self.parent.TBS_signals is not self.parent.written_signals:
+                # persistent task, new waveform: buffer resized to its length
+                with tracing.span("cfg_samp_clk_timing", streamed=False):
+                    self.parent.task.timing.cfg_samp_clk_timing(rate=self.parent.dt.rate,sample_mode=AcquisitionType.FINITE,samps_per_chan=np.shape(self.parent.TBS_signals)[1])
             
             # add trigger to writing task
-            if self.parent.use_trigger:
-                self.parent.task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source="/"+util.device+"/PFI0", trigger_edge=Edge.RISING)
-                self.parent.task.triggers.start_trigger
+            if self.parent.use_trigger and not self.trigger_configured:
+                with tracing.span("cfg_dig_edge_start_trig"):
+                    self.parent.task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source=channels.layout().trigger_source(), trigger_edge=Edge.RISING)
+                self.trigger_configured = True
+            if util.persistent_task:
+                with tracing.span("task.commit"):
+                    self.parent.task.control(TaskMode.TASK_COMMIT) # no-op if already committed
+            self.parent.control.setup_times.append(time.perf_counter()-setup_start)
 
             # save parameters of start of experiment to csv
-            self.parent.save_params(directory=self.parent.save_edit.text())
+            self.parent.save_params(event="repetition", repetition=rep_counter+1)
             
             # handle button enabling/disabling while running
             self.parent.btn_update.setEnabled(True) 
@@ -82,11 +161,17 @@ class WorkerThread(threading.Thread):
                 self.parent.btn_create_signals.setEnabled(True)
 
             # write signals to DAQ
-            self.parent.send_signal()
+            with tracing.span("repetition", repetition=rep_counter+1):
+                self.parent.send_signal()
 
             # task closing handling
-            self.parent.task.wait_until_done(inf)
-            self.parent.task.close()
+            if not self.streamed: #streamed tasks are stopped by send_signal once all samples are generated
+                self.parent.task.wait_until_done(inf)
+            self.parent.control.repetition_ended()
+            if util.persistent_task:
+                self.parent.task.stop() # back to committed state, ready for the next repetition
+            else:
+                self.close_task()
 
             # handle button enabling/disabling after run
             self.parent.btn_update.setEnabled(False)
@@ -97,9 +182,17 @@ class WorkerThread(threading.Thread):
                 self.exit_repetitions = False
                 break
 
-        # reset status labels
-        self.parent.running = False
-        self.parent.run_status.setText("Ready")
-        self.parent.run_status.setStyleSheet("color: green; font-weight: bold;")
-        self.parent.run_status.setAlignment(Qt.AlignmentFlag.AlignRight)
-        self.parent.stim_selected() 
\ No newline at end of file
+    def close_task(self):
+        """
+        Description
+        -----------
+        Stops and closes the task, if any (also after a DAQ error)
+        """
+        task, self.parent.task = self.parent.task, None
+        if task is None:
+            return
+        try:
+            task.stop()
+        except Exception:
+            pass # (the error that aborted the task is reported once, by the operation that raised it)
+        task.close()
@@ -1,16 +1,15 @@
 """
 Description
 -----------
-Module for the creation of TBS control signals
+Module for the creation of TBS control signals (declared in protocols.py)
 
 Author
 ------
 Gregor Dederichs, EPFL School of Life Sciences
 """
 
-import numpy as np
 import util
-import fbase
+import protocols
 
 def TBS_control(total_time = util.total_TBS_time,
          carrier_f = util.carrier_f,
@@ -18,7 +17,9 @@ def TBS_control(total_time = util.total_TBS_time,
          A2 = util.ampli2,
          ramp_up_time = util.ramp_up_time,
          ramp_down_time = util.ramp_down_time,
-         rampup = True):
+         rampup = True,
+         progress = None,
+         out = None):
     ''' 
     Description
     -----------
@@ -47,36 +48,23 @@ def TBS_control(total_time = util.total_TBS_time,
     rampup : bool
         True if rampup is to be included (eg. False for updating signal during stimulation)
 
+    progress : callable
+        called with the fraction of the signal created, may abort the creation (see segments.compose)
+
+    out : np.array
+        optional array (eg. a np.memmap) or writable buffer of shape (channels, samples) receiving the signals,
+        for signals larger than memory (number of samples: see protocols.plan)
+
     Returns
     -------
-    tuple[np.array, np.array]
-        the time points and the signals (eg. signal 1 is signals[0])
+    tuple[segments.TimeAxis, np.array]
+        the time points (computed on demand) and the signals (eg. signal 1 is signals[0])
     '''
-    dt = np.linspace(0,total_time, int(util.sampling_f*total_time))
-    # ========== RAMP UP ==========
-    if rampup:
-        signals = fbase.ramp(direction="up", carrier_f=carrier_f, ramp_time=ramp_up_time, A1_max=A1, A2_max=A2)
-    
-    # ======== MAIN SIGNAL ========
-    I1b = A1*np.cos(2*np.pi*carrier_f*dt)
-    I2b = A2*np.cos(2*np.pi*carrier_f*dt+np.pi)
-    if rampup:
-        signals = np.concatenate((signals, np.vstack((I1b,I2b))), axis=1)
-    else:
-        signals = np.vstack((I1b,I2b))
-
-    # ======== RAMP DOWN ========
-    down = fbase.ramp(direction="down", carrier_f=carrier_f, ramp_time=ramp_down_time, A1_max=A1, A2_max=A2)
-    signals = np.concatenate((signals,down),axis=1)
-
-    # adjust dt to include ramps
-    if rampup:
-        dt = np.linspace(0,total_time+ramp_up_time+ramp_down_time, int(util.sampling_f*(total_time+ramp_up_time+ramp_down_time)))
-    else:
-        dt = np.linspace(0,total_time+ramp_down_time, int(util.sampling_f*(total_time+ramp_down_time)))
+    params = _params(total_time, carrier_f, A1, A2, ramp_up_time, ramp_down_time)
+    return protocols.create("TBS_control", params, rampup, progress, out)
 
-    # add 100 zeros to offset spiking and update dt accordingly 
-    signals = np.concatenate((signals, np.zeros((2,100))), axis=1)
-    dt = np.concatenate((dt, dt[-1] + np.arange(0, 100) * dt[1]-dt[0]))
 
-    return dt, signals
\ No newline at end of file
+def _params(total_time, carrier_f, A1, A2, ramp_up_time, ramp_down_time):
+    """Parameters of a control signal, named as the fields of the GUI"""
+    return {"total_TBS_time": total_time, "carrier_f": carrier_f, "A1": A1,
+            "A2": A2, "ramp_up_time": ramp_up_time, "ramp_down_time": ramp_down_time}
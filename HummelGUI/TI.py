@@ -1,7 +1,7 @@
 """
 Description
 -----------
-Module for the creation of TI signals
+Module for the creation of TI signals (declared in protocols.py)
 
 Author
 ------
@@ -9,8 +9,7 @@ Gregor Dederichs, EPFL School of Life Sciences
 """
 
 import util
-import fbase
-import numpy as np
+import protocols
 
 def TI(total_time = util.total_TBS_time,
          shift_f = util.freq_of_pulse,
@@ -19,7 +18,9 @@ def TI(total_time = util.total_TBS_time,
          A2 = util.ampli2,
          ramp_up_time = util.ramp_up_time,
          ramp_down_time = util.ramp_down_time,
-         rampup = True):
+         rampup = True,
+         progress = None,
+         out = None):
     ''' 
     Description
     -----------
@@ -51,41 +52,24 @@ def TI(total_time = util.total_TBS_time,
     rampup : bool
         True if rampup is to be included (eg. False for updating signal during stimulation)
 
+    progress : callable
+        called with the fraction of the signal created, may abort the creation (see segments.compose)
+
+    out : np.array
+        optional array (eg. a np.memmap) or writable buffer of shape (channels, samples) receiving the signals,
+        for signals larger than memory (number of samples: see protocols.plan)
+
     Returns
     -------
-    tuple[np.array, np.array]
-        the time points and the signals (eg. signal 1 is signals[0])
+    tuple[segments.TimeAxis, np.array]
+        the time points (computed on demand) and the signals (eg. signal 1 is signals[0])
     '''
-    dt = np.linspace(0,total_time+ramp_down_time, int(util.sampling_f*(total_time+ramp_down_time)))
-    # ========== RAMP UP ==========
-    if rampup:
-        dt = np.linspace(0,total_time+ramp_up_time+ramp_down_time, int(util.sampling_f*(total_time+ramp_up_time+ramp_down_time)))
-        signals = fbase.ramp(direction="up", carrier_f=carrier_f, ramp_time=ramp_up_time, A1_max=A1, A2_max=A2)
-
-    # ======== MAIN SIGNAL ========
-    f1 = carrier_f
-    f2 = f1 + shift_f
-
-    main_dt = np.linspace(0,total_time,int(util.sampling_f*total_time))
-
-    main_I1 = A1*np.cos(2*np.pi*f1*main_dt)
-    main_I2 = A2*np.cos(2*np.pi*f2*main_dt+np.pi)
-
-    main_sig = np.vstack((main_I1,main_I2))
-
-    if rampup:
-        #concatenate to ramp
-        signals = np.concatenate((signals, main_sig), axis=1)
-    else:
-        #if no ramp, first_sig is the beginning of the signal
-        signals = main_sig
-
-    # ======== RAMP DOWN ========
-    down = fbase.ramp(direction="down", carrier_f=carrier_f, ramp_time=ramp_down_time, A1_max=A1, A2_max=A2)
-    signals = np.concatenate((signals,down),axis=1)
+    params = _params(total_time, shift_f, carrier_f, A1, A2, ramp_up_time, ramp_down_time)
+    return protocols.create("TI", params, rampup, progress, out)
 
-    # add 100 zeros to offset spiking and update dt accordingly 
-    signals = np.concatenate((signals, np.zeros((2,100))), axis=1)
-    dt = np.concatenate((dt, dt[-1] + np.arange(0, 100) * dt[1]-dt[0]))
 
-    return dt, signals
\ No newline at end of file
+def _params(total_time, shift_f, carrier_f, A1, A2, ramp_up_time, ramp_down_time):
+    """Parameters of a TI signal, named as the fields of the GUI (the shift is the pulse frequency field)"""
+    return {"total_TBS_time": total_time, "freq_of_pulse": shift_f, "carrier_f": carrier_f,
+            "A1": A1, "A2": A2, "ramp_up_time": ramp_up_time,
+            "ramp_down_time": ramp_down_time}
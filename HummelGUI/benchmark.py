@@ -0,0 +1,276 @@
+"""
+Description
+-----------
+Benchmarks the signal generators (fbase.TBS, fbase.ramp, iTBS, cTBS, TI, TBS_control) over
+session lengths, carrier frequencies and sampling rates, recording wall time, peak memory
+and bytes per output sample. Results are written to a JSON file, and can be compared to
+the results of a previous run (baseline) to catch regressions before a session day.
+The write cases (write.float64, write.float32, write.int16) measure instead the throughput of writing
+TI signals to a finite task of the fake DAQ (see fake_daq.py) in each sample format (see sample_format.py).
+
+Each case runs in a fresh process, so that peak memory of one case does not hide the next.
+
+Usage (from the HummelGUI folder):
+    python benchmark.py --output results.json
+    python benchmark.py --quick --baseline results.json
+    python benchmark.py --generators write.float64 write.float32 write.int16 --durations 60 300
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import util
+
+try:
+    import psutil
+except ImportError:
+    psutil = None # RSS is only reported if psutil is installed
+
+GENERATORS = ["fbase.TBS", "fbase.ramp", "iTBS", "cTBS", "TI", "TBS_control"]
+WRITERS = ["write.float64", "write.float32", "write.int16"] # (only run if selected)
+DURATIONS = [10, 60, 300, 900, 3600] # seconds, up to 60 minutes
+CARRIER_FS = [2000, 5000] # Hz
+SAMPLING_FS = [100000, 50000] # Hz
+QUICK = {"durations": [10, 60], "carrier_fs": [util.carrier_f], "sampling_fs": [util.sampling_f]}
+
+
+def _generator(name, duration, carrier_f):
+    """Returns a function creating the signals of a generator for a duration (s) and carrier frequency (Hz)"""
+    import fbase
+    import iTBS
+    import cTBS
+    import TI
+    import TBS_ctrl
+
+    if name == "fbase.TBS":
+        return lambda: fbase.TBS(high_f=carrier_f, duration=duration)
+    elif name == "fbase.ramp":
+        return lambda: fbase.ramp(carrier_f=carrier_f, ramp_time=duration)
+    elif name == "iTBS":
+        return lambda: iTBS.iTBS(total_time=duration, carrier_f=carrier_f)
+    elif name == "cTBS":
+        return lambda: cTBS.cTBS(total_time=duration, carrier_f=carrier_f)
+    elif name == "TI":
+        return lambda: TI.TI(total_time=duration, carrier_f=carrier_f)
+    elif name == "TBS_control":
+        return lambda: TBS_ctrl.TBS_control(total_time=duration, carrier_f=carrier_f)
+    raise ValueError(f"unknown generator '{name}'")
+
+
+def _writer(name, duration, carrier_f):
+    """
+    Returns a function writing TI signals for a duration (s) and carrier frequency (Hz) to a new finite task
+    of the fake DAQ, in the sample format of the case (signals created beforehand, stored in that format)
+    """
+    import TI
+    import daq
+    import channels
+    import sample_format
+    from nidaqmx.constants import AcquisitionType
+
+    fmt = name.split(".")[1]
+    util.daq_backend = "fake"
+    util.sample_format = fmt # read by the generators at call time (float32 storage for "int16")
+    signals = TI.TI(total_time=duration, carrier_f=carrier_f)[1]
+
+    def write():
+        with daq.new_task() as task:
+            for channel in channels.layout().names:
+                task.ao_channels.add_ao_voltage_chan(channel)
+            task.timing.cfg_samp_clk_timing(rate=util.sampling_f, sample_mode=AcquisitionType.FINITE, samps_per_chan=np.shape(signals)[1])
+            sample_format.SampleWriter(task, sample_format=fmt).write(signals)
+        return signals
+    return write
+
+
+def _rss():
+    """Current and peak resident memory of this process in bytes (None if unavailable)"""
+    if psutil is None:
+        return None, None
+    info = psutil.Process().memory_info()
+    peak = getattr(info, "peak_wset", None) # Windows
+    if peak is None:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak *= 1 if sys.platform == "darwin" else 1024 # bytes on macOS, kB on Linux
+        except ImportError:
+            pass
+    return info.rss, peak
+
+
+def run_case(case):
+    """
+    Description
+    -----------
+    Runs one benchmark case (to be called in a fresh process)
+
+    Parameters
+    ----------
+    case : dict
+        generator, duration (s), carrier_f (Hz), sampling_f (Hz) and repeats
+
+    Returns
+    -------
+    dict
+        the case, completed with its measurements (or an error)
+    """
+    result = dict(case)
+    util.sampling_f = case["sampling_f"] # read by the generators at call time
+    try:
+        make = _writer if case["generator"] in WRITERS else _generator
+        generate = make(case["generator"], case["duration"], case["carrier_f"])
+
+        # memory: one traced run
+        rss_before, _ = _rss()
+        tracemalloc.start()
+        output = generate()
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        _, rss_peak = _rss()
+
+        arrays = output if isinstance(output, tuple) else (output,)
+        samples = np.shape(arrays[-1])[1]
+        result["samples"] = samples
+        result["output_bytes"] = sum(a.nbytes for a in arrays) # (time axes hold no memory)
+        result["peak_traced_bytes"] = traced_peak
+        result["bytes_per_sample"] = traced_peak/max(samples, 1)
+        result["peak_rss_bytes"] = None if rss_peak is None else rss_peak - rss_before
+        del output, arrays
+
+        # wall time: best of untraced runs
+        times = []
+        for _ in range(case["repeats"]):
+            start = time.perf_counter()
+            generate()
+            times.append(time.perf_counter() - start)
+        result["wall_time"] = min(times)
+        result["wall_time_mean"] = sum(times)/len(times)
+        result["samples_per_second"] = samples/result["wall_time"] # (per channel)
+    except MemoryError:
+        result["error"] = "MemoryError"
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+    return result
+
+
+def case_key(result):
+    """Identifies a case across runs"""
+    return (result["generator"], result["duration"], result["carrier_f"], result["sampling_f"])
+
+
+def compare(results, baseline, time_tolerance=0.2, memory_tolerance=0.1):
+    """
+    Description
+    -----------
+    Compares results to a baseline run
+
+    Parameters
+    ----------
+    results : list[dict]
+        the results of this run
+
+    baseline : list[dict]
+        the results of the baseline run
+
+    time_tolerance : float
+        allowed relative increase of wall time
+
+    memory_tolerance : float
+        allowed relative increase of peak traced memory
+
+    Returns
+    -------
+    list[str]
+        descriptions of the regressions found (empty if none)
+    """
+    reference = {case_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        ref = reference.get(case_key(result))
+        if ref is None or "error" in ref:
+            continue
+        name = "{} duration={}s carrier={}Hz fs={}Hz".format(*case_key(result))
+        if "error" in result:
+            regressions.append(f"{name}: {result['error']}")
+            continue
+        for metric, tolerance in (("wall_time", time_tolerance), ("peak_traced_bytes", memory_tolerance)):
+            if result[metric] > ref[metric]*(1+tolerance):
+                regressions.append(f"{name}: {metric} {ref[metric]:.4g} -> {result[metric]:.4g} "
+                                   f"(+{100*(result[metric]/ref[metric]-1):.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the signal generators")
+    parser.add_argument("--generators", nargs="+", default=GENERATORS, choices=GENERATORS+WRITERS,
+                        help="generators, or sample formats written to the fake DAQ (write.*)")
+    parser.add_argument("--durations", nargs="+", type=float, default=None, help="session lengths in seconds")
+    parser.add_argument("--carrier-fs", nargs="+", type=float, default=None, help="carrier frequencies in Hz")
+    parser.add_argument("--sampling-fs", nargs="+", type=int, default=None, help="sampling rates in Hz")
+    parser.add_argument("--quick", action="store_true", help="short sessions at the default frequencies only")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per case (best is kept)")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file receiving the results")
+    parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare with")
+    parser.add_argument("--time-tolerance", type=float, default=0.2)
+    parser.add_argument("--memory-tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    sweep = QUICK if args.quick else {"durations": DURATIONS, "carrier_fs": CARRIER_FS, "sampling_fs": SAMPLING_FS}
+    durations = args.durations or sweep["durations"]
+    carrier_fs = args.carrier_fs or sweep["carrier_fs"]
+    sampling_fs = args.sampling_fs or sweep["sampling_fs"]
+    cases = [{"generator": g, "duration": d, "carrier_f": c, "sampling_f": fs, "repeats": args.repeats}
+             for g in args.generators for fs in sampling_fs for c in carrier_fs for d in durations]
+
+    # one fresh process per case
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_case, cases):
+            results.append(result)
+            if "error" in result:
+                print("{:13} {:>7}s {:>6}Hz fs={:>6}Hz  {}".format(*case_key(result), result["error"]))
+            else:
+                print("{:13} {:>7}s {:>6}Hz fs={:>6}Hz  {:8.3f}s  {:9.1f}MB  {:6.1f}B/sample  {:7.1f}MS/s".format(
+                    *case_key(result), result["wall_time"], result["peak_traced_bytes"]/1e6, result["bytes_per_sample"],
+                    result["samples_per_second"]/1e6))
+
+    report = {"meta": {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+                       "python": platform.python_version(),
+                       "numpy": np.__version__,
+                       "platform": platform.platform(),
+                       "sample_format": util.sample_format,
+                       "oscillator": util.oscillator,
+                       "channels": len(util.channels)},
+              "results": results}
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            return 1
+        print(f"no regression against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
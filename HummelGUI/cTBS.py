@@ -1,7 +1,7 @@
 """
 Description
 -----------
-Module for the creation of cTBS signals
+Module for the creation of cTBS signals (declared in protocols.py)
 
 Author
 ------
@@ -9,8 +9,7 @@ Gregor Dederichs, EPFL School of Life Sciences
 """
 
 import util
-import fbase
-import numpy as np
+import protocols
 
 def cTBS(total_time = util.total_TBS_time,
          pulse_f = util.freq_of_pulse,
@@ -20,7 +19,9 @@ def cTBS(total_time = util.total_TBS_time,
          A2 = util.ampli2,
          ramp_up_time = util.ramp_up_time,
          ramp_down_time = util.ramp_down_time,
-         rampup = True):
+         rampup = True,
+         progress = None,
+         out = None):
     ''' 
     Description
     -----------
@@ -55,36 +56,24 @@ def cTBS(total_time = util.total_TBS_time,
     rampup : bool
         True if rampup is to be included (eg. False for updating signal during stimulation)
 
+    progress : callable
+        called with the fraction of the signal created, may abort the creation (see segments.compose)
+
+    out : np.array
+        optional array (eg. a np.memmap) or writable buffer of shape (channels, samples) receiving the signals,
+        for signals larger than memory (number of samples: see protocols.plan)
+
     Returns
     -------
-    tuple[np.array, np.array]
-        the time points and the signals (eg. signal 1 is signals[0])
+    tuple[segments.TimeAxis, np.array]
+        the time points (computed on demand) and the signals (eg. signal 1 is signals[0])
     '''
-    dt = np.linspace(0,total_time+ramp_down_time, int(util.sampling_f*(total_time+ramp_down_time)))
-    # ========== RAMP UP ==========
-    if rampup:
-        dt = np.linspace(0,total_time+ramp_up_time+ramp_down_time, int(util.sampling_f*(total_time+ramp_up_time+ramp_down_time)))
-        signals = fbase.ramp(direction="up", carrier_f=carrier_f, ramp_time=ramp_up_time, A1_max=A1, A2_max=A2)
-
-    # ======== MAIN SIGNAL ========
-    sig = fbase.TBS(high_f=carrier_f,
-                  pulse_f=pulse_f,
-                  burst_f=burst_f,
-                  duration=total_time,
-                  A1=A1, A2=A2)
-    if rampup:
-        #concatenate to ramp
-        signals = np.concatenate((signals, sig), axis=1)
-    else:
-        #if no ramp, first_sig is the beginning of the signal
-        signals = sig
-
-    # ======== RAMP DOWN ========
-    down = fbase.ramp(direction="down", carrier_f=carrier_f, ramp_time=ramp_down_time, A1_max=A1, A2_max=A2)
-    signals = np.concatenate((signals,down),axis=1)
+    params = _params(total_time, pulse_f, burst_f, carrier_f, A1, A2, ramp_up_time, ramp_down_time)
+    return protocols.create("cTBS", params, rampup, progress, out)
 
-    # add 100 zeros to offset spiking and update dt accordingly 
-    signals = np.concatenate((signals, np.zeros((2,100))), axis=1)
-    dt = np.concatenate((dt, dt[-1] + np.arange(0, 100) * dt[1]-dt[0]))
 
-    return dt, signals
\ No newline at end of file
+def _params(total_time, pulse_f, burst_f, carrier_f, A1, A2, ramp_up_time, ramp_down_time):
+    """Parameters of a cTBS signal, named as the fields of the GUI"""
+    return {"total_TBS_time": total_time, "freq_of_pulse": pulse_f, "burst_freq": burst_f,
+            "carrier_f": carrier_f, "A1": A1, "A2": A2,
+            "ramp_up_time": ramp_up_time, "ramp_down_time": ramp_down_time}
@@ -0,0 +1,235 @@
+"""
+Description
+-----------
+Module caching created waveforms, keyed on the complete set of stimulation parameters.
+Waveforms are kept in memory within a size budget (least recently used are evicted first),
+and optionally on disk as .npy files (signals) which are loaded back as memory maps, with the description
+of their time points (.json file, see segments.TimeAxis).
+Waveforms rendered ahead of a session (see prerender.py) are found in their own directory, never evicted.
+Large waveforms created directly in files (see util.memmap_min_bytes) are found in their own directory too
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+import util
+import segments
+
+
+def _nbytes(array):
+    """Bytes held in memory by an array (memory maps are backed by their file, time axes are computed)"""
+    if isinstance(array, (np.memmap, segments.TimeAxis)):
+        return 0
+    return np.asarray(array).nbytes
+
+
+def waveform_files(directory, key):
+    """
+    Description
+    -----------
+    Returns the paths of the files (time points, signals) of a waveform in a directory
+    """
+    name = hashlib.sha1(repr(key).encode()).hexdigest()
+    return (os.path.join(directory, name+"_time.json"),
+            os.path.join(directory, name+"_signals.npy"))
+
+
+def save_waveform(directory, key, dt, signals=None):
+    """
+    Description
+    -----------
+    Saves a waveform to files in a directory (created if needed): the description of its time points
+    (segments.TimeAxis), and its signals as a .npy file (None if already saved, eg. created in their file)
+    """
+    os.makedirs(directory, exist_ok=True)
+    time_file, signals_file = waveform_files(directory, key)
+    # write to temporary file first, so that no partial file is ever loaded
+    if signals is not None:
+        with open(signals_file+".tmp", "wb") as file:
+            np.save(file, np.asarray(signals))
+        os.replace(signals_file+".tmp", signals_file)
+    with open(time_file+".tmp", "w") as file:
+        json.dump({"duration": dt.duration, "n": dt.n, "zeros": dt.zeros, "start": dt.start, "rate": dt.rate}, file)
+    os.replace(time_file+".tmp", time_file)
+
+
+def load_waveform(directory, key):
+    """
+    Description
+    -----------
+    Loads a waveform saved in a directory, its signals as a memory map
+
+    Returns
+    -------
+    tuple[segments.TimeAxis, np.array]
+        the time points and the signals, or None if not found (or unreadable)
+    """
+    time_file, signals_file = waveform_files(directory, key)
+    if not (os.path.exists(time_file) and os.path.exists(signals_file)):
+        return None
+    try:
+        with open(time_file) as file:
+            dt = segments.TimeAxis(**json.load(file))
+        return (dt, np.load(signals_file, mmap_mode="r"))
+    except (OSError, ValueError, TypeError):
+        return None # unreadable files are regenerated
+
+
+class WaveformCache:
+    """
+    Description
+    -----------
+    Least recently used cache of waveforms (time points and signals), safe to use from several threads.
+    Cached arrays are shared, they must not be modified in place
+    """
+    def __init__(self, max_bytes=util.cache_max_bytes, directory=util.cache_dir, max_disk_bytes=util.cache_max_disk_bytes,
+                 prerendered=util.prerender_dir, files=util.memmap_dir):
+        """
+        Parameters
+        ----------
+        max_bytes : int
+            memory budget in bytes of the cache
+
+        directory : str
+            directory of the on-disk cache, relative to the working directory (empty to disable)
+
+        max_disk_bytes : int
+            disk budget in bytes of the on-disk cache
+
+        prerendered : str
+            directory of waveforms rendered ahead (see prerender.py), relative to the working directory (empty to disable)
+
+        files : str
+            directory of large waveforms created in files (see waveforms.job), relative to the working directory
+            (empty to disable); evicted as the on-disk cache
+        """
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.path = os.path.join(os.getcwd(), directory) if directory else None
+        self.prerendered = os.path.join(os.getcwd(), prerendered) if prerendered else None
+        self.files = os.path.join(os.getcwd(), files) if files else None
+        self.entries = OrderedDict() #key -> (dt, signals), most recently used last
+        self.size = 0
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        """
+        Description
+        -----------
+        Returns the cached waveform for key, or None if not cached
+
+        Parameters
+        ----------
+        key : tuple
+            the stimulation type and all parameters defining the waveform
+
+        Returns
+        -------
+        tuple[segments.TimeAxis, np.array]
+            the time points and the signals (eg. signal 1 is signals[0])
+        """
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+            # on-disk cache
+            if self.path is not None:
+                entry = load_waveform(self.path, key)
+                if entry is not None:
+                    os.utime(waveform_files(self.path, key)[1]) # most recently used files are evicted last
+                    self._store(key, entry)
+                    return entry
+
+            # created in files
+            if self.files is not None:
+                entry = load_waveform(self.files, key)
+                if entry is not None:
+                    os.utime(waveform_files(self.files, key)[1])
+                    self._store(key, entry)
+                    return entry
+
+            # rendered ahead
+            if self.prerendered is not None:
+                entry = load_waveform(self.prerendered, key)
+                if entry is not None:
+                    self._store(key, entry)
+                    return entry
+            return None
+
+    def put(self, key, dt, signals):
+        """
+        Description
+        -----------
+        Adds a waveform to the cache, evicting least recently used waveforms if needed
+
+        Parameters
+        ----------
+        key : tuple
+            the stimulation type and all parameters defining the waveform
+
+        dt : segments.TimeAxis
+            the time points
+
+        signals : np.array
+            the signals (eg. signal 1 is signals[0])
+        """
+        with self._lock:
+            self._store(key, (dt, signals))
+            if isinstance(signals, np.memmap):
+                # already in a file (created in files, or loaded from disk)
+                if self.files is not None and os.path.dirname(signals.filename) == os.path.normpath(self.files):
+                    self._evict_disk(self.files)
+            elif self.path is not None:
+                self._save(key, dt, signals)
+
+    def clear(self):
+        """
+        Description
+        -----------
+        Empties the in-memory cache (the on-disk cache is kept)
+        """
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _store(self, key, entry):
+        if key in self.entries:
+            self.size -= sum(_nbytes(a) for a in self.entries.pop(key))
+        nbytes = sum(_nbytes(a) for a in entry)
+        if nbytes > self.max_bytes:
+            return # never keep a single waveform larger than the budget
+        self.entries[key] = entry
+        self.size += nbytes
+        while self.size > self.max_bytes:
+            _, old = self.entries.popitem(last=False)
+            self.size -= sum(_nbytes(a) for a in old)
+
+    def _save(self, key, dt, signals):
+        save_waveform(self.path, key, dt, signals)
+        self._evict_disk(self.path)
+
+    def _evict_disk(self, directory):
+        files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith("_signals.npy")]
+        files.sort(key=os.path.getmtime)
+        sizes = {f: os.path.getsize(f) + os.path.getsize(f[:-len("_signals.npy")]+"_time.json")
+                 for f in files if os.path.exists(f[:-len("_signals.npy")]+"_time.json")}
+        total = sum(sizes.values())
+        for signals_file in files:
+            if total <= self.max_disk_bytes:
+                break
+            time_file = signals_file[:-len("_signals.npy")]+"_time.json"
+            total -= sizes.get(signals_file, 0)
+            for f in (signals_file, time_file):
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass # missing, or still memory mapped (Windows)
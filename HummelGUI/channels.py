@@ -0,0 +1,102 @@
+"""
+Description
+-----------
+Module describing the output channels (see util.channels): the physical channels, possibly on several devices,
+and the carrier each of them outputs, as a signal of the stimulation (1 or 2) with its own phase and gain.
+Generators create all channels in one pass, from per-channel vectors of frequencies, phases and amplitudes
+broadcast over the time points, so that several stimulator pairs (eg. multipolar TI) are driven at once.
+
+The default layout is the original one: signal 1 on ao0, signal 2 (shifted by pi) on ao1
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import functools
+import numpy as np
+
+import util
+
+
+class Layout:
+    """
+    Description
+    -----------
+    Output channels and the carrier of each channel. Vectors have one row per channel,
+    so that they broadcast over time points (shape (channels, samples))
+    """
+    def __init__(self, names, signals, phases, gains, device=None):
+        """
+        Parameters
+        ----------
+        names : list[str]
+            the physical channels, eg. "ao0" (on device) or "Dev5/ao0" (on another device)
+
+        signals : list[int]
+            the signal output by each channel: 1 (frequency f1, amplitude A1) or 2 (frequency f2, amplitude A2)
+
+        phases : list[float]
+            the phase in radians of each channel
+
+        gains : list[float]
+            the factor applied to the amplitude of each channel
+
+        device : str
+            the device of channels given without one (default: util.device)
+        """
+        device = util.device if device is None else device
+        if not len(names) == len(signals) == len(phases) == len(gains):
+            raise ValueError("util.channels, channel_signals, channel_phases and channel_gains should have the same length")
+        if not names:
+            raise ValueError("util.channels should contain at least one channel")
+        if any(signal not in (1, 2) for signal in signals):
+            raise ValueError("util.channel_signals should only contain 1 or 2")
+        self.names = [name if "/" in name else device+"/"+name for name in names]
+        self.devices = list(dict.fromkeys(name.split("/")[0] for name in self.names)) # in order of first channel
+        self.signal1 = (np.asarray(signals) == 1)[:, np.newaxis]
+        self.phases = np.asarray(phases, dtype=float)[:, np.newaxis]
+        self.gains = np.asarray(gains, dtype=float)[:, np.newaxis]
+        self.key = (tuple(self.names), tuple(signals), tuple(phases), tuple(gains))
+
+    def __len__(self):
+        return len(self.names)
+
+    def frequencies(self, f1, f2):
+        """Frequency of each channel (shape (channels, 1))"""
+        return np.where(self.signal1, float(f1), float(f2))
+
+    def amplitudes(self, A1, A2):
+        """
+        Description
+        -----------
+        Amplitude of each channel, of shape (channels, 1) for constant amplitudes,
+        or (channels, samples) for envelopes (A1 and A2 being arrays)
+        """
+        if np.ndim(A1) == 0 and np.ndim(A2) == 0:
+            return np.where(self.signal1, float(A1), float(A2))*self.gains
+        return np.where(self.signal1, np.asarray(A1, dtype=float), np.asarray(A2, dtype=float))*self.gains
+
+    def trigger_source(self):
+        """Start trigger line (PFI0) of the first device, shared by all channels of the task"""
+        return "/"+self.devices[0]+"/PFI0"
+
+
+@functools.lru_cache(maxsize=8)
+def _layout(names, signals, phases, gains, device):
+    return Layout(list(names), list(signals), list(phases), list(gains), device)
+
+
+def layout():
+    """
+    Description
+    -----------
+    Returns the layout of the current settings (see util.channels), created once per setting
+    """
+    return _layout(tuple(util.channels), tuple(util.channel_signals), tuple(util.channel_phases),
+                   tuple(util.channel_gains), util.device)
+
+
+def count():
+    """Number of output channels"""
+    return len(layout())
@@ -0,0 +1,204 @@
+"""
+Description
+-----------
+Module for the control channel between the GUI and the worker thread running stimulations.
+The worker blocks until either the task is done or the experimenter requests an update or stop,
+instead of continuously polling the DAQ
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import threading
+import time
+
+import util
+
+# commands and events returned by StimulationControl.wait()
+UPDATE = "update"
+STOP = "stop"
+DONE = "done"
+
+
+class StimulationControl:
+    """
+    Description
+    -----------
+    Thread-safe channel carrying update/stop requests from the GUI and task completion from the DAQ.
+    Also measures the reaction latency, from a request to the DAQ running the corresponding signal
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._command = None #pending command
+        self._requested_at = None
+        self._handling = None #(command, request time) being handled by the worker
+        self._task_done = False
+        self.latencies = {UPDATE: [], STOP: []} #seconds from request to DAQ restart
+        self.switch_latencies = [] #samples generated from the handling of a hot-swap until the new signals play (creation, then write-ahead window)
+        self.setup_times = [] #seconds spent creating/configuring the task of each repetition
+        self.repetition_gaps = [] #seconds from the end of a repetition to the start of the next one
+        self._ended_at = None
+
+    def request_update(self):
+        """
+        Description
+        -----------
+        Requests an update of the running stimulation (ignored if a stop is already requested)
+        """
+        with self._condition:
+            if self._command != STOP:
+                self._command = UPDATE
+                self._requested_at = time.perf_counter()
+            self._condition.notify_all()
+
+    def request_stop(self):
+        """
+        Description
+        -----------
+        Requests the stop (ramp-down) of the running stimulation
+        """
+        with self._condition:
+            if self._command != STOP:
+                self._command = STOP
+                self._requested_at = time.perf_counter()
+            self._condition.notify_all()
+
+    def done_callback(self, task_handle, status, callback_data):
+        """
+        Description
+        -----------
+        Callback for nidaqmx.Task.register_done_event, wakes up the worker when the task is done
+        """
+        with self._condition:
+            self._task_done = True
+            self._condition.notify_all()
+        return 0
+
+    def command(self):
+        """
+        Description
+        -----------
+        Returns the pending command (UPDATE, STOP or None), without blocking
+        """
+        with self._condition:
+            return self._command
+
+    def wait(self, timeout=util.control_timeout):
+        """
+        Description
+        -----------
+        Blocks until a command is requested or the task is done.
+        The task done event is consumed, so that it is reported once
+
+        Parameters
+        ----------
+        timeout : float
+            maximal time in seconds to wait (safety net if no done event is received)
+
+        Returns
+        -------
+        str
+            UPDATE, STOP, DONE, or None if the timeout expired
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._command is not None or self._task_done, timeout)
+            if self._command is not None:
+                return self._command
+            if self._task_done:
+                self._task_done = False
+                return DONE
+            return None
+
+    def begin(self, command):
+        """
+        Description
+        -----------
+        To be called by the worker when it starts handling the pending command.
+        Commands requested meanwhile (eg. stop during an update) remain pending
+
+        Parameters
+        ----------
+        command : str
+            UPDATE or STOP, as returned by wait() or command()
+        """
+        with self._condition:
+            if self._command == command:
+                self._handling = (command, self._requested_at)
+                self._command = None
+                self._requested_at = None
+
+    def handling(self):
+        """
+        Description
+        -----------
+        Returns the command being handled by the worker (UPDATE, STOP or None)
+        """
+        with self._condition:
+            return None if self._handling is None else self._handling[0]
+
+    def task_started(self, late=0.0):
+        """
+        Description
+        -----------
+        To be called once the DAQ runs a new signal: acknowledges the command being handled
+        and records its reaction latency
+
+        Parameters
+        ----------
+        late : float
+            time in seconds since the DAQ started the new signal (eg. hot-swapped signals, noticed between chunks)
+        """
+        with self._condition:
+            if self._handling is not None:
+                command, requested_at = self._handling
+                self.latencies[command].append(time.perf_counter()-late-requested_at)
+            if self._ended_at is not None:
+                self.repetition_gaps.append(time.perf_counter()-self._ended_at)
+            self._handling = None
+            self._ended_at = None
+            self._task_done = False
+
+    def repetition_ended(self):
+        """
+        Description
+        -----------
+        To be called by the worker once a repetition is over, to measure the gap until the next one starts
+        """
+        with self._condition:
+            self._ended_at = time.perf_counter()
+
+    def reset(self):
+        """
+        Description
+        -----------
+        Discards pending commands and events (eg. before a new stimulation)
+        """
+        with self._condition:
+            self._command = None
+            self._requested_at = None
+            self._handling = None
+            self._ended_at = None
+            self._task_done = False
+
+    def latency_stats(self):
+        """
+        Description
+        -----------
+        Summarises measured reaction latencies
+
+        Returns
+        -------
+        dict
+            for UPDATE and STOP: number of requests, mean and maximal latency in seconds;
+            for "switch": number of hot-swaps, mean and maximal switch-over latency in samples
+            (from the handling of the request until the new signals play, including the write-ahead window);
+            for "setup" and "repetition_gap": number, mean and maximal time in seconds
+        """
+        with self._condition:
+            latencies = dict(self.latencies, switch=self.switch_latencies,
+                             setup=self.setup_times, repetition_gap=self.repetition_gaps)
+            return {command: {"count": len(values),
+                              "mean": sum(values)/len(values) if values else None,
+                              "max": max(values) if values else None}
+                    for command, values in latencies.items()}
@@ -0,0 +1,72 @@
+"""
+Description
+-----------
+Module selecting the DAQ backend (see util.daq_backend): the nidaqmx driver,
+or the in-process fake DAQ (see fake_daq.py) for testing and benchmarking without hardware.
+Tasks, stream writers and readers are created here; both backends share the nidaqmx constants and errors
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import util
+
+
+def _fake():
+    """Checks whether the fake backend is selected"""
+    if util.daq_backend not in ("nidaqmx", "fake"):
+        raise ValueError("util.daq_backend should be either 'nidaqmx' or 'fake'")
+    return util.daq_backend == "fake"
+
+
+def new_task():
+    """
+    Description
+    -----------
+    Creates a new task on the selected backend
+    """
+    if _fake():
+        import fake_daq
+        return fake_daq.Task()
+    import nidaqmx
+    return nidaqmx.Task()
+
+
+def multi_channel_writer(task):
+    """
+    Description
+    -----------
+    Returns a writer of voltages (float64) to all channels of a task, without auto-start
+    """
+    if _fake():
+        from fake_daq import AnalogMultiChannelWriter
+    else:
+        from nidaqmx.stream_writers import AnalogMultiChannelWriter
+    return AnalogMultiChannelWriter(task.out_stream, auto_start=False)
+
+
+def unscaled_writer(task):
+    """
+    Description
+    -----------
+    Returns a writer of device-native codes (int16) to all channels of a task, without auto-start
+    """
+    if _fake():
+        from fake_daq import AnalogUnscaledWriter
+    else:
+        from nidaqmx.stream_writers import AnalogUnscaledWriter
+    return AnalogUnscaledWriter(task.out_stream, auto_start=False)
+
+
+def multi_channel_reader(task):
+    """
+    Description
+    -----------
+    Returns a reader of voltages (float64) from all channels of an input task
+    """
+    if _fake():
+        from fake_daq import AnalogMultiChannelReader
+    else:
+        from nidaqmx.stream_readers import AnalogMultiChannelReader
+    return AnalogMultiChannelReader(task.in_stream)
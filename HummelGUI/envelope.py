@@ -0,0 +1,174 @@
+"""
+Description
+-----------
+Envelopes applied in place to carriers (eg. the ramps starting and ending stimulations, see segments.Ramp):
+the carrier is written at full amplitude into the output buffer, then multiplied in place by a view of
+a precomputed table of the envelope, without any temporary array.
+
+Shapes (see util.ramp_shape) rise from 0 to the amplitude over the ramp (ramps down are the same tables, reversed):
+    - "linear": np.linspace(0, amplitude, n), as the original ramps (bit-identical)
+    - "raised_cosine": (1-cos(pi*x))/2, with no step in slope at the start and end of the ramp
+    - "exponential": (exp(k*x)-1)/(exp(k)-1), with k = util.ramp_exp_rate
+    - piecewise-linear: points ((time fraction, amplitude fraction), ...), eg. ((0, 0), (0.5, 0.2), (1, 1))
+
+Tables are computed once per shape, length, amplitude and channel gain, and shared (read-only) by all ramps
+using them (eg. the ramp-down of each repetition, of each update and of each stop), the least recently used
+being discarded beyond util.envelope_cache_bytes. Smoother shapes cost the same as linear ramps once computed
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import threading
+from collections import OrderedDict
+import numpy as np
+
+import util
+
+SHAPES = ("linear", "raised_cosine", "exponential") #named shapes (other shapes: piecewise-linear points)
+
+_tables = OrderedDict() #key -> read-only table, most recently used last
+_size = 0
+_lock = threading.Lock()
+
+
+def shape(spec):
+    """
+    Description
+    -----------
+    Returns a shape as used by the tables (named shape, or piecewise-linear points as a tuple of pairs)
+    """
+    if isinstance(spec, str):
+        if spec not in SHAPES:
+            raise ValueError("ramp shape should be one of {} or piecewise-linear points, not {!r}".format(SHAPES, spec))
+        return spec
+    points = tuple((float(x), float(y)) for x, y in spec)
+    xs = [x for x, _ in points]
+    if len(points) < 2 or xs[0] != 0 or xs[-1] != 1 or any(b < a for a, b in zip(xs, xs[1:])):
+        raise ValueError("piecewise-linear ramp shape should be points (x, y) with x increasing from 0 to 1")
+    return points
+
+
+def _cached(key, compute):
+    """Table of key, computed once (outside the lock) and kept within util.envelope_cache_bytes"""
+    global _size
+    with _lock:
+        if key in _tables:
+            _tables.move_to_end(key)
+            return _tables[key]
+    values = compute()
+    values.flags.writeable = False # (shared)
+    with _lock:
+        if key not in _tables:
+            _tables[key] = values
+            _size += values.nbytes
+            while _size > util.envelope_cache_bytes and len(_tables) > 1:
+                _, old = _tables.popitem(last=False)
+                _size -= old.nbytes
+        return _tables[key]
+
+
+def _unit(spec, n):
+    """Values of a shape from 0 to 1 at n points"""
+    x = np.linspace(0, 1, n)
+    if spec == "raised_cosine":
+        np.multiply(x, np.pi, out=x)
+        np.cos(x, out=x)
+        return np.multiply(np.subtract(1, x, out=x), 0.5, out=x)
+    if spec == "exponential":
+        k = util.ramp_exp_rate
+        np.multiply(x, k, out=x)
+        np.expm1(x, out=x)
+        return np.divide(x, np.expm1(k), out=x)
+    if spec == "linear":
+        return x
+    xs, ys = zip(*spec)
+    return np.interp(x, xs, ys)
+
+
+def table(spec, n, peak, gain=1.0):
+    """
+    Description
+    -----------
+    Returns the table (read-only, shared) of a ramp from 0 to peak in n samples, times the gain of a channel
+
+    Parameters
+    ----------
+    spec : str or tuple
+        the shape (see shape())
+
+    n : int
+        number of samples of the ramp
+
+    peak : float
+        the amplitude reached at the end of the ramp
+
+    gain : float
+        the factor applied to the amplitude of the channel (see channels.py)
+    """
+    def compute():
+        if spec == "linear":
+            values = np.linspace(0, peak, n) # (as the original ramps)
+        else:
+            values = np.multiply(_unit(spec, n), peak)
+        np.multiply(values, gain, out=values)
+        return values
+    return _cached((spec, int(n), float(peak), float(gain)), compute)
+
+
+def times(duration, n):
+    """
+    Description
+    -----------
+    Returns the time points np.linspace(0, duration, n) (read-only, shared), eg. of the carrier of ramps
+    """
+    return _cached(("times", float(duration), int(n)), lambda: np.linspace(0, duration, n))
+
+
+def views(spec, n, peaks, gains, start, stop, reverse=False):
+    """
+    Description
+    -----------
+    Returns the samples [start, stop) of the envelope of each channel, as views of the tables
+
+    Parameters
+    ----------
+    spec : str or tuple
+        the shape (see shape())
+
+    n : int
+        number of samples of the ramp
+
+    peaks : list[float]
+        the amplitude of each channel at the end of the ramp
+
+    gains : list[float]
+        the gain of each channel
+
+    start, stop : int
+        the range of samples
+
+    reverse : bool
+        True for a ramp down (the table read backwards)
+
+    Returns
+    -------
+    list[np.array]
+        one view per channel
+    """
+    envelopes = []
+    for peak, gain in zip(peaks, gains):
+        values = table(spec, n, peak, gain)
+        envelopes.append((values[::-1] if reverse else values)[start:stop])
+    return envelopes
+
+
+def apply(out, envelopes):
+    """
+    Description
+    -----------
+    Multiplies each channel of out (shape (channels, samples)) in place by its envelope
+    """
+    for channel, values in zip(out, envelopes):
+        np.multiply(channel, values, out=channel)
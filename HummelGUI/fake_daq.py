@@ -0,0 +1,638 @@
+"""
+Description
+-----------
+In-process stand-in for an NI DAQ and the parts of the nidaqmx API used by the GUI
+(select it with daq_backend = "fake" in util.py). It models the sample clock, the on-board
+output buffer (FIFO), the start trigger on PFI0, task completion and its done event, with a
+virtual clock that can be fast-forwarded (see util.fake_daq_speed), so that the stimulation path
+can be run and timed on any computer, and whole sessions can be simulated in seconds.
+
+Generation events (start of output, end of output, underflows...) are recorded in 'events',
+from which the gaps in the output (eg. between repetitions or on update) can be measured.
+
+Tasks with analog input channels acquire the samples generated by the running output task (loopback:
+input channel i reads output channel i), as inputs clocked by the output sample clock (see monitor.py)
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import threading
+import time
+import numpy as np
+from nidaqmx.constants import AcquisitionType
+from nidaqmx.constants import Edge
+from nidaqmx.constants import RegenerationMode
+from nidaqmx.errors import DaqError
+from nidaqmx.error_codes import DAQmxErrors
+
+import util
+
+
+class VirtualClock:
+    """
+    Description
+    -----------
+    Device time, elapsing 'speed' times faster than real time
+    """
+    def __init__(self, speed=util.fake_daq_speed):
+        self._lock = threading.Lock()
+        self._real0 = time.perf_counter()
+        self._virtual0 = 0.0
+        self.speed = speed
+
+    def now(self):
+        """Current virtual time in seconds"""
+        with self._lock:
+            return self._virtual0 + (time.perf_counter()-self._real0)*self.speed
+
+    def set_speed(self, speed):
+        """Changes the speed of the clock from now on (to be called while no task is running)"""
+        with self._lock:
+            real = time.perf_counter()
+            self._virtual0 += (real-self._real0)*self.speed
+            self._real0 = real
+            self.speed = speed
+
+    def real(self, seconds):
+        """Real time in seconds corresponding to a virtual duration"""
+        return max(seconds, 0)/self.speed
+
+    def sleep(self, seconds):
+        """Sleeps for a virtual duration"""
+        time.sleep(self.real(seconds))
+
+
+clock = VirtualClock()
+
+events = [] # (virtual time, task name, event, samples per channel generated)
+_events_lock = threading.Lock()
+write_stats = {"writes": 0, "samples": 0, "seconds": 0.0} # real time spent writing, excluding waits for buffer space
+_armed = [] # started tasks waiting for their start trigger
+_armed_lock = threading.Lock()
+_outputs = [] # started output tasks (most recent last), read back by input tasks
+_inputs = [] # started input tasks: samples written to outputs are recorded for them
+_outputs_lock = threading.Lock()
+
+
+def log(task_name, event, at=None, samples=0):
+    """Records a generation event (at the current virtual time, unless given)"""
+    with _events_lock:
+        events.append((clock.now() if at is None else at, task_name, event, samples))
+
+
+def reset_events():
+    """Discards recorded events and write statistics"""
+    with _events_lock:
+        events.clear()
+        write_stats.update(writes=0, samples=0, seconds=0.0)
+
+
+def output_gaps():
+    """
+    Description
+    -----------
+    Measures the interruptions of the output from recorded events
+
+    Returns
+    -------
+    list[dict]
+        for each restart of the output: the gap in seconds (virtual time) since the previous output ended,
+        and whether it happened within the same task (update/stop) or on a new task (repetition)
+    """
+    gaps = []
+    last_end, last_task = None, None
+    with _events_lock:
+        recorded = list(events)
+    for at, task_name, event, _ in recorded:
+        if event in ("done", "stop", "underflow") and task_name == last_task:
+            last_end = at
+        elif event == "generating":
+            if last_end is not None:
+                gaps.append({"gap": at-last_end, "same_task": task_name == last_task})
+            last_end, last_task = None, task_name
+    return gaps
+
+
+def send_trigger(source="/"+util.device+"/PFI0"):
+    """
+    Description
+    -----------
+    Sends a rising edge on a trigger line, starting the output of the tasks armed on it
+    (for util.fake_trigger_delay = None)
+    """
+    with _armed_lock:
+        armed = [task for task in _armed if task.triggers.start_trigger.dig_edge_src == source]
+        for task in armed:
+            _armed.remove(task)
+    for task in armed:
+        task._trigger(clock.now())
+
+
+class _AOChannel:
+    def __init__(self, name, min_val, max_val):
+        self.name = name
+        self.ao_min = min_val
+        self.ao_max = max_val
+        self.ao_resolution = 16.0
+        # volts to 16-bit codes over the output range
+        self.ao_dev_scaling_coeff = [0.0, 32768/max(abs(min_val), abs(max_val))]
+
+
+class _AOChannelCollection(list):
+    def add_ao_voltage_chan(self, physical_channel, name_to_assign_to_channel="", min_val=-10.0, max_val=10.0, **kwargs):
+        channel = _AOChannel(name_to_assign_to_channel or physical_channel, min_val, max_val)
+        self.append(channel)
+        return channel
+
+
+class _AIChannel:
+    def __init__(self, name, min_val, max_val):
+        self.name = name
+        self.ai_min = min_val
+        self.ai_max = max_val
+
+
+class _AIChannelCollection(list):
+    def add_ai_voltage_chan(self, physical_channel, name_to_assign_to_channel="", min_val=-10.0, max_val=10.0, **kwargs):
+        channel = _AIChannel(name_to_assign_to_channel or physical_channel, min_val, max_val)
+        self.append(channel)
+        return channel
+
+
+class _Timing:
+    def __init__(self, task):
+        self._task = task
+        self.samp_clk_rate = None
+        self.samp_clk_src = ""
+        self.samp_quant_samp_mode = AcquisitionType.FINITE
+        self.samp_quant_samp_per_chan = 0
+
+    def cfg_samp_clk_timing(self, rate, source="", active_edge=Edge.RISING, sample_mode=AcquisitionType.FINITE, samps_per_chan=1000):
+        with self._task._cond:
+            self._task._check_not_running()
+            self.samp_clk_rate = float(rate)
+            self.samp_clk_src = source
+            self.samp_quant_samp_mode = sample_mode
+            self.samp_quant_samp_per_chan = int(samps_per_chan)
+            self._task._reset_buffer()
+
+
+class _StartTrigger:
+    def __init__(self):
+        self.dig_edge_src = None
+        self.dig_edge_edge = None
+
+    def cfg_dig_edge_start_trig(self, trigger_source, trigger_edge=Edge.RISING):
+        self.dig_edge_src = trigger_source
+        self.dig_edge_edge = trigger_edge
+
+    def disable_start_trig(self):
+        self.dig_edge_src = None
+        self.dig_edge_edge = None
+
+
+class _Triggers:
+    def __init__(self):
+        self.start_trigger = _StartTrigger()
+
+
+class _OutStream:
+    def __init__(self, task):
+        self._task = task
+        self.regen_mode = RegenerationMode.ALLOW_REGENERATION
+        self.output_buf_size = 0 # 0: sized by the timing configuration
+
+    @property
+    def total_samp_per_chan_generated(self):
+        with self._task._cond:
+            return self._task._generated()
+
+    @property
+    def space_avail(self):
+        with self._task._cond:
+            return self._task._space()
+
+
+class _InStream:
+    def __init__(self, task):
+        self._task = task
+
+    @property
+    def avail_samp_per_chan(self):
+        with self._task._cond:
+            return self._task._available
+
+
+class _Acquisition(threading.Thread):
+    """
+    Description
+    -----------
+    Acquisition of an input task: samples generated by the most recently started output task are
+    read back from its buffer as they are generated, and the every-N-samples callback is called for each N
+    """
+    def __init__(self, task):
+        super().__init__(daemon=True)
+        self.task = task
+        self.running = True
+
+    def run(self):
+        task = self.task
+        source, consumed = None, 0
+        while self.running:
+            time.sleep(max(clock.real(task._every_n/task.timing.samp_clk_rate), 0.002))
+            with _outputs_lock:
+                output = _outputs[-1] if _outputs else None
+            if output is not source:
+                source, consumed = output, 0
+            if source is None:
+                continue
+            with source._cond:
+                generated = source._generated()
+                if generated < consumed: # restarted
+                    consumed = 0
+                if source._history is None or generated == consumed:
+                    consumed = generated
+                    continue
+                size = np.shape(source._history)[1]
+                index = np.arange(max(consumed, source._written-size), generated) % size # (older samples are overwritten)
+                data = np.zeros((len(task.ai_channels), len(index)))
+                count = min(len(task.ai_channels), len(source._history))
+                data[:count] = source._history[:count, index]
+                if source._history.dtype == np.int16: # device codes to volts
+                    data[:count] /= np.array([ch.ao_dev_scaling_coeff[1] for ch in source.ao_channels[:count]])[:, np.newaxis]
+            consumed = generated
+            with task._cond:
+                task._acquired.append(data)
+                task._available += np.shape(data)[1]
+                task._cond.notify_all()
+            while task._every_n_callback is not None and self.running:
+                with task._cond:
+                    if task._available - task._pending < task._every_n:
+                        break
+                    task._pending += task._every_n
+                task._every_n_callback(task.name, 1, task._every_n, None)
+
+
+class Task:
+    """
+    Description
+    -----------
+    Fake analog output task, with the interface of nidaqmx.Task used by the GUI
+    """
+    _count = 0
+
+    def __init__(self, new_task_name=""):
+        self.name = new_task_name or "_unnamedTask<{}>".format(Task._count)
+        Task._count += 1
+        self.ao_channels = _AOChannelCollection()
+        self.timing = _Timing(self)
+        self.triggers = _Triggers()
+        self.out_stream = _OutStream(self)
+        self.ai_channels = _AIChannelCollection()
+        self.in_stream = _InStream(self)
+        self._cond = threading.Condition()
+        self._running = False
+        self._stopped = False # stopped since the last write/start: the next ones start a new output
+        self._t0 = None # virtual time at which the output starts (None: waiting for trigger)
+        self._end = None # samples per channel generated when the output ended (stop, done or underflow)
+        self._written = 0 # samples per channel written since the buffer was reset
+        self._fifo = None
+        self._error = None
+        self._done_callback = None
+        self._timer = None
+        self._closed = False
+        self._history = None # output tasks: samples written, kept longer than the buffer for input tasks
+        self._acquisition = None # input tasks
+        self._acquired = [] # input tasks: samples acquired, not read yet
+        self._available = 0
+        self._pending = 0 # samples announced to the every-N-samples callback, not read yet
+        self._every_n = 1000
+        self._every_n_callback = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _check_not_running(self):
+        if self._closed:
+            raise DaqError("Task has been closed.", DAQmxErrors.INVALID_TASK, self.name)
+        if self._running:
+            raise DaqError("Specified operation cannot be performed while the task is running.", DAQmxErrors.UNKNOWN, self.name)
+
+    def _finite(self):
+        return self.timing.samp_quant_samp_mode == AcquisitionType.FINITE
+
+    def _buffer_size(self):
+        return self.out_stream.output_buf_size or self.timing.samp_quant_samp_per_chan
+
+    def _reset_buffer(self):
+        self._stopped = False
+        self._written = 0
+        self._end = None
+        self._error = None
+
+    def _generated(self):
+        """Samples per channel generated so far (to be called with the lock held)"""
+        if self._end is not None:
+            return self._end
+        if not self._running or self._t0 is None:
+            return 0
+        generated = max(int((clock.now()-self._t0)*self.timing.samp_clk_rate), 0)
+        if self._finite():
+            return min(generated, self.timing.samp_quant_samp_per_chan)
+        if self.out_stream.regen_mode == RegenerationMode.DONT_ALLOW_REGENERATION and generated > self._written:
+            # the output ran out of samples: the DAQ stops with an error
+            self._end = self._written
+            self._error = DaqError("Onboard device memory underflow. Not enough data was written to the device.",
+                                   DAQmxErrors.OUTPUT_FIFO_UNDERFLOW_2, self.name)
+            log(self.name, "underflow", self._t0 + self._written/self.timing.samp_clk_rate, self._end)
+            return self._end
+        return generated
+
+    def _done(self):
+        """Checks whether the output ended (to be called with the lock held)"""
+        generated = self._generated()
+        if not self._running or self._end is not None:
+            return True
+        return self._finite() and self._t0 is not None and generated >= self.timing.samp_quant_samp_per_chan
+
+    def _space(self):
+        """Samples per channel that can be written without blocking (to be called with the lock held)"""
+        if self._finite() or not self._running:
+            return self._buffer_size() - self._written
+        return self._buffer_size() - (self._written - self._generated())
+
+    def _trigger(self, at):
+        with self._cond:
+            if not self._running or self._t0 is not None:
+                return
+            self._t0 = at
+            log(self.name, "generating", at)
+            self._schedule_done()
+            self._cond.notify_all()
+
+    def _schedule_done(self):
+        """Fires the done event when a finite output ends (to be called with the lock held)"""
+        if self._finite():
+            end = self._t0 + self.timing.samp_quant_samp_per_chan/self.timing.samp_clk_rate
+            self._timer = threading.Timer(clock.real(end-clock.now()), self._fire_done, args=(self._t0,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _fire_done(self, t0):
+        end = t0 + self.timing.samp_quant_samp_per_chan/self.timing.samp_clk_rate
+        while clock.now() < end: # timers may fire slightly early
+            clock.sleep(end-clock.now())
+        with self._cond:
+            if not self._running or self._t0 != t0 or self._end is not None:
+                return
+            self._end = self.timing.samp_quant_samp_per_chan
+            log(self.name, "done", end, self._end)
+            callback = self._done_callback
+            self._cond.notify_all()
+        if callback is not None:
+            callback(self.name, 0, None)
+
+    def control(self, action):
+        """Task state transitions (eg. TaskMode.TASK_COMMIT); resources are always reserved by the fake DAQ"""
+        with self._cond:
+            if self._closed:
+                raise DaqError("Task has been closed.", DAQmxErrors.INVALID_TASK, self.name)
+            log(self.name, str(action.name).lower())
+
+    def register_done_event(self, callback_method):
+        """Registers callback_method(task_handle, status, callback_data), called when a finite output ends"""
+        self._done_callback = callback_method
+
+    def register_every_n_samples_acquired_into_buffer_event(self, sample_interval, callback_method):
+        """Registers callback_method(task_handle, event_type, number_of_samples, callback_data), called by input tasks"""
+        self._every_n = int(sample_interval)
+        self._every_n_callback = callback_method
+
+    def start(self):
+        if self.ai_channels:
+            with self._cond:
+                self._check_not_running()
+                self._running = True
+                self._acquired, self._available, self._pending = [], 0, 0
+                self._acquisition = _Acquisition(self)
+                log(self.name, "start")
+            with _outputs_lock:
+                _inputs.append(self)
+            self._acquisition.start()
+            return
+        with self._cond:
+            self._check_not_running()
+            if self.timing.samp_clk_rate is None:
+                raise DaqError("Sample clock timing is not configured.", DAQmxErrors.UNKNOWN, self.name)
+            if self._stopped:
+                # restarted without new data: a finite output regenerates the samples in the buffer
+                written = self._written if self._finite() and self.out_stream.regen_mode == RegenerationMode.ALLOW_REGENERATION else 0
+                self._reset_buffer()
+                self._written = written
+            self._running = True
+            self._t0 = None
+            log(self.name, "start")
+            if self.triggers.start_trigger.dig_edge_src is None:
+                self._t0 = clock.now()
+            elif util.fake_trigger_delay is not None:
+                self._t0 = clock.now() + util.fake_trigger_delay
+            if self._t0 is not None:
+                log(self.name, "generating", self._t0)
+                self._schedule_done()
+        with _outputs_lock:
+            _outputs.append(self)
+        if self._t0 is None:
+            with _armed_lock:
+                _armed.append(self)
+
+    def stop(self):
+        if self._acquisition is not None:
+            self._acquisition.running = False
+            if self._acquisition is not threading.current_thread():
+                self._acquisition.join()
+            self._acquisition = None
+            with _outputs_lock:
+                if self in _inputs:
+                    _inputs.remove(self)
+            with self._cond:
+                self._running = False
+            return
+        with _outputs_lock:
+            if self in _outputs:
+                _outputs.remove(self)
+        with self._cond:
+            if not self._running:
+                return
+            generated = self._generated()
+            if self._end is None:
+                log(self.name, "stop", samples=generated)
+            self._end = generated # still readable until the next output
+            self._running = False
+            self._stopped = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._cond.notify_all()
+        with _armed_lock:
+            if self in _armed:
+                _armed.remove(self)
+
+    def close(self):
+        self.stop()
+        with self._cond:
+            self._closed = True
+            self._fifo = None
+
+    def is_task_done(self):
+        with self._cond:
+            return self._done()
+
+    def wait_until_done(self, timeout=10.0):
+        """Blocks until the output ended, for at most timeout real seconds (-1: no limit)"""
+        deadline = None if timeout == -1 else time.perf_counter() + timeout
+        with self._cond:
+            while not self._done():
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    raise DaqError("Wait Until Done did not indicate all samples were generated within the timeout.",
+                                   DAQmxErrors.WAIT_UNTIL_DONE_DOES_NOT_INDICATE_DONE, self.name)
+                self._cond.wait(0.01 if remaining is None else min(remaining, 0.01))
+            if self._error is not None:
+                raise self._error
+
+    def write(self, data, auto_start=None, timeout=10.0):
+        """Writes voltages (any float array of shape (channels, samples)); starts the task if auto_start"""
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        written = self._write(data, timeout)
+        if auto_start or (auto_start is None and np.shape(data)[-1] == 1):
+            if not self._running:
+                self.start()
+        return written
+
+    def _write(self, data, timeout):
+        """Writes samples to the buffer, blocking until there is space (timeout in real seconds, -1: no limit)"""
+        data = data[np.newaxis] if data.ndim == 1 else data
+        if np.shape(data)[0] != len(self.ao_channels):
+            raise DaqError("Write cannot be performed, because the number of channels in the data does not match the number of channels in the task.",
+                           DAQmxErrors.WRITE_NUM_CHANS_MISMATCH, self.name)
+        n = np.shape(data)[1]
+        begin = time.perf_counter()
+        deadline = None if timeout == -1 else begin + timeout
+        waited = 0.0
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise DaqError("Task has been closed.", DAQmxErrors.INVALID_TASK, self.name)
+                if self._stopped:
+                    self._reset_buffer()
+                if self._error is not None:
+                    raise self._error
+                buffer_size = self._buffer_size()
+                space = self._space()
+                if n <= space:
+                    if self._fifo is None or np.shape(self._fifo) != (len(data), buffer_size) or self._fifo.dtype != data.dtype:
+                        self._fifo = np.empty((len(data), buffer_size), dtype=data.dtype)
+                    # ring buffer copy, as done by the driver
+                    start = self._written % buffer_size
+                    first = min(n, buffer_size-start)
+                    self._fifo[:, start:start+first] = data[:, :first]
+                    self._fifo[:, :n-first] = data[:, first:]
+                    if _inputs:
+                        self._record(data)
+                    self._written += n
+                    with _events_lock:
+                        write_stats["writes"] += 1
+                        write_stats["samples"] += n
+                        write_stats["seconds"] += time.perf_counter() - begin - waited
+                    return n
+                if self._finite() or not self._running or n > buffer_size:
+                    raise DaqError("Write cannot be performed because the buffer is too small for the data written.",
+                                   DAQmxErrors.SAMPLES_CAN_NOT_YET_BE_WRITTEN, self.name)
+                wait = (n-space)/self.timing.samp_clk_rate
+            if deadline is not None and time.perf_counter() + clock.real(wait) > deadline:
+                raise DaqError("Some or all of the samples to write could not be written to the buffer yet.",
+                               DAQmxErrors.SAMPLES_CAN_NOT_YET_BE_WRITTEN, self.name)
+            slept = time.perf_counter()
+            clock.sleep(wait)
+            waited += time.perf_counter() - slept
+
+
+    def _record(self, data):
+        """Records samples written for input tasks (to be called with the lock held, before counting them)"""
+        size = 2*self._buffer_size()
+        if self._history is None or np.shape(self._history) != (len(data), size) or self._history.dtype != data.dtype:
+            self._history = np.zeros((len(data), size), dtype=data.dtype)
+        n = np.shape(data)[1]
+        start = self._written % size
+        first = min(n, size-start)
+        self._history[:, start:start+first] = data[:, :first]
+        self._history[:, :n-first] = data[:, first:]
+
+
+class AnalogMultiChannelWriter:
+    """Fake of nidaqmx.stream_writers.AnalogMultiChannelWriter"""
+    def __init__(self, task_out_stream, auto_start=False):
+        self._task = task_out_stream._task
+        self.auto_start = auto_start
+
+    def write_many_sample(self, data, timeout=10.0):
+        if data.dtype != np.float64 or not data.flags.c_contiguous:
+            raise DaqError("Write cannot be performed, because the data is not a C-contiguous float64 array.",
+                           DAQmxErrors.UNKNOWN, self._task.name)
+        written = self._task._write(data, timeout)
+        if self.auto_start and not self._task._running:
+            self._task.start()
+        return written
+
+
+class AnalogMultiChannelReader:
+    """Fake of nidaqmx.stream_readers.AnalogMultiChannelReader"""
+    def __init__(self, task_in_stream):
+        self._task = task_in_stream._task
+
+    def read_many_sample(self, data, number_of_samples_per_channel, timeout=10.0):
+        """Reads samples acquired into data (float64 array of shape (channels, samples)), waiting at most timeout"""
+        task = self._task
+        n = int(number_of_samples_per_channel)
+        deadline = time.perf_counter() + timeout
+        with task._cond:
+            while task._available < n:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise DaqError("Some or all of the samples requested have not yet been acquired.",
+                                   DAQmxErrors.SAMPLES_NOT_YET_AVAILABLE, task.name)
+                task._cond.wait(remaining)
+            filled = 0
+            while filled < n:
+                block = task._acquired[0]
+                count = min(n-filled, np.shape(block)[1])
+                data[:, filled:filled+count] = block[:, :count]
+                if count == np.shape(block)[1]:
+                    task._acquired.pop(0)
+                else:
+                    task._acquired[0] = block[:, count:]
+                filled += count
+            task._available -= n
+            task._pending = max(task._pending-n, 0)
+        return n
+
+
+class AnalogUnscaledWriter:
+    """Fake of nidaqmx.stream_writers.AnalogUnscaledWriter"""
+    def __init__(self, task_out_stream, auto_start=False):
+        self._task = task_out_stream._task
+        self.auto_start = auto_start
+
+    def write_int16(self, data, timeout=10.0):
+        if data.dtype != np.int16 or not data.flags.c_contiguous:
+            raise DaqError("Write cannot be performed, because the data is not a C-contiguous int16 array.",
+                           DAQmxErrors.UNKNOWN, self._task.name)
+        written = self._task._write(data, timeout)
+        if self.auto_start and not self._task._running:
+            self._task.start()
+        return written
@@ -7,13 +7,10 @@ Author
 ------
 Gregor Dederichs, EPFL School of Life Sciences
 '''
-import os
-import pandas as pd
 import numpy as np
-from matplotlib import pyplot as plt
-from nidaqmx.constants import AcquisitionType
-from nidaqmx.constants import WAIT_INFINITELY as inf
 import util
+import segments
+import schedule
 
 
 
@@ -23,31 +20,20 @@ def get_subject_and_session_IDs(filename):
      Description
      -----------
      Reads an excel file containing subject IDs and returns the corresponding list
+     (the file is parsed once, then cached: see schedule.py)
 
      Parameters
      ----------
      filename : str
         name of the excel file in the same directory
     """
-    parent_dir = os.getcwd()
-    path = os.path.join(parent_dir,"HummelGUI", filename) 
-
-    # check path
-    if not os.path.exists(path):
-        raise ValueError("File not found")
-    else: # (if path exists)
-        try:
-            df = pd.read_excel(path)
-            df = df
-        except:
-            raise ValueError("File not readable")
-        
-        subj_IDs = df["Subj"].to_list()
-        subj_IDs.insert(0,"Select Subject ID")
-        sess_IDs = df.columns.to_list()[1:]
-        sess_IDs.insert(0, "Select Session ID")
+    sched = schedule.load(filename) # raises ValueError if not found or not readable (see schedule.py)
+    subj_IDs = list(sched.subjects)
+    subj_IDs.insert(0,"Select Subject ID")
+    sess_IDs = list(sched.sessions)
+    sess_IDs.insert(0, "Select Session ID")
 
-        return subj_IDs,sess_IDs
+    return subj_IDs,sess_IDs
 
 
 def TBS(high_f = util.carrier_f,
@@ -82,31 +68,8 @@ def TBS(high_f = util.carrier_f,
         amplitude in mA of signal 2
 
     """
-    cycle_t = 1/burst_f #related to cycle frequency
-    pulse_t = 3/pulse_f 
-    no_pulses = int(duration/cycle_t)
-    dt = np.linspace(0,duration,int(util.sampling_f*duration))
-    f1 = high_f
-    f2 = high_f + pulse_f
-
-    # Pulse
-    pulse_dt = np.linspace(0,pulse_t,int(util.sampling_f*pulse_t))
-    I1 = A1*np.cos(2*np.pi*f1*pulse_dt)
-    I2 = A2*np.cos(2*np.pi*f2*pulse_dt+np.pi)
-
-    # Break
-    break_dt = pulse_dt[-1] + np.linspace(1/util.sampling_f, cycle_t-pulse_t, int(util.sampling_f*(cycle_t-pulse_t)))
-    I1b = A1*np.cos(2*np.pi*f1*break_dt)
-    I2b = A2*np.cos(2*np.pi*f1*break_dt+np.pi) #with freq f1: no change
-
-    # One cycle
-    I1 = np.concatenate((I1, I1b))
-    I2 = np.concatenate((I2, I2b))
-    signals = np.vstack((I1,I2))
-
-    # Complete signal
-    signals = np.tile(signals, no_pulses)
-
+    # one cycle is computed, then repeated in place
+    signals = segments.compose([segments.TBSTrain(high_f, pulse_f, burst_f, duration, A1, A2)])
 
     return signals
 
@@ -116,11 +79,14 @@ def ramp(direction = "up",
         carrier_f = util.carrier_f,
         ramp_time = util.ramp_up_time,
         A1_max=util.ampli1,
-        A2_max=util.ampli2):
+        A2_max=util.ampli2,
+        rate=None,
+        shape=None):
         """
         Description
         -----------
-        Creates signals with no temporal interference, with linearly increasing/decreasing amplitudes (eg. notably used to start and finish stimulations)
+        Creates signals with no temporal interference, with increasing/decreasing amplitudes (eg. notably used to start and finish stimulations).
+        The amplitudes are applied in place from envelope tables shared across calls (see envelope.py)
         
         Parameters
         ----------
@@ -131,28 +97,18 @@ def ramp(direction = "up",
             the high frequency of signals
 
         ramp_time : int
-            the time in seconds of the linear change in amplitude
+            the time in seconds of the change in amplitude
 
         A1 : float
             the maximum amplitude of signal 1 in mA reached at the end of the ramp
 
         A2 : float
             the maximum amplitude of signal 2 in mA reached at the end of the ramp
+
+        rate : float
+            the sampling frequency in Hz (default: util.sampling_f)
+
+        shape : str or tuple
+            the shape of the ramp (see envelope.py; default: util.ramp_shape)
         """
-        # time space
-        dt = np.linspace(0,ramp_time,int(util.sampling_f*ramp_time))
-
-        # envelope of linear change
-        ramp1 = np.linspace(0,A1_max,int(util.sampling_f*ramp_time))
-        ramp2 = np.linspace(0,A2_max,int(util.sampling_f*ramp_time))
-        if direction=="down":
-            ramp1 = ramp1[::-1]
-            ramp2 = ramp2[::-1]
-        elif direction != "up":
-            raise ValueError("parameter 'direction' should be either 'up' or 'down' (case sensitive)")
-
-        # scale signals according to envelope
-        I1 = ramp1*np.cos(2*np.pi*carrier_f*dt)
-        I2 = ramp2*np.cos(2*np.pi*carrier_f*dt+np.pi)
-
-        return np.vstack((I1,I2))
\ No newline at end of file
+        return segments.compose([segments.Ramp(direction, carrier_f, ramp_time, A1_max, A2_max, rate, shape)])
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""
+Description
+-----------
+Module creating waveforms in the background, so that the GUI does not freeze on long protocols.
+A new request supersedes (and cancels) any creation still ongoing
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt6.QtCore import QObject, pyqtSignal
+
+import util
+import segments
+
+
+class WaveformGenerator(QObject):
+    """
+    Description
+    -----------
+    Runs waveform creations on a pool of worker threads, and reports to the GUI through Qt signals
+    (delivered in the GUI thread). Only the latest request is reported; older ones are cancelled
+    at the next segment of their signals
+    """
+    progress = pyqtSignal(int, float) #request id, fraction created
+    finished = pyqtSignal(int, object, object) #request id, key, (time points, signals)
+    failed = pyqtSignal(int, str) #request id, error message
+
+    def __init__(self, workers=util.generation_workers):
+        """
+        Parameters
+        ----------
+        workers : int
+            number of threads creating waveforms
+        """
+        super().__init__()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.latest = 0
+        self._lock = threading.Lock()
+
+    def submit(self, key, generate):
+        """
+        Description
+        -----------
+        Starts creating a waveform in the background, superseding previous requests
+
+        Parameters
+        ----------
+        key : tuple
+            identifies the waveform (eg. cache key), returned with the result
+
+        generate : callable
+            creates the waveform; called with a 'progress' keyword argument (see segments.compose)
+
+        Returns
+        -------
+        int
+            the id of the request
+        """
+        with self._lock:
+            self.latest += 1
+            request = self.latest
+        self.pool.submit(self._run, request, key, generate)
+        return request
+
+    def cancel(self):
+        """
+        Description
+        -----------
+        Cancels all ongoing requests
+        """
+        with self._lock:
+            self.latest += 1
+
+    def is_current(self, request):
+        """
+        Description
+        -----------
+        Checks whether a request is the latest one (ie. not superseded or cancelled)
+        """
+        with self._lock:
+            return request == self.latest
+
+    def _run(self, request, key, generate):
+        def report(fraction):
+            if not self.is_current(request):
+                raise segments.GenerationCancelled()
+            self.progress.emit(request, fraction)
+
+        try:
+            result = generate(progress=report)
+        except segments.GenerationCancelled:
+            return
+        except Exception as error:
+            self.failed.emit(request, str(error))
+            return
+        if self.is_current(request):
+            self.finished.emit(request, key, result)
@@ -1,16 +1,15 @@
 """
 Description
 -----------
-Module for the creation of iTBS signals
+Module for the creation of iTBS signals (declared in protocols.py)
 
 Author
 ------
 Gregor Dederichs, EPFL School of Life Sciences
 """
 
-import numpy as np
 import util
-import fbase
+import protocols
 
 def iTBS(total_time = util.total_TBS_time,
          stim_time = util.train_stim_time,
@@ -22,7 +21,9 @@ def iTBS(total_time = util.total_TBS_time,
          A2 = util.ampli2,
          ramp_up_time = util.ramp_up_time,
          ramp_down_time = util.ramp_down_time,
-         rampup = True):
+         rampup = True,
+         progress = None,
+         out = None):
     ''' 
     Description
     -----------
@@ -63,72 +64,25 @@ def iTBS(total_time = util.total_TBS_time,
     rampup : bool
         True if rampup is to be included (eg. False for updating signal during stimulation)
 
+    progress : callable
+        called with the fraction of the signal created, may abort the creation (see segments.compose)
+
+    out : np.array
+        optional array (eg. a np.memmap) or writable buffer of shape (channels, samples) receiving the signals,
+        for signals larger than memory (number of samples: see protocols.plan)
+
     Returns
     -------
-    tuple[np.array, np.array]
-        the time points and the signals (eg. signal 1 is signals[0])
+    tuple[segments.TimeAxis, np.array]
+        the time points (computed on demand) and the signals (eg. signal 1 is signals[0])
     '''
-    no_cycles = np.floor(total_time/(stim_time+break_time)-0.001)
-    dt = np.linspace(0,total_time+ramp_down_time, int(util.sampling_f*(total_time+ramp_down_time)))
-    break_dt = np.linspace(0, break_time, int(util.sampling_f*break_time))
-
-    # ========== RAMP UP ==========
-    if rampup:
-        dt = np.linspace(0,total_time+ramp_up_time+ramp_down_time, int(util.sampling_f*(total_time+ramp_up_time+ramp_down_time)))
-        signals = fbase.ramp(direction="up", carrier_f=carrier_f, ramp_time=ramp_up_time, A1_max=A1, A2_max=A2)
-
-    # ======== MAIN SIGNAL ========
-    first_sig = fbase.TBS(high_f=carrier_f,
-                       pulse_f=pulse_f,
-                       burst_f=burst_f,
-                       duration=stim_time,
-                       A1=A1,
-                       A2=A2)
-    if rampup:
-        #concatenate to ramp
-        signals = np.concatenate((signals, first_sig), axis=1)
-    else:
-        #if no ramp, first_sig is the beginning of the signal
-        signals=first_sig
-
-    #break has no difference in carrier frequencies
-    I1b = A1*np.cos(2*np.pi*carrier_f*break_dt)
-    I2b = A2*np.cos(2*np.pi*carrier_f*break_dt+np.pi)
-    signals = np.concatenate((signals, np.vstack((I1b,I2b))), axis=1)
-    
-    #remaining cycles
-    for i in np.arange(no_cycles):
-        #stim time
-        new = fbase.TBS(high_f=carrier_f,
-                       pulse_f=pulse_f,
-                       burst_f=burst_f,
-                       duration=stim_time,
-                       A1=A1,
-                       A2=A2)
-        signals = np.concatenate((signals, new), axis=1)
-        
-        #break time
-        if i!=no_cycles-1:
-            I1b = A1*np.cos(2*np.pi*carrier_f*break_dt)
-            I2b = A2*np.cos(2*np.pi*carrier_f*break_dt+np.pi)
-            signals = np.concatenate((signals, np.vstack((I1b,I2b))), axis=1)  
-        else: 
-            #last cycle needs special care to correctly fit time  
-            dt_dim = np.size(dt)-int(util.sampling_f*ramp_down_time)
-            sig_dim = np.shape(signals)[1]
-            # fill in remaining time
-            if dt_dim-sig_dim>0:
-                last_break_dt = np.arange(0, dt_dim-sig_dim) * (dt[1]-dt[0])
-                I1b = A1*np.cos(2*np.pi*carrier_f*last_break_dt)
-                I2b = A2*np.cos(2*np.pi*carrier_f*last_break_dt+np.pi)
-                signals = np.concatenate((signals, np.vstack((I1b,I2b))), axis=1)
-                
-    # ========= RAMP DOWN =========
-    down = fbase.ramp(direction="down", carrier_f=carrier_f, ramp_time=ramp_down_time, A1_max=A1, A2_max=A2)
-    signals = np.concatenate((signals, down), axis=1)
-    # add 100 zeros to offset spiking and update dt accordingly 
-    signals = np.concatenate((signals, np.zeros((2,100))), axis=1)
-    dt = np.concatenate((dt, dt[-1] + np.arange(0, 100) * dt[1]-dt[0]))
+    params = _params(total_time, stim_time, break_time, pulse_f, burst_f, carrier_f,
+                     A1, A2, ramp_up_time, ramp_down_time)
+    return protocols.create("iTBS", params, rampup, progress, out)
 
 
-    return dt, signals
\ No newline at end of file
+def _params(total_time, stim_time, break_time, pulse_f, burst_f, carrier_f, A1, A2, ramp_up_time, ramp_down_time):
+    """Parameters of an iTBS signal, named as the fields of the GUI"""
+    return {"total_TBS_time": total_time, "train_stim_time": stim_time, "train_break_time": break_time,
+            "freq_of_pulse": pulse_f, "burst_freq": burst_f, "carrier_f": carrier_f, "A1": A1, "A2": A2,
+            "ramp_up_time": ramp_up_time, "ramp_down_time": ramp_down_time}
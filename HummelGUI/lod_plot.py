@@ -0,0 +1,291 @@
+"""
+Description
+-----------
+Module for plotting long waveforms with a level of detail adapted to the view.
+The sum of signals is reduced once to a pyramid of minima/maxima, from which only
+as many points as there are pixels are drawn, whatever the length of the stimulation.
+Pyramids are built by the thread creating the signals (see with_pyramid), so that the GUI thread only draws
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import threading
+import weakref
+import numpy as np
+import pyqtgraph as pg
+
+import util
+
+
+class MinMaxPyramid:
+    """
+    Description
+    -----------
+    Minima and maxima of the sum of signals over blocks of samples, at increasingly coarse levels.
+    Level 0 holds blocks of 'base' samples, each following level groups 'factor' blocks of the previous one
+    """
+    def __init__(self, signals, base=util.plot_lod_base, factor=4, min_blocks=1000, chunk_size=2**20):
+        """
+        Parameters
+        ----------
+        signals : np.array
+            signals of shape (channels, samples) (eg. signal 1 is signals[0])
+
+        base : int
+            number of samples in the blocks of the finest level
+
+        factor : int
+            number of blocks of a level grouped into one block of the next level
+
+        min_blocks : int
+            levels are added until fewer blocks than this remain
+
+        chunk_size : int
+            samples summed at once, so that the summed signal is never stored entirely
+        """
+        self.n = np.shape(signals)[1]
+        chunk_size -= chunk_size % base
+        no_blocks = -(-self.n//base)
+        mins = np.empty(no_blocks)
+        maxs = np.empty(no_blocks)
+        for start in range(0, self.n, chunk_size):
+            summed = signals[:, start:start+chunk_size].sum(axis=0)
+            first = start//base
+            self._reduce(summed, base, mins, maxs, first)
+
+        self.levels = [(base, mins, maxs)] #(samples per block, minima, maxima)
+        block = base
+        while len(mins) > min_blocks:
+            block *= factor
+            coarse_mins = np.empty(-(-len(mins)//factor))
+            coarse_maxs = np.empty(len(coarse_mins))
+            self._reduce(mins, factor, coarse_mins, None, 0)
+            self._reduce(maxs, factor, None, coarse_maxs, 0)
+            mins, maxs = coarse_mins, coarse_maxs
+            self.levels.append((block, mins, maxs))
+
+    @staticmethod
+    def _reduce(values, size, mins, maxs, first):
+        """Stores minima/maxima of values over blocks of size (last block may be shorter) from index first"""
+        full = len(values)//size
+        blocks = values[:full*size].reshape(full, size)
+        if mins is not None:
+            mins[first:first+full] = blocks.min(axis=1)
+            if full*size < len(values):
+                mins[first+full] = values[full*size:].min()
+        if maxs is not None:
+            maxs[first:first+full] = blocks.max(axis=1)
+            if full*size < len(values):
+                maxs[first+full] = values[full*size:].max()
+
+    def bounds(self):
+        """Minimum and maximum of the sum of signals"""
+        _, mins, maxs = self.levels[-1]
+        return mins.min(), maxs.max()
+
+    def decimate(self, dt, signals, start, stop, width):
+        """
+        Description
+        -----------
+        Returns points to draw samples [start, stop) on width pixels.
+        Few samples are returned as is; otherwise minima and maxima of blocks are interleaved,
+        so that drawn lines cover the full amplitude of the signal at each pixel
+
+        Parameters
+        ----------
+        dt : segments.TimeAxis
+            the time points (or np.array)
+
+        signals : np.array
+            the signals (eg. signal 1 is signals[0])
+
+        start : int
+            first sample to draw
+
+        stop : int
+            sample after the last one to draw
+
+        width : int
+            number of pixels available
+
+        Returns
+        -------
+        tuple[np.array, np.array]
+            the time points and values to draw
+        """
+        n = stop-start
+        if n <= 2*width:
+            return np.asarray(dt[start:stop]), signals[:, start:stop].sum(axis=0)
+
+        # coarsest level with at least one block per pixel
+        samples_per_px = n//width
+        block, mins, maxs = None, None, None
+        for level in self.levels:
+            if level[0] > samples_per_px:
+                break
+            block, mins, maxs = level
+
+        if block is None:
+            # view is too narrow for the pyramid: reduce the few samples shown directly
+            block = samples_per_px
+            start -= start % block
+            summed = signals[:, start:stop].sum(axis=0)
+            mins = np.empty(-(-len(summed)//block))
+            maxs = np.empty(len(mins))
+            self._reduce(summed, block, mins, maxs, 0)
+            first, last = start//block, start//block + len(mins)
+            offset = first
+        else:
+            first, last = start//block, -(-stop//block)
+            offset = 0
+
+        index = np.minimum(np.arange(first, last)*block, min(self.n, len(dt))-1)
+        x = np.repeat(dt[index], 2)
+        y = np.empty(2*(last-first))
+        y[0::2] = mins[first-offset:last-offset]
+        y[1::2] = maxs[first-offset:last-offset]
+        return x, y
+
+
+_pyramids = {} #id of signals -> (weak reference to the signals, their pyramid), while the signals live
+_lock = threading.RLock() # (reentrant: entries are removed when signals are freed, possibly in a locked section)
+
+
+def pyramid(signals):
+    """
+    Description
+    -----------
+    Returns the pyramid of signals, built once for as long as the signals live (eg. held by the waveform cache)
+
+    Parameters
+    ----------
+    signals : np.array
+        the signals (eg. signal 1 is signals[0])
+
+    Returns
+    -------
+    MinMaxPyramid
+        the pyramid of the sum of signals
+    """
+    key = id(signals)
+    with _lock:
+        entry = _pyramids.get(key)
+        if entry is not None and entry[0]() is signals:
+            return entry[1]
+    built = MinMaxPyramid(signals)
+
+    def forget(ref):
+        with _lock:
+            if _pyramids.get(key, (None,))[0] is ref:
+                del _pyramids[key]
+
+    with _lock:
+        _pyramids[key] = (weakref.ref(signals, forget), built)
+    return built
+
+
+def has_pyramid(signals):
+    """Checks whether the pyramid of signals is already built (see pyramid)"""
+    with _lock:
+        entry = _pyramids.get(id(signals))
+        return entry is not None and entry[0]() is signals
+
+
+def with_pyramid(generate, progress=None):
+    """
+    Description
+    -----------
+    Creates signals and builds their pyramid in the same thread (eg. of generation.WaveformGenerator)
+
+    Parameters
+    ----------
+    generate : callable
+        creates the signals, called with the 'progress' keyword argument (see waveforms.job)
+
+    progress : callable
+        called with the fraction of the signal created (see segments.compose)
+
+    Returns
+    -------
+    tuple[segments.TimeAxis, np.array]
+        the time points and the signals, as returned by generate
+    """
+    dt, signals = generate(progress=progress)
+    pyramid(signals)
+    return dt, signals
+
+
+class _LODCurve(pg.PlotDataItem):
+    """Curve reporting the bounds of the complete waveform, so that auto-range shows all of it"""
+    full_bounds = None # ((x_min, x_max), (y_min, y_max))
+
+    def dataBounds(self, ax, frac=1.0, orthoRange=None):
+        if self.full_bounds is None:
+            return super().dataBounds(ax, frac, orthoRange)
+        return self.full_bounds[ax]
+
+
+class LODPlot:
+    """
+    Description
+    -----------
+    Draws the sum of signals on an existing PlotWidget, redrawn at the resolution
+    of the visible range whenever the view is zoomed, panned or resized
+    """
+    def __init__(self, plot_widget):
+        """
+        Parameters
+        ----------
+        plot_widget : pg.PlotWidget
+            the widget to draw in, reused for every waveform
+        """
+        self.widget = plot_widget
+        self.curve = _LODCurve()
+        self.widget.addItem(self.curve)
+        self.view = self.widget.getViewBox()
+        self.view.sigXRangeChanged.connect(self.refresh)
+        self.view.sigResized.connect(self.refresh)
+        self.dt = None
+        self.signals = None
+        self.pyramid = None
+
+    def set_signals(self, dt, signals, pyramid):
+        """
+        Description
+        -----------
+        Shows a new waveform entirely
+
+        Parameters
+        ----------
+        dt : segments.TimeAxis
+            the time points (or np.array), only computed where drawn
+
+        signals : np.array
+            the signals (eg. signal 1 is signals[0])
+
+        pyramid : MinMaxPyramid
+            the pyramid of the signals, built beforehand (see pyramid, with_pyramid)
+        """
+        self.dt = dt if hasattr(dt, "searchsorted") else np.asarray(dt)
+        self.signals = signals
+        self.pyramid = pyramid
+        self.curve.full_bounds = ((self.dt[0], self.dt[-1]), self.pyramid.bounds())
+        self.view.setXRange(self.dt[0], self.dt[-1], padding=0)
+        self.refresh()
+
+    def refresh(self, *args):
+        """
+        Description
+        -----------
+        Redraws the visible range of the waveform
+        """
+        if self.pyramid is None:
+            return
+        x_min, x_max = self.view.viewRange()[0]
+        start = max(int(self.dt.searchsorted(x_min))-1, 0)
+        stop = min(int(self.dt.searchsorted(x_max, side="right"))+1, self.pyramid.n, len(self.dt))
+        width = max(int(self.view.width()), 100)
+        x, y = self.pyramid.decimate(self.dt, self.signals, start, stop, width)
+        self.curve.setData(x, y)
@@ -8,15 +8,21 @@ Author
 Gregor Dederichs, EPFL School of Life Sciences
 """
 
+import startup # (first, to time the startup: see startup.py)
 import sys
 from PyQt6.QtWidgets import QApplication
+startup.checkpoint("import PyQt6")
 import GUI
+startup.checkpoint("import GUI modules")
 
 def main():
     # RUN APPLICATION
     app = QApplication(sys.argv)
+    startup.checkpoint("QApplication")
     window = GUI.MainWindow()
-    sys.exit(app.exec())
+    code = app.exec()
+    window.session_log.close() # writes parameters still queued
+    sys.exit(code)
 
 
 if __name__ == "__main__":
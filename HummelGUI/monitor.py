@@ -0,0 +1,287 @@
+"""
+Description
+-----------
+Read-back monitor of the stimulation (see util.monitor): the output channels, wired back to analog inputs
+(eg. ao0 -> ai0, ao1 -> ai1, see util.monitor_channels), are acquired by an input task clocked by the sample
+clock of the output task, so that every sample read is a sample generated, for the whole run.
+
+The driver calls back every util.monitor_block samples; each callback reads them into a preallocated block
+and copies it into a fixed-size ring buffer (the last util.monitor_buffer_time seconds), without allocating,
+locking or waiting, so that ingestion never delays the output nor the event loop. The GUI draws a decimated
+trace of the most recent samples and the RMS/peak of each channel at a fixed rate (util.monitor_refresh_rate)
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import numpy as np
+import pyqtgraph as pg
+from PyQt6.QtCore import QTimer
+
+import util
+import daq
+import channels
+
+
+class RingBuffer:
+    """
+    Description
+    -----------
+    Last samples of several channels, written by a single thread (the acquisition) and read by others
+    (the live view) without locks: a reader detects samples overwritten while it copied them
+    """
+    def __init__(self, no_channels, capacity):
+        """
+        Parameters
+        ----------
+        no_channels : int
+            number of channels
+
+        capacity : int
+            number of samples per channel kept
+        """
+        self.data = np.zeros((no_channels, capacity))
+        self.capacity = capacity
+        self.total = 0 #samples per channel written since the start
+        self.largest = 0 #largest write, possibly in progress while a reader copies
+
+    def write(self, block):
+        """
+        Description
+        -----------
+        Appends samples of shape (channels, samples), overwriting the oldest ones
+        """
+        n = np.shape(block)[1]
+        self.largest = max(self.largest, min(n, self.capacity))
+        if n > self.capacity:
+            block = block[:, n-self.capacity:]
+        count = np.shape(block)[1]
+        start = (self.total + n - count) % self.capacity
+        first = min(count, self.capacity-start)
+        self.data[:, start:start+first] = block[:, :first]
+        self.data[:, :count-first] = block[:, first:]
+        self.total += n # published once the samples are written
+
+    def latest(self, n):
+        """
+        Description
+        -----------
+        Returns a copy of the last n samples (fewer if not written yet)
+
+        Returns
+        -------
+        tuple[np.array, int]
+            the samples of shape (channels, samples), and the number of samples written before the first one;
+            (None, total) if they were overwritten while copied (acquisition faster than the reader)
+        """
+        total = self.total
+        n = min(n, total, self.capacity)
+        start = (total - n) % self.capacity
+        first = min(n, self.capacity-start)
+        samples = np.empty((len(self.data), n))
+        samples[:, :first] = self.data[:, start:start+first]
+        samples[:, first:] = self.data[:, :n-first]
+        if self.total - total + self.largest > self.capacity - n:
+            return None, self.total
+        return samples, total - n
+
+
+def decimate(samples, points):
+    """
+    Description
+    -----------
+    Reduces samples to at most points per channel: minima and maxima of blocks are interleaved,
+    so that the drawn lines cover the full amplitude of each channel
+
+    Parameters
+    ----------
+    samples : np.array
+        samples of shape (channels, samples)
+
+    points : int
+        maximum number of points per channel
+
+    Returns
+    -------
+    tuple[np.array, np.array]
+        the indices of the points (in samples) and their values (shape (channels, points))
+    """
+    n = np.shape(samples)[1]
+    if n <= points:
+        return np.arange(n), samples
+    block = -(-2*n//points)
+    full = n//block
+    no_blocks = -(-n//block) # (last block may be shorter)
+    blocks = samples[:, :full*block].reshape(len(samples), full, block)
+    values = np.empty((len(samples), 2*no_blocks))
+    values[:, 0:2*full:2] = blocks.min(axis=2)
+    values[:, 1:2*full:2] = blocks.max(axis=2)
+    if no_blocks > full:
+        values[:, -2] = samples[:, full*block:].min(axis=1)
+        values[:, -1] = samples[:, full*block:].max(axis=1)
+    return np.repeat(np.arange(no_blocks)*block, 2), values
+
+
+def stats(samples):
+    """
+    Description
+    -----------
+    Returns the RMS and peak (maximum absolute value) of each channel
+    """
+    if np.shape(samples)[1] == 0:
+        return np.zeros(len(samples)), np.zeros(len(samples))
+    return np.sqrt(np.mean(np.square(samples), axis=1)), np.abs(samples).max(axis=1)
+
+
+class Monitor:
+    """
+    Description
+    -----------
+    Input task acquiring the outputs into a ring buffer, from the start to the end of a run.
+    Errors (eg. no analog inputs on the device) are kept in errors instead of interrupting the stimulation
+    """
+    def __init__(self, inputs=None, block=util.monitor_block, buffer_time=util.monitor_buffer_time):
+        """
+        Parameters
+        ----------
+        inputs : list[str]
+            analog input wired to each output channel (default: util.monitor_channels),
+            on the device of that output unless given as "DevX/aiN"
+
+        block : int
+            samples per channel read at each callback of the driver
+
+        buffer_time : float
+            seconds of read-back kept in the ring buffer
+        """
+        inputs = util.monitor_channels if inputs is None else inputs
+        outputs = channels.layout().names
+        if len(inputs) > len(outputs):
+            raise ValueError("util.monitor_channels should have at most one input per output channel")
+        self.names = [name if "/" in name else output.split("/")[0]+"/"+name for name, output in zip(inputs, outputs)]
+        self.block = int(block)
+        self.buffer_time = buffer_time
+        self.rate = util.sampling_f # (of the output, see start)
+        self.ring = RingBuffer(len(self.names), max(int(buffer_time*self.rate), self.block))
+        self._samples = np.empty((len(self.names), self.block)) # read by each callback
+        self.task = None
+        self.reader = None
+        self.errors = []
+
+    def start(self, rate=None):
+        """
+        Description
+        -----------
+        Starts acquiring, before the output starts (samples are clocked by the output sample clock)
+
+        Parameters
+        ----------
+        rate : float
+            the sample rate in Hz of the output (default: util.sampling_f, see rate_planner.py)
+        """
+        from nidaqmx.constants import AcquisitionType # (loaded on first use, see startup.py)
+        if self.task is not None:
+            return
+        self.errors = []
+        rate = util.sampling_f if rate is None else rate
+        if rate != self.rate:
+            self.rate = rate
+            self.ring = RingBuffer(len(self.names), max(int(self.buffer_time*rate), self.block))
+        task = None
+        try:
+            task = daq.new_task()
+            for name in self.names:
+                task.ai_channels.add_ai_voltage_chan(name)
+            task.timing.cfg_samp_clk_timing(rate=self.rate, source="/"+channels.layout().devices[0]+"/ao/SampleClock",
+                                            sample_mode=AcquisitionType.CONTINUOUS, samps_per_chan=self.ring.capacity)
+            task.register_every_n_samples_acquired_into_buffer_event(self.block, self._callback)
+            self.reader = daq.multi_channel_reader(task)
+            task.start()
+            self.task = task
+        except Exception as error:
+            self.errors.append(error)
+            if task is not None:
+                task.close()
+
+    def stop(self):
+        """Stops acquiring (samples already in the ring buffer are kept)"""
+        if self.task is None:
+            return
+        try:
+            self.task.stop()
+            self.task.close()
+        except Exception as error:
+            self.errors.append(error)
+        self.task = None
+
+    def _callback(self, task_handle, event_type, number_of_samples, callback_data):
+        """Reads the samples announced by the driver into the ring buffer (in the thread of the driver)"""
+        try:
+            n = int(number_of_samples)
+            samples = self._samples if n == self.block else np.empty((len(self.names), n)) # (C-contiguous)
+            self.reader.read_many_sample(samples, number_of_samples_per_channel=n, timeout=0)
+            self.ring.write(samples)
+        except Exception as error:
+            self.errors.append(error)
+        return 0
+
+
+class LiveView:
+    """
+    Description
+    -----------
+    Draws the most recent read-back of each channel (decimated to the width of the plot) and shows
+    their RMS/peak, refreshed at a fixed rate by a timer of the event loop
+    """
+    def __init__(self, monitor, plot_widget, label, view_time=util.monitor_view_time, rate=util.monitor_refresh_rate):
+        """
+        Parameters
+        ----------
+        monitor : Monitor
+            the monitor read
+
+        plot_widget : pg.PlotWidget
+            the widget to draw in
+
+        label : QLabel
+            the label showing RMS/peak of each channel
+
+        view_time : float
+            seconds of read-back shown (the most recent)
+
+        rate : float
+            refreshes per second
+        """
+        self.monitor = monitor
+        self.widget = plot_widget
+        self.label = label
+        self.view_time = view_time
+        self.curves = [plot_widget.plot(pen=pg.intColor(i, len(monitor.names))) for i in range(len(monitor.names))]
+        self.shown = None # samples written when last refreshed
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(int(1000/rate))
+
+    def refresh(self):
+        """
+        Description
+        -----------
+        Redraws the read-back if new samples were acquired since the last refresh
+        """
+        if self.monitor.errors:
+            self.label.setText("Read-back unavailable: {}".format(self.monitor.errors[-1]))
+            return
+        if self.monitor.ring.total == self.shown:
+            return
+        samples, first = self.monitor.ring.latest(max(int(self.view_time*self.monitor.rate), 1))
+        if samples is None:
+            return # overwritten while copied: next refresh
+        self.shown = first + np.shape(samples)[1]
+        index, values = decimate(samples, max(int(self.widget.width()), 100))
+        x = (first + index)/self.monitor.rate
+        for curve, y in zip(self.curves, values):
+            curve.setData(x, y)
+        rms, peak = stats(samples)
+        self.label.setText("   ".join("{}: RMS {:.3f} V, peak {:.3f} V".format(name.split("/")[-1], r, p)
+                                      for name, r, p in zip(self.monitor.names, rms, peak)))
@@ -0,0 +1,100 @@
+"""
+Description
+-----------
+Module for phase-exact carrier oscillators on the sampling grid (time points k/sampling_f).
+The phase of sample k is reduced with integer arithmetic, so that it stays exact over hours.
+When the carrier repeats on a short integer period (eg. 2000 Hz at 100 kHz: every 50 samples),
+one period is precomputed and outputs are filled by copying it, without any cosine evaluation
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import functools
+from fractions import Fraction
+import numpy as np
+
+import util
+
+
+class Oscillator:
+    """
+    Description
+    -----------
+    Cosine of frequency f sampled at fs: cos(2*pi*f*k/fs + phase) for integer sample indices k.
+    f/fs is reduced to the fraction p/q (q samples hold exactly p periods), the phase of sample k
+    being 2*pi*((k*p) mod q)/q + phase
+    """
+    def __init__(self, f, fs=None, max_table=None, phase=0.0):
+        """
+        Parameters
+        ----------
+        f : float
+            the frequency in Hz
+
+        fs : float
+            the sampling frequency in Hz (default: util.sampling_f)
+
+        max_table : int
+            max number of samples of a precomputed period (default: util.wavetable_max_size);
+            longer periods have the phase of each sample computed from its index
+
+        phase : float
+            the phase in radians at sample 0
+        """
+        fs = util.sampling_f if fs is None else fs
+        max_table = util.wavetable_max_size if max_table is None else max_table
+        # denominators up to 2**31 keep (k mod q)*p within int64, with a negligible frequency error
+        ratio = (Fraction(f)/Fraction(fs)).limit_denominator(2**31)
+        self.q = ratio.denominator
+        self.p = ratio.numerator % self.q
+        self.phase = float(phase)
+        self.table = None
+        if self.q <= max_table:
+            self.table = np.cos(2*np.pi*((np.arange(self.q, dtype=np.int64)*self.p) % self.q)/self.q + self.phase)
+
+    def render(self, start, stop, out, block=2**16):
+        """
+        Description
+        -----------
+        Fills out (array of stop-start samples) with samples [start, stop) of the oscillator
+        """
+        n = stop-start
+        if self.table is not None:
+            # first (partial) period, full periods, last (partial) period
+            offset = start % self.q
+            first = min(n, self.q-offset)
+            out[:first] = self.table[offset:offset+first]
+            full = (n-first)//self.q
+            out[first:first+full*self.q].reshape(full, self.q)[:] = self.table
+            last = first+full*self.q
+            out[last:] = self.table[:n-last]
+            return
+        # phase from integer indices, in blocks (float64 work buffer, out may be float32)
+        work = np.empty(min(n, block))
+        for begin in range(0, n, block):
+            end = min(begin+block, n)
+            k = np.arange(start+begin, start+end, dtype=np.int64) % self.q
+            k *= self.p
+            k %= self.q
+            np.multiply(k, 2*np.pi/self.q, out=work[:end-begin])
+            np.add(work[:end-begin], self.phase, out=work[:end-begin])
+            np.cos(work[:end-begin], out=work[:end-begin])
+            out[begin:end] = work[:end-begin]
+
+
+@functools.lru_cache(maxsize=64)
+def _oscillator(f, fs, max_table, phase):
+    return Oscillator(f, fs, max_table, phase)
+
+
+def get(f, phase=0.0, fs=None):
+    """
+    Description
+    -----------
+    Returns the oscillator of frequency f and phase (radians) at the sampling frequency fs
+    (default: util.sampling_f), created once and shared by all segments (eg. ramps and carrier of a signal)
+    """
+    fs = util.sampling_f if fs is None else fs
+    return _oscillator(float(f), fs, util.wavetable_max_size, float(phase))
@@ -0,0 +1,262 @@
+"""
+Description
+-----------
+Renders the waveforms of a whole study schedule (see schedule.py) ahead of the session days, without the GUI.
+Every row of the excel file is validated (missing or duplicated subject IDs, unknown stimulation types).
+Identical waveforms (same stimulation type and parameters) are rendered once, each in parallel on a pool
+of processes, and saved as .npy files to util.prerender_dir, with a manifest (manifest.json) describing them.
+At run time, the GUI loads these waveforms (as memory maps) instead of creating them (see cache.py).
+
+Waveforms depend on the settings of util.py (eg. sampling_f, sample_format, channels): they have to be
+rendered again after these are changed, otherwise the GUI does not find them and creates signals as usual.
+
+Usage (from the folder containing HummelGUI, like the GUI):
+    python HummelGUI/prerender.py
+    python HummelGUI/prerender.py --check
+    python HummelGUI/prerender.py --updates --workers 4
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import util
+import cache
+import schedule
+import waveforms
+import protocols
+
+MANIFEST_FILE = "manifest.json"
+SETTINGS = ["sampling_f", "sample_rate_mode", "rate_max_error", "daq_timebase", "sample_format", "oscillator",
+            "ramp_shape", "ramp_exp_rate", "wavetable_max_size", "device", "memmap_min_bytes", "channels", "channel_signals", "channel_phases", "channel_gains"] #settings of util.py the waveforms depend on
+
+
+def _missing(subject):
+    """Checks whether a subject ID is missing (None, NaN or empty cell)"""
+    return subject is None or subject != subject or str(subject).strip() in ("", "nan")
+
+
+def validate(sched):
+    """
+    Description
+    -----------
+    Checks every row of a schedule
+
+    Parameters
+    ----------
+    sched : schedule.Schedule
+        the schedule
+
+    Returns
+    -------
+    list[str]
+        descriptions of the problems found (empty if none)
+    """
+    problems = []
+    seen = set()
+    for row, subject in enumerate(sched.subjects, start=2): # (row 1 holds the column names)
+        if _missing(subject):
+            problems.append(f"row {row}: missing subject ID")
+            continue
+        if str(subject) in seen:
+            problems.append(f"row {row}: subject {subject} appears more than once (only its first row is used)")
+            continue
+        seen.add(str(subject))
+        for session in sched.sessions:
+            protocol = sched.lookup(subject, session)
+            if protocols.get(protocol) is None:
+                problems.append(f"row {row}: subject {subject}, session {session}: unknown stimulation type ({protocol})")
+    return problems
+
+
+def jobs(sched, updates=False):
+    """
+    Description
+    -----------
+    Lists the distinct waveforms of a schedule (stimulations of blind mode: parameters of util.py)
+
+    Parameters
+    ----------
+    sched : schedule.Schedule
+        the schedule
+
+    updates : bool
+        also lists the waveforms of updates (without ramp-up)
+
+    Returns
+    -------
+    dict
+        file name of the waveform -> stimulation type, rampup, key and the subjects/sessions using it
+    """
+    params = waveforms.default_params()
+    unique = {}
+    for subject, sessions in sched.protocols.items():
+        if _missing(subject):
+            continue # (reported by validate)
+        for session, protocol in sessions.items():
+            if protocols.get(protocol) is None:
+                continue # (reported by validate)
+            for rampup in ((True, False) if updates else (True,)):
+                key, _ = waveforms.job(protocol, params, rampup)
+                name = os.path.basename(cache.waveform_files("", key)[1])
+                entry = unique.setdefault(name, {"stim_type": protocol, "rampup": rampup, "key": key, "used_by": []})
+                entry["used_by"].append({"subject": subject, "session": session})
+    return unique
+
+
+def _render(task):
+    """
+    Description
+    -----------
+    Renders and saves one waveform (in a worker process)
+
+    Parameters
+    ----------
+    task : tuple
+        stimulation type, rampup, directory and settings of util.py
+
+    Returns
+    -------
+    dict
+        file name, shape, data type, bytes and time of the creation of the waveform
+    """
+    stim_type, rampup, directory, settings = task
+    for name, value in settings.items():
+        setattr(util, name, value)
+    key, generate = waveforms.job(stim_type, waveforms.default_params(), rampup, directory)
+    begin = time.perf_counter()
+    dt, signals = generate() # (large waveforms are created directly in their files)
+    created = time.perf_counter() - begin
+    if not isinstance(signals, np.memmap):
+        cache.save_waveform(directory, key, dt, signals)
+    return {"file": os.path.basename(cache.waveform_files(directory, key)[1]),
+            "shape": list(signals.shape),
+            "dtype": str(signals.dtype),
+            "bytes": int(signals.nbytes),
+            "render_time": created,
+            "total_time": time.perf_counter() - begin}
+
+
+def render(unique, directory, workers=None, force=False):
+    """
+    Description
+    -----------
+    Renders waveforms in parallel (one process per core by default), skipping those already rendered
+
+    Parameters
+    ----------
+    unique : dict
+        the waveforms to render (see jobs)
+
+    directory : str
+        the directory receiving the waveforms
+
+    workers : int
+        number of processes (default: number of cores); each holds one waveform in memory
+        (waveforms of at least util.memmap_min_bytes: in their files)
+
+    force : bool
+        renders waveforms again even if already rendered
+
+    Returns
+    -------
+    dict
+        file name -> results of the rendering (see _render), or None if already rendered
+    """
+    settings = {name: getattr(util, name) for name in SETTINGS}
+    todo = {name: entry for name, entry in unique.items()
+            if force or cache.load_waveform(directory, entry["key"]) is None}
+    results = {name: None for name in unique if name not in todo}
+    if not todo:
+        return results
+    workers = min(workers or os.cpu_count() or 1, len(todo))
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {name: pool.submit(_render, (entry["stim_type"], entry["rampup"], directory, settings))
+                   for name, entry in todo.items()}
+        for name, future in futures.items():
+            results[name] = future.result()
+            print("rendered {:48} {:8.2f}s  {:9.1f}MB".format(
+                  name, results[name]["total_time"], results[name]["bytes"]/1e6), flush=True)
+    return results
+
+
+def write_manifest(directory, unique, results, problems, filename):
+    """
+    Description
+    -----------
+    Writes the manifest of the rendered waveforms (merged with the manifest of previous renderings)
+    """
+    path = os.path.join(directory, MANIFEST_FILE)
+    try:
+        with open(path) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        manifest = {"waveforms": {}}
+    waveform_entries = manifest["waveforms"]
+    for name, entry in unique.items():
+        previous = waveform_entries.get(name, {})
+        result = results.get(name) or {k: previous.get(k) for k in ("shape", "dtype", "bytes", "render_time")}
+        waveform_entries[name] = {"stim_type": entry["stim_type"],
+                                  "rampup": entry["rampup"],
+                                  "params": waveforms.default_params(),
+                                  "used_by": entry["used_by"],
+                                  "shape": result["shape"],
+                                  "dtype": result["dtype"],
+                                  "bytes": result["bytes"],
+                                  "render_time": result["render_time"]}
+    manifest.update({"date": datetime.datetime.now().isoformat(timespec="seconds"),
+                     "schedule": filename,
+                     "settings": {name: getattr(util, name) for name in SETTINGS},
+                     "problems": problems})
+    os.makedirs(directory, exist_ok=True)
+    with open(path+".tmp", "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(path+".tmp", path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the waveforms of the study schedule ahead of the sessions")
+    parser.add_argument("--file", default=util.excel_file_name, help="excel file of the schedule (in the GUI directory)")
+    parser.add_argument("--output", default=util.prerender_dir or "prerendered_waveforms",
+                        help="directory of the waveforms (relative to the working directory)")
+    parser.add_argument("--workers", type=int, default=None, help="processes rendering waveforms (default: one per core)")
+    parser.add_argument("--updates", action="store_true", help="also render the waveforms of updates (no ramp-up)")
+    parser.add_argument("--force", action="store_true", help="render again waveforms already rendered")
+    parser.add_argument("--check", action="store_true", help="only validate the schedule, render nothing")
+    args = parser.parse_args(argv)
+
+    sched = schedule.load(args.file)
+    problems = validate(sched)
+    for problem in problems:
+        print("PROBLEM", problem)
+    unique = jobs(sched, args.updates)
+    print("{} subjects, {} sessions: {} distinct waveforms".format(
+          len(sched.protocols), len(sched.sessions), len(unique)))
+    if args.check:
+        return 1 if problems else 0
+
+    directory = os.path.join(os.getcwd(), args.output)
+    begin = time.perf_counter()
+    results = render(unique, directory, args.workers, args.force)
+    write_manifest(directory, unique, results, problems, args.file)
+    print("{} rendered, {} already rendered, in {:.1f}s; manifest: {}".format(
+          sum(r is not None for r in results.values()), sum(r is None for r in results.values()),
+          time.perf_counter()-begin, os.path.join(directory, MANIFEST_FILE)))
+    if os.path.normpath(directory) != os.path.normpath(os.path.join(os.getcwd(), util.prerender_dir or "")):
+        print("note: the GUI loads waveforms from util.prerender_dir ({})".format(util.prerender_dir or "disabled"))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,339 @@
+"""
+Description
+-----------
+Registry of the stimulation types. A protocol is declared by the segments of its main signal
+(carrier only, interference, burst train, or cycles of these), with their parameters named as the fields
+of the GUI (see waveforms.default_params). Every protocol is compiled by the same steps: ramp-up
+(unless updating), main signal, ramp-down and the 100 zeros offsetting spiking, into a plan
+(see segments.Program) whose exact length and time points are known before any sample is created.
+
+Identical segments are shared: within a plan and across plans (eg. a waveform and the same waveform
+without ramp-up, created for updates), a segment is only built once and its samples only computed once
+(see segments.compose). Compiled plans are kept (see util.plan_cache_size),
+and feed any output path: complete signals (compose), signals created in files (out), or chunks (render).
+
+To add a stimulation type, declare it with register() (see the protocols below); it is then listed
+in the GUI, recognised in the excel file, cached and rendered ahead like the others
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+import util
+import channels
+import segments
+import envelope
+
+
+def _value(spec, p):
+    """Value of a parameter of a segment: the parameter of that name, computed from the parameters, or a constant"""
+    if isinstance(spec, str):
+        return p[spec]
+    if callable(spec):
+        return spec(p)
+    return spec
+
+
+class CarrierOnly:
+    """
+    Description
+    -----------
+    Segment of high frequency signals only (no shift, ie. no envelope)
+    """
+    def __init__(self, duration="total_TBS_time"):
+        self.duration = duration
+
+    def build(self, p, plan):
+        return [plan.segment(segments.Carrier, _value(self.duration, p), p["carrier_f"], p["carrier_f"], p["A1"], p["A2"])]
+
+
+class Interference:
+    """
+    Description
+    -----------
+    Segment of temporal interference: signal 2 shifted in frequency by shift (the frequency of the envelope)
+    """
+    def __init__(self, duration="total_TBS_time", shift="freq_of_pulse"):
+        self.duration = duration
+        self.shift = shift
+
+    def build(self, p, plan):
+        f1 = p["carrier_f"]
+        f2 = f1 + _value(self.shift, p)
+        return [plan.segment(segments.Carrier, _value(self.duration, p), f1, f2, p["A1"], p["A2"])]
+
+
+class BurstTrain:
+    """
+    Description
+    -----------
+    Segment of theta-bursts (3 pulses of interference at pulse_f, every 1/burst_f seconds, see segments.TBSTrain)
+    """
+    def __init__(self, duration="total_TBS_time", pulse_f="freq_of_pulse", burst_f="burst_freq"):
+        self.duration = duration
+        self.pulse_f = pulse_f
+        self.burst_f = burst_f
+
+    def build(self, p, plan):
+        return [plan.segment(segments.TBSTrain, p["carrier_f"], _value(self.pulse_f, p), _value(self.burst_f, p),
+                             _value(self.duration, p), p["A1"], p["A2"])]
+
+
+class Cycles:
+    """
+    Description
+    -----------
+    Cycles of segments repeated during total seconds (eg. stimulation and break of the trains of iTBS).
+    As in the original iTBS, if the protocol declares the duration of its time points, the last segment
+    of the last cycle is replaced by high frequency signals lasting until the ramp-down
+    """
+    def __init__(self, cycle, total="total_TBS_time"):
+        """
+        Parameters
+        ----------
+        cycle : list
+            the segments of one cycle, each lasting a parameter named duration
+
+        total : str
+            the parameter giving the time in seconds of all cycles
+        """
+        self.cycle = cycle
+        self.total = total
+
+    def build(self, p, plan):
+        cycle_time = sum(_value(seg.duration, p) for seg in self.cycle)
+        no_cycles = int(np.floor(_value(self.total, p)/cycle_time-0.001))
+        cycle = [seg for spec in self.cycle for seg in spec.build(p, plan)]
+        segs = list(cycle)
+        for i in range(no_cycles):
+            if i != no_cycles-1 or plan.axis is None:
+                segs += cycle
+            else:
+                segs += cycle[:-1]
+                # fill in remaining time, on the time points of the signals
+                remaining = plan.axis.n - plan.ramp_down_n - (plan.n_before + segments.length(segs))
+                if remaining > 0:
+                    segs.append(plan.segment(segments.Carrier, None, p["carrier_f"], p["carrier_f"], p["A1"], p["A2"],
+                                             n=remaining, step=plan.axis.step))
+        return segs
+
+
+class Protocol:
+    """
+    Description
+    -----------
+    A stimulation type: its main signal, and how the GUI presents its parameters
+    """
+    def __init__(self, name, main, duration=None, labels=None, disabled=(), ramp=None):
+        """
+        Parameters
+        ----------
+        name : str
+            the stimulation type, as listed in the GUI and written in the excel file
+
+        main : list
+            the segments of the main signal (eg. [BurstTrain()]), between ramp-up and ramp-down
+
+        duration : str
+            the parameter giving the time in seconds of the main signal, spanned by the time points
+            (as the original stimulation functions); None for one time point per sample of the signals
+
+        labels : dict
+            labels of parameter fields differing from the defaults (eg. {"freq_of_pulse": "Shift Frequency (Hz)"})
+
+        disabled : tuple[str]
+            parameter fields disabled in the GUI (not used by the protocol)
+
+        ramp : str or tuple
+            the shape of its ramps (see envelope.py); None for util.ramp_shape
+        """
+        self.name = name
+        self.main = list(main)
+        self.duration = duration
+        self.labels = dict(labels or {})
+        self.disabled = tuple(disabled)
+        self.ramp = ramp
+
+
+class Plan:
+    """
+    Description
+    -----------
+    A protocol compiled with its parameters at a sampling frequency (rate): its segments (program),
+    its time points (axis) and length, known before any sample is created
+    """
+    def __init__(self, protocol, params, rampup, rate):
+        p = params
+        self.rampup = rampup
+        self.rate = rate
+        # time points (including the 100 zeros added to offset spiking)
+        if protocol.duration is None:
+            self.axis = None # (once the length is known)
+        elif rampup:
+            self.axis = segments.TimeAxis(_value(protocol.duration, p)+p["ramp_up_time"]+p["ramp_down_time"], rate=rate)
+        else:
+            self.axis = segments.TimeAxis(_value(protocol.duration, p)+p["ramp_down_time"], rate=rate)
+        self.ramp_down_n = int(rate*p["ramp_down_time"])
+        shape = envelope.shape(util.ramp_shape if protocol.ramp is None else protocol.ramp)
+
+        segs = []
+        # ========== RAMP UP ==========
+        if rampup:
+            segs.append(self.segment(segments.Ramp, "up", p["carrier_f"], p["ramp_up_time"], p["A1"], p["A2"], shape=shape))
+        # ======== MAIN SIGNAL ========
+        for spec in protocol.main:
+            self.n_before = segments.length(segs) # (samples before the segment being built)
+            segs += spec.build(p, self)
+        # ========= RAMP DOWN =========
+        segs.append(self.segment(segments.Ramp, "down", p["carrier_f"], p["ramp_down_time"], p["A1"], p["A2"], shape=shape))
+        # add 100 zeros to offset spiking
+        segs.append(self.segment(segments.Zeros, 100))
+        self.program = segments.Program(segs)
+        if self.axis is None:
+            n = len(self.program) - 100
+            self.axis = segments.TimeAxis((n-1)/rate, n=n, rate=rate)
+
+    def __len__(self):
+        return len(self.program)
+
+    def segment(self, kind, *args, **kwargs):
+        """
+        Description
+        -----------
+        Returns the segment of this kind and arguments at the rate of the plan, the same object
+        as in any other live plan (built with the same oscillator and channels)
+        """
+        kwargs["rate"] = self.rate
+        key = (kind, args, tuple(sorted(kwargs.items())), util.oscillator, channels.layout().key)
+        with _lock:
+            seg = _segments.get(key)
+            if seg is None:
+                seg = kind(*args, **kwargs)
+                _segments[key] = seg
+        return seg
+
+    def compose(self, progress=None, dtype=None, out=None):
+        """
+        Description
+        -----------
+        Creates the complete signals (see segments.compose)
+
+        Returns
+        -------
+        tuple[segments.TimeAxis, np.array]
+            the time points (computed on demand) and the signals (eg. signal 1 is signals[0])
+        """
+        return self.axis, self.program.compose(progress, dtype, out)
+
+
+REGISTRY = OrderedDict() #name -> Protocol, in the order listed by the GUI
+_segments = weakref.WeakValueDictionary() #key -> segment used by a live plan
+_plans = OrderedDict() #key -> Plan, most recently used last
+_lock = threading.RLock()
+
+
+def register(protocol):
+    """
+    Description
+    -----------
+    Adds a stimulation type (replacing any of the same name)
+    """
+    REGISTRY[protocol.name] = protocol
+    with _lock:
+        _plans.clear()
+    return protocol
+
+
+def get(name):
+    """
+    Description
+    -----------
+    Returns the protocol of a stimulation type, or None if it creates no signals (eg. "Select Stimulation")
+    """
+    return REGISTRY.get(name)
+
+
+def names():
+    """Returns the registered stimulation types"""
+    return list(REGISTRY)
+
+
+def plan(name, params, rampup=True, rate=None):
+    """
+    Description
+    -----------
+    Compiles a stimulation, or returns it if compiled recently with the same parameters
+
+    Parameters
+    ----------
+    name : str
+        the stimulation type (see names())
+
+    params : dict
+        the parameters of the stimulation, named as the fields of the GUI (see waveforms.default_params)
+
+    rampup: bool
+        decides whether a ramping signal with no shift is added to the main signal
+
+    rate : float
+        the sampling frequency in Hz (default: util.sampling_f; see rate_planner.py)
+
+    Returns
+    -------
+    Plan
+        the compiled signals
+    """
+    protocol = REGISTRY[name]
+    rate = util.sampling_f if rate is None else rate
+    key = (name, tuple(sorted(params.items())), rampup, rate, util.oscillator, envelope.shape(util.ramp_shape),
+           channels.layout().key)
+    with _lock:
+        if key in _plans:
+            _plans.move_to_end(key)
+            return _plans[key]
+    compiled = Plan(protocol, params, rampup, rate)
+    with _lock:
+        _plans[key] = compiled
+        while len(_plans) > util.plan_cache_size:
+            _plans.popitem(last=False)
+    return compiled
+
+
+def create(name, params, rampup=True, progress=None, out=None, rate=None):
+    """
+    Description
+    -----------
+    Creates the signals of a stimulation (see plan)
+
+    Parameters
+    ----------
+    progress : callable
+        called with the fraction of the signal created, may abort the creation (see segments.compose)
+
+    out : np.array
+        optional array (eg. a np.memmap) or writable buffer of shape (channels, samples) receiving the signals
+
+    rate : float
+        the sampling frequency in Hz (default: util.sampling_f)
+
+    Returns
+    -------
+    tuple[segments.TimeAxis, np.array]
+        the time points (computed on demand) and the signals (eg. signal 1 is signals[0])
+    """
+    return plan(name, params, rampup, rate).compose(progress, out=out)
+
+
+# ========== STIMULATION TYPES ==========
+register(Protocol("iTBS", [Cycles([BurstTrain(duration="train_stim_time"), CarrierOnly(duration="train_break_time")])],
+                  duration="total_TBS_time"))
+register(Protocol("cTBS", [BurstTrain()], duration="total_TBS_time"))
+register(Protocol("TBS_control", [CarrierOnly()], duration="total_TBS_time"))
+register(Protocol("TI", [Interference()], duration="total_TBS_time",
+                  labels={"freq_of_pulse": "Shift Frequency (Hz)"}, disabled=("burst_freq",)))
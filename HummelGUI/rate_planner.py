@@ -0,0 +1,115 @@
+"""
+Description
+-----------
+Sample rate of each stimulation (see util.sample_rate_mode). With "fixed", every stimulation is sampled
+at util.sampling_f. With "planned", each stimulation is sampled at the lowest rate the DAQ generates exactly
+(its timebase divided by an integer, see util.daq_timebase), up to util.sampling_f, such that:
+    - the reconstruction error of its highest frequency stays within util.rate_max_error: the zero-order hold
+      of the DAC attenuates a sine of frequency f sampled at rate by sinc(f/rate), ie. an error of 1-sinc(f/rate)
+      (eg. 0.07% for 2 kHz at 100 kHz, 1% at 25.7 kHz)
+    - every duration of its segments (eg. pulses and cycles of theta-bursts, ramps) spans a whole number of samples,
+      so that timings are the same as at util.sampling_f
+
+Eg. TBS_control (2 kHz carrier only) is sampled at 31.25 kHz instead of 100 kHz with the default bound of 1%,
+which divides its buffer, write time and memory by 3.2
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import functools
+import numpy as np
+
+import util
+import channels
+import protocols
+
+
+def reconstruction_error(f, rate):
+    """
+    Description
+    -----------
+    Returns the relative amplitude error of a sine of frequency f (Hz) generated at rate (Hz) by a zero-order hold
+    (1 if at or beyond the Nyquist frequency)
+    """
+    if 2*f >= rate:
+        return 1.0
+    return float(1 - np.sinc(f/rate))
+
+
+@functools.lru_cache(maxsize=None)
+def candidates(max_rate, timebase):
+    """
+    Description
+    -----------
+    Returns the rates generated exactly from the timebase (integer divisors of its frequency) up to max_rate, ascending
+    """
+    timebase = int(round(timebase))
+    divisors = set()
+    for k in range(1, int(np.sqrt(timebase))+1):
+        if timebase % k == 0:
+            divisors.update((k, timebase//k))
+    return tuple(sorted(d for d in divisors if d <= max_rate))
+
+
+def _exact(times, rate):
+    """Checks whether all durations span whole numbers of samples at rate (also once truncated, as by the segments)"""
+    return all(int(rate*t) == round(rate*t) and abs(rate*t - round(rate*t)) < 1e-6 for t in times)
+
+
+class RatePlan:
+    """
+    Description
+    -----------
+    Sample rate of a stimulation, with the resulting reconstruction error and size of its signals
+    """
+    def __init__(self, rate, highest_f, samples):
+        self.rate = rate
+        self.highest_f = highest_f
+        self.error = reconstruction_error(highest_f, rate) if highest_f else 0.0
+        self.samples = samples #per channel
+        itemsize = 8 if util.sample_format == "float64" else 4
+        self.nbytes = samples*channels.count()*itemsize
+
+    def __str__(self):
+        return "Sample rate {:g} kHz: error {:.2f}% at {:g} Hz, signals {:.1f} MB".format(
+            self.rate/1000, 100*self.error, self.highest_f, self.nbytes/1024**2)
+
+
+def plan(stim_type, params, rampup=True, rate=None):
+    """
+    Description
+    -----------
+    Chooses the sample rate of a stimulation (see util.sample_rate_mode)
+
+    Parameters
+    ----------
+    stim_type : str
+        the stimulation type (see protocols.names)
+
+    params : dict
+        the parameters of the stimulation (see waveforms.default_params)
+
+    rampup: bool
+        decides whether a ramping signal with no shift is added to the main signal
+
+    rate : float
+        imposed rate (eg. the rate of a running task, which cannot change); None to choose it
+
+    Returns
+    -------
+    RatePlan
+        the rate, its reconstruction error and the size of the signals
+    """
+    reference = protocols.plan(stim_type, params, rampup).program # (at util.sampling_f)
+    highest_f = max((abs(f) for seg in reference.segments for f in seg.frequencies), default=0)
+    if rate is None:
+        rate = util.sampling_f
+        if util.sample_rate_mode == "planned":
+            times = [t for seg in reference.segments for t in seg.times]
+            for candidate in candidates(util.sampling_f, util.daq_timebase):
+                if reconstruction_error(highest_f, candidate) <= util.rate_max_error and _exact(times, candidate):
+                    rate = candidate
+                    break
+    return RatePlan(rate, highest_f, len(protocols.plan(stim_type, params, rampup, rate)))
@@ -0,0 +1,127 @@
+"""
+Description
+-----------
+Module converting signals to the sample format written to the DAQ.
+Signals may be written as device-native 16-bit codes (scaled with the calibration of each channel),
+or as floating point voltages, through the stream writers of the DAQ backend (see daq.py)
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import numpy as np
+
+import util
+import daq
+import tracing
+
+
+def volts_to_codes(volts, coeffs, out, work=None):
+    """
+    Description
+    -----------
+    Converts voltages to device-native 16-bit codes, in one vectorized pass per channel:
+    codes = round(c0 + c1*volts + c2*volts**2 + ...), clipped to the int16 range
+
+    Parameters
+    ----------
+    volts : np.array
+        signals of shape (channels, samples)
+
+    coeffs : list[list[float]]
+        scaling coefficients of each channel, from voltage to device codes (ao_dev_scaling_coeff)
+
+    out : np.array
+        int16 array of the same shape as volts, receiving the codes
+
+    work : np.array
+        optional float64 buffer of at least one channel of samples, reused between calls
+    """
+    n = np.shape(volts)[1]
+    if work is None or len(work) < n:
+        work = np.empty(n)
+    work = work[:n]
+    for channel, c in enumerate(coeffs):
+        # Horner scheme, in place
+        if len(c) == 1:
+            work[:] = c[0]
+        else:
+            np.multiply(volts[channel], c[-1], out=work, dtype=np.float64)
+            for coeff in c[-2:0:-1]:
+                np.add(work, coeff, out=work)
+                np.multiply(work, volts[channel], out=work)
+            np.add(work, c[0], out=work)
+        np.clip(work, -32768, 32767, out=work) # (integer bounds: same codes as clipping after rounding)
+        np.rint(work, out=out[channel], casting="unsafe")
+
+
+class SampleWriter:
+    """
+    Description
+    -----------
+    Writes signals to a task in the configured sample format (see util.sample_format), chunk by chunk,
+    so that conversions never need more than one chunk of additional memory (buffers allocated once per writer).
+    Falls back to floating point voltages if the device does not report its scaling coefficients.
+    Signals are stored as voltages (float32 for "int16"): device codes depend on the calibration
+    of each channel of the task, so they are only computed here, chunk by chunk
+    """
+    def __init__(self, task, sample_format=util.sample_format, chunk_size=util.stream_chunk_size):
+        """
+        Parameters
+        ----------
+        task : nidaqmx.Task
+            task with its output channels and timing configured
+
+        sample_format : str
+            "int16" (device codes), "float32" or "float64" (voltages)
+
+        chunk_size : int
+            number of samples per channel converted at once
+        """
+        from nidaqmx.errors import DaqError # (loaded on first use, see startup.py)
+        self.format = sample_format
+        self.chunk_size = chunk_size
+        if self.format == "int16":
+            try:
+                self.coeffs = [list(channel.ao_dev_scaling_coeff) for channel in task.ao_channels]
+                self.writer = daq.unscaled_writer(task)
+            except DaqError:
+                self.format = "float32" # scaling not available for this device
+        if self.format != "int16":
+            self.writer = daq.multi_channel_writer(task)
+        self.work = np.empty(chunk_size)
+        # contiguous chunks written to the driver (flat, so that any chunk length is a contiguous view)
+        self.channels = len(task.ao_channels)
+        self.buffer = np.empty(self.channels*chunk_size, dtype=np.int16 if self.format == "int16" else np.float64)
+
+    def _chunk(self, n):
+        """Contiguous view of the buffer holding a chunk of n samples per channel"""
+        return self.buffer[:self.channels*n].reshape(self.channels, n)
+
+    def write(self, signals):
+        """
+        Description
+        -----------
+        Writes signals (voltages of shape (channels, samples)) to the task, without starting it
+
+        Parameters
+        ----------
+        signals : np.array
+            the signals (eg. signal 1 is signals[0])
+        """
+        n = np.shape(signals)[1]
+        with tracing.span("task.write", samples=n):
+            for start in range(0, n, self.chunk_size):
+                chunk = signals[:, start:start+self.chunk_size]
+                if self.format == "int16":
+                    codes = self._chunk(np.shape(chunk)[1])
+                    volts_to_codes(chunk, self.coeffs, codes, self.work)
+                    self.writer.write_int16(codes)
+                elif chunk.dtype == np.float64 and chunk.flags.c_contiguous:
+                    self.writer.write_many_sample(chunk) # (eg. streamed chunks)
+                else:
+                    volts = self._chunk(np.shape(chunk)[1])
+                    volts[:] = chunk
+                    self.writer.write_many_sample(volts)
+        tracing.count("samples_written", n)
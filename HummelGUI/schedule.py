@@ -0,0 +1,154 @@
+"""
+Description
+-----------
+Module for the schedule of the study: the excel file (see util.excel_file_name) giving the protocol
+of each subject (rows, column "Subj") and session (other columns).
+The file is parsed once into a subject -> session -> protocol lookup, which is cached on disk next to it
+(pickle file ".<file name>.schedule"); the cache is used as long as the size and modification time
+of the excel file are unchanged, or its content hash is (eg. file copied again without changes).
+Parsing with pandas/openpyxl is only needed after the excel file changed
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import hashlib
+import os
+import pickle
+
+import util
+
+CACHE_VERSION = 1 #to be increased if Schedule changes
+
+
+class Schedule:
+    """
+    Description
+    -----------
+    Protocol of each subject and session, looked up in constant time
+    """
+    def __init__(self, subjects, sessions, protocols):
+        """
+        Parameters
+        ----------
+        subjects : list
+            the subject IDs, in the order of the file
+
+        sessions : list[str]
+            the session IDs, in the order of the file
+
+        protocols : dict
+            subject ID (str) -> session ID -> protocol (eg. "iTBS")
+        """
+        self.subjects = subjects
+        self.sessions = sessions
+        self.protocols = protocols
+
+    def lookup(self, subject, session):
+        """
+        Description
+        -----------
+        Returns the protocol of a subject in a session; raises KeyError if either is not in the file
+        """
+        return self.protocols[str(subject)][session]
+
+
+def _parse(path):
+    """Reads the excel file into a Schedule"""
+    import pandas as pd # (only needed if the cache is outdated)
+    df = pd.read_excel(path)
+    subjects = df["Subj"].to_list()
+    sessions = df.columns.to_list()[1:]
+    protocols = {}
+    for subject, row in zip(subjects, df[sessions].itertuples(index=False, name=None)):
+        protocols.setdefault(str(subject), dict(zip(sessions, row))) # (first row of a subject, as df.at)
+    return Schedule(subjects, sessions, protocols)
+
+
+def _digest(path):
+    """Content hash of a file"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(2**20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def cache_file(path):
+    """Path of the disk cache of an excel file"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, "."+name+".schedule")
+
+
+_loaded = {} #path -> (size, mtime, schedule): schedules loaded in this process
+
+
+def load(filename=util.excel_file_name):
+    """
+    Description
+    -----------
+    Returns the schedule of an excel file of the GUI directory, parsed only if neither
+    this process nor the disk cache holds it for the current file
+
+    Parameters
+    ----------
+    filename : str
+        name of the excel file in the GUI directory
+
+    Returns
+    -------
+    Schedule
+        the schedule
+
+    Raises
+    ------
+    ValueError
+        if the file is not found ("File not found") or cannot be read ("File not readable")
+    """
+    path = os.path.join(os.getcwd(), "HummelGUI", filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise ValueError("File not found")
+    signature = (stat.st_size, stat.st_mtime_ns)
+
+    # loaded in this process
+    if path in _loaded and _loaded[path][0] == signature:
+        return _loaded[path][1]
+
+    # cached on disk
+    cached = None
+    try:
+        with open(cache_file(path), "rb") as file:
+            cached = pickle.load(file)
+        if cached["version"] != CACHE_VERSION:
+            cached = None
+    except Exception:
+        cached = None # no cache, or unreadable
+    schedule = None
+    digest = None
+    if cached is not None:
+        if cached["signature"] == signature:
+            schedule = cached["schedule"]
+        else:
+            digest = _digest(path)
+            if cached["digest"] == digest: # file touched, but unchanged
+                schedule = cached["schedule"]
+
+    # parse
+    if schedule is None:
+        try:
+            schedule = _parse(path)
+        except Exception:
+            raise ValueError("File not readable")
+    if cached is None or cached["signature"] != signature:
+        try:
+            with open(cache_file(path)+".tmp", "wb") as file:
+                pickle.dump({"version": CACHE_VERSION, "signature": signature,
+                             "digest": digest or _digest(path), "schedule": schedule}, file)
+            os.replace(cache_file(path)+".tmp", cache_file(path))
+        except OSError:
+            pass # (eg. read-only directory: parsed again next time)
+    _loaded[path] = (signature, schedule)
+    return schedule
@@ -0,0 +1,569 @@
+"""
+Description
+-----------
+Module describing signals as sequences of segments (ramps, carriers, theta-burst trains, zeros).
+The exact sample count of every segment is known up front, so that a complete signal
+is allocated once and each segment is filled in place
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import bisect
+import numpy as np
+import util
+import channels
+import oscillator
+import envelope
+
+
+def _fill_cos(dt, f1, f2, A1, A2, out, block=2**16, envelopes=None):
+    """
+    Description
+    -----------
+    In place equivalent of out = A*np.cos(2*np.pi*f*dt + phase), for the frequency f, phase and amplitude A
+    of each channel (see channels.py); by default (A1*np.cos(2*np.pi*f1*dt), A2*np.cos(2*np.pi*f2*dt+np.pi)).
+    A1 and A2 may be envelopes (arrays) or constants; envelopes may also be given per channel
+    (1-D views, eg. of shared tables, see envelope.py), replacing the amplitudes.
+    Phases are always computed in float64; for float32 outputs, this is done in blocks of samples
+    """
+    if out.dtype != np.float64:
+        work = np.empty((np.shape(out)[0], min(block, len(dt))))
+        for start in range(0, len(dt), block):
+            stop = min(start+block, len(dt))
+            env1 = A1[start:stop] if np.ndim(A1) else A1
+            env2 = A2[start:stop] if np.ndim(A2) else A2
+            views = None if envelopes is None else [values[start:stop] for values in envelopes]
+            _fill_cos(dt[start:stop], f1, f2, env1, env2, work[:, :stop-start], envelopes=views)
+            out[:, start:stop] = work[:, :stop-start]
+        return
+    layout = channels.layout()
+    # all channels at once: per-channel vectors broadcast over time points
+    np.multiply(2*np.pi*layout.frequencies(f1, f2), dt, out=out)
+    np.add(out, layout.phases, out=out)
+    np.cos(out, out=out)
+    if envelopes is None:
+        np.multiply(layout.amplitudes(A1, A2), out, out=out)
+    else:
+        envelope.apply(out, envelopes)
+
+
+def _fill_osc(start, f1, f2, A1, A2, out, rate=None, envelopes=None):
+    """
+    Description
+    -----------
+    Equivalent of _fill_cos on the sampling grid (time points k/rate, k from start; default rate: util.sampling_f),
+    with carriers from phase-exact oscillators (see oscillator.py, util.oscillator = "wavetable")
+    """
+    layout = channels.layout()
+    stop = start + np.shape(out)[1]
+    for channel, (f, phase) in enumerate(zip(layout.frequencies(f1, f2)[:, 0], layout.phases[:, 0])):
+        oscillator.get(f, phase, rate).render(start, stop, out[channel])
+    if envelopes is None:
+        np.multiply(layout.amplitudes(A1, A2), out, out=out)
+    else:
+        envelope.apply(out, envelopes)
+
+
+def _wavetable():
+    """Checks whether carriers are created by oscillators on the sampling grid (see util.oscillator)"""
+    return util.oscillator == "wavetable"
+
+
+def _linspace(first, last, n, index):
+    """
+    Description
+    -----------
+    Values of np.linspace(first, last, n) at the given indices (float array), computed as numpy does,
+    so that any range of samples is bit-identical to the complete array
+    """
+    if n <= 1:
+        return index*(last-first) + first
+    values = index*((last-first)/(n-1)) + first
+    values[index == n-1] = last # endpoint is exact
+    return values
+
+
+def _indices(start, stop, n, reverse=False):
+    """Indices (as floats) of samples [start, stop) of an array of n samples, possibly reversed"""
+    if reverse:
+        return np.arange(n-1-start, n-1-stop, -1, dtype=float)
+    return np.arange(start, stop, dtype=float)
+
+
+class Segment:
+    """
+    Description
+    -----------
+    Base class of all segments. A segment knows its number of samples per channel (n),
+    and evaluates any range of its samples in place. Segments are sampled at rate (default: util.sampling_f);
+    the frequencies they contain and the durations that must span whole samples (times) are known
+    to choose the rate (see rate_planner.py)
+    """
+    n = 0
+    frequencies = () #frequencies in Hz of the signals
+    times = () #durations in seconds, exact only if rate*time is a whole number of samples
+
+    def render(self, start, stop, out):
+        """
+        Description
+        -----------
+        Fills out (view of shape (channels, stop-start)) with samples [start, stop) of the segment
+        """
+        raise NotImplementedError
+
+    def fill(self, out):
+        """
+        Description
+        -----------
+        Fills out (view of shape (channels, n)) with all samples of the segment
+        """
+        self.render(0, self.n, out)
+
+
+class Zeros(Segment):
+    """
+    Description
+    -----------
+    Null signals (eg. the 100 samples added at the end of stimulations to offset spiking)
+    """
+    def __init__(self, n, rate=None):
+        self.n = int(n) # (at any rate)
+
+    def render(self, start, stop, out):
+        out[:] = 0
+
+
+class Carrier(Segment):
+    """
+    Description
+    -----------
+    Cosines of constant amplitude on all channels (by default: signal 2 being shifted by pi).
+    Time points are linspace(0, duration, n), or arange(n)*step if step is given
+    """
+    def __init__(self, duration, f1, f2, A1, A2, n=None, step=None, rate=None):
+        """
+        Parameters
+        ----------
+        duration : float
+            the time in seconds of the segment (ignored if step is given)
+
+        f1 : float
+            the frequency in Hz of signal 1
+
+        f2 : float
+            the frequency in Hz of signal 2 (equal to f1 if no interference)
+
+        A1 : float
+            the amplitude in mA of signal 1
+
+        A2 : float
+            the amplitude in mA of signal 2
+
+        n : int
+            number of samples (defaults to the number of samples in duration)
+
+        step : float
+            time between two samples, if time points do not span duration
+
+        rate : float
+            the sampling frequency in Hz (default: util.sampling_f)
+        """
+        self.duration = duration
+        self.f1, self.f2 = f1, f2
+        self.A1, self.A2 = A1, A2
+        self.rate = util.sampling_f if rate is None else rate
+        self.n = int(self.rate*duration) if n is None else int(n)
+        self.step = step
+        self.frequencies = (f1, f2)
+        self.times = (duration,) if n is None else ()
+
+    def render(self, start, stop, out):
+        if _wavetable():
+            _fill_osc(start, self.f1, self.f2, self.A1, self.A2, out, self.rate)
+            return
+        if self.step is None:
+            dt = _linspace(0, self.duration, self.n, _indices(start, stop, self.n))
+        else:
+            dt = np.arange(start, stop) * self.step
+        _fill_cos(dt, self.f1, self.f2, self.A1, self.A2, out)
+
+
+class Ramp(Segment):
+    """
+    Description
+    -----------
+    Signals with no temporal interference, with amplitudes increasing/decreasing along the ramp shape
+    (see fbase.ramp). Carriers are multiplied in place by views of shared envelope tables (see envelope.py)
+    """
+    def __init__(self, direction, carrier_f, ramp_time, A1_max, A2_max, rate=None, shape=None):
+        if direction not in ("up", "down"):
+            raise ValueError("parameter 'direction' should be either 'up' or 'down' (case sensitive)")
+        self.direction = direction
+        self.carrier_f = carrier_f
+        self.ramp_time = ramp_time
+        self.A1_max, self.A2_max = A1_max, A2_max
+        self.rate = util.sampling_f if rate is None else rate
+        self.shape = envelope.shape(util.ramp_shape if shape is None else shape)
+        self.n = int(self.rate*ramp_time)
+        self.frequencies = (carrier_f,)
+        self.times = (ramp_time,)
+
+    def render(self, start, stop, out):
+        layout = channels.layout()
+        peaks = [self.A1_max if signal1 else self.A2_max for signal1 in layout.signal1[:, 0]]
+        envelopes = envelope.views(self.shape, self.n, peaks, layout.gains[:, 0], start, stop,
+                                   reverse=self.direction == "down")
+        if _wavetable():
+            _fill_osc(start, self.carrier_f, self.carrier_f, None, None, out, self.rate, envelopes)
+            return
+        dt = envelope.times(self.ramp_time, self.n)[start:stop]
+        _fill_cos(dt, self.carrier_f, self.carrier_f, None, None, out, envelopes=envelopes)
+
+
+class TBSTrain(Segment):
+    """
+    Description
+    -----------
+    Train of theta-bursts (see fbase.TBS). One cycle (burst and break) is computed once
+    and repeated in place
+    """
+    def __init__(self, high_f, pulse_f, burst_f, duration, A1, A2, rate=None):
+        self.high_f = high_f
+        self.pulse_f = pulse_f
+        self.burst_f = burst_f
+        self.A1, self.A2 = A1, A2
+        cycle_t = 1/burst_f
+        pulse_t = 3/pulse_f
+        self.no_pulses = int(duration/cycle_t)
+        self.rate = util.sampling_f if rate is None else rate
+        self.cycle_n = int(self.rate*pulse_t) + int(self.rate*(cycle_t-pulse_t))
+        self.n = self.no_pulses*self.cycle_n
+        self.frequencies = (high_f, high_f+pulse_f)
+        self.times = (pulse_t, cycle_t)
+        self._cycle = None
+
+    def cycle(self):
+        """
+        Description
+        -----------
+        Returns the signals of one cycle (one theta-burst followed by a break), computed once
+        """
+        if self._cycle is None:
+            cycle_t = 1/self.burst_f
+            pulse_t = 3/self.pulse_f
+            f1 = self.high_f
+            f2 = self.high_f + self.pulse_f
+            n_pulse = int(self.rate*pulse_t)
+            cycle = np.empty((channels.count(), self.cycle_n))
+            if _wavetable():
+                # pulse, then break (with freq f1: no change), on one sampling grid
+                _fill_osc(0, f1, f2, self.A1, self.A2, cycle[:, :n_pulse], self.rate)
+                _fill_osc(n_pulse, f1, f1, self.A1, self.A2, cycle[:, n_pulse:], self.rate)
+            else:
+                # Pulse
+                pulse_dt = np.linspace(0, pulse_t, n_pulse)
+                _fill_cos(pulse_dt, f1, f2, self.A1, self.A2, cycle[:, :n_pulse])
+
+                # Break (with freq f1: no change)
+                break_dt = pulse_dt[-1] + np.linspace(1/self.rate, cycle_t-pulse_t, self.cycle_n-n_pulse)
+                _fill_cos(break_dt, f1, f1, self.A1, self.A2, cycle[:, n_pulse:])
+            self._cycle = cycle
+        return self._cycle
+
+    def render(self, start, stop, out):
+        # first (partial) cycle, full cycles, last (partial) cycle
+        cycle = self.cycle()
+        n = stop-start
+        offset = start % self.cycle_n
+        first = min(n, self.cycle_n-offset)
+        out[:, :first] = cycle[:, offset:offset+first]
+        full = (n-first)//self.cycle_n
+        out[:, first:first+full*self.cycle_n].reshape(np.shape(out)[0], full, self.cycle_n)[:] = cycle[:, np.newaxis, :]
+        last = first+full*self.cycle_n
+        out[:, last:] = cycle[:, :n-last]
+
+    def fill(self, out):
+        # broadcast the cycle over all pulses, without intermediate copies
+        out.reshape(np.shape(out)[0], self.no_pulses, self.cycle_n)[:] = self.cycle()[:, np.newaxis, :]
+
+
+class GenerationCancelled(Exception):
+    """
+    Description
+    -----------
+    Raised by a progress callback to abort the composition of signals
+    """
+
+
+def length(segments):
+    """
+    Description
+    -----------
+    Returns the total number of samples per channel of a sequence of segments
+    """
+    return sum(seg.n for seg in segments)
+
+
+class Program:
+    """
+    Description
+    -----------
+    A protocol compiled into its sequence of segments. Any range of samples can be evaluated directly,
+    at a cost proportional to the range only (eg. the next chunk streamed to the DAQ, or the visible window
+    of a preview), bit-identical to the same range of the complete signals
+    """
+    def __init__(self, segments):
+        """
+        Parameters
+        ----------
+        segments : list[Segment]
+            the segments of the signal, in order
+        """
+        self.segments = list(segments)
+        self.offsets = np.cumsum([0] + [seg.n for seg in self.segments]) # first sample of each segment
+        self.n = int(self.offsets[-1])
+
+    def __len__(self):
+        return self.n
+
+    def prepare(self):
+        """
+        Description
+        -----------
+        Computes what the segments reuse for any range (eg. the cycle of a train, envelope and oscillator tables)
+        by evaluating their first sample, so that chunks streamed later are not delayed by it
+
+        Returns
+        -------
+        Program
+            this program
+        """
+        out = np.empty((channels.count(), 1))
+        for seg in {id(seg): seg for seg in self.segments}.values(): # (segments may be repeated)
+            if seg.n:
+                seg.render(0, 1, out)
+        return self
+
+    def render(self, start, stop, out=None, dtype=None):
+        """
+        Description
+        -----------
+        Evaluates samples [start, stop) of the signals
+
+        Parameters
+        ----------
+        start : int
+            first sample
+
+        stop : int
+            sample after the last one (clipped to the end of the signals)
+
+        out : np.array
+            optional array of shape (channels, stop-start) receiving the samples
+
+        dtype : np.dtype
+            data type of the samples if out is not given (default: see util.sample_format)
+
+        Returns
+        -------
+        np.array
+            the samples (eg. signal 1 is samples[0])
+        """
+        start, stop = max(int(start), 0), min(int(stop), self.n)
+        stop = max(stop, start)
+        if out is None:
+            if dtype is None:
+                dtype = np.float64 if util.sample_format == "float64" else np.float32
+            out = np.empty((channels.count(), stop-start), dtype=dtype)
+        first = start
+        i = int(np.searchsorted(self.offsets, start, side="right")) - 1
+        while start < stop:
+            seg_start = self.offsets[i]
+            seg_stop = min(self.offsets[i+1], stop)
+            if seg_stop > start: # (skips empty segments)
+                self.segments[i].render(start-seg_start, seg_stop-seg_start, out[:, start-first:seg_stop-first])
+            start = seg_stop
+            i += 1
+        return out
+
+    def compose(self, progress=None, dtype=None, out=None):
+        """
+        Description
+        -----------
+        Creates the complete signals at once (see compose)
+        """
+        return compose(self.segments, progress, dtype, out)
+
+
+def _target(out, shape, dtype):
+    """
+    Description
+    -----------
+    Returns the array of the given shape receiving the signals: out itself if an array (eg. a np.memmap),
+    or a view of any other writable buffer (eg. mmap.mmap, bytearray) holding samples of type dtype
+    """
+    if not isinstance(out, np.ndarray):
+        out = np.frombuffer(out, dtype=dtype, count=shape[0]*shape[1]).reshape(shape)
+    if out.shape != shape:
+        raise ValueError(f"out should be of shape {shape}, not {out.shape}")
+    if not out.flags.writeable:
+        raise ValueError("out should be writable")
+    return out
+
+
+def compose(segments, progress=None, dtype=None, out=None, block=2**20):
+    """
+    Description
+    -----------
+    Allocates the complete signals once, and fills each segment in place.
+    A segment appearing more than once is only computed once, then copied
+
+    Parameters
+    ----------
+    segments : list[Segment]
+        the segments of the signal, in order
+
+    progress : callable
+        called with the fraction of samples filled before each segment, before each block of long segments
+        and at the end; may raise GenerationCancelled to abort (eg. a superseded request, see generation.py)
+
+    dtype : np.dtype
+        data type of the signals (default: data type of out, or see util.sample_format)
+
+    out : np.array
+        optional array (eg. a np.memmap) or writable buffer of shape (channels, samples) receiving the signals,
+        instead of allocating them in memory
+
+    block : int
+        number of samples per channel filled at once: segments are filled by blocks of samples,
+        so that memory use does not depend on the length of the signals, and a creation
+        can be cancelled within one block (eg. in a 30-minute carrier)
+
+    Returns
+    -------
+    np.array
+        the signals (eg. signal 1 is signals[0]), out if given
+    """
+    if dtype is None:
+        if isinstance(out, np.ndarray):
+            dtype = out.dtype
+        else:
+            dtype = np.float64 if util.sample_format == "float64" else np.float32
+    total = length(segments)
+    if out is None:
+        signals = np.empty((channels.count(), total), dtype=dtype)
+    else:
+        signals = _target(out, (channels.count(), total), dtype)
+    filled = {} #id of segment -> start of its first occurrence
+    start = 0
+    for seg in segments:
+        first = filled.get(id(seg))
+        for i in range(0, seg.n, block):
+            if progress is not None:
+                progress((start+i)/max(total, 1))
+            j = min(i+block, seg.n)
+            if first is not None:
+                signals[:, start+i:start+j] = signals[:, first+i:first+j]
+            elif seg.n <= block:
+                seg.fill(signals[:, start:start+seg.n])
+            else:
+                seg.render(i, j, signals[:, start+i:start+j])
+        if first is None:
+            filled[id(seg)] = start
+        start += seg.n
+    if progress is not None:
+        progress(1.0)
+    return signals
+
+
+class TimeAxis:
+    """
+    Description
+    -----------
+    Time points of signals, described by their start, step and length instead of being stored:
+    np.linspace(start, start+duration, n) followed by zeros points continuing with the step of the first two
+    (eg. the 100 samples added at the end of stimulations to offset spiking), as the time points originally
+    created by the stimulation functions. Any time point, range or set of time points is computed on demand,
+    bit-identical to the same time points of the complete array
+    """
+    nbytes = 0 # (nothing is held in memory)
+
+    def __init__(self, duration, n=None, zeros=100, start=0.0, rate=None):
+        """
+        Parameters
+        ----------
+        duration : float
+            the time in seconds from the first to the last time point of the signals (excluding zeros)
+
+        n : int
+            number of time points of the signals (defaults to the number of samples in duration)
+
+        zeros : int
+            number of time points after the signals
+
+        start : float
+            the first time point
+
+        rate : float
+            the sampling frequency in Hz of the signals (default: util.sampling_f)
+        """
+        self.start = start
+        self.duration = duration
+        self.stop = start + duration
+        self.rate = util.sampling_f if rate is None else rate
+        self.n = int(self.rate*duration) if n is None else int(n)
+        self.zeros = int(zeros)
+        self.step = (self.stop-self.start)/(self.n-1) if self.n > 1 else 0.0
+
+    def __len__(self):
+        return self.n + self.zeros
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    def values(self, index):
+        """
+        Description
+        -----------
+        Returns the time points at the given indices (array of non-negative integers)
+        """
+        index = np.asarray(index, dtype=float)
+        if self.zeros == 0:
+            return _linspace(self.start, self.stop, self.n, index)
+        values = _linspace(self.start, self.stop, self.n, np.minimum(index, self.n-1))
+        tail = index >= self.n
+        if tail.any():
+            # as dt[-1] + np.arange(0, zeros)*dt[1] - dt[0]
+            second = float(_linspace(self.start, self.stop, self.n, np.array([1.0]))[0])
+            values[tail] = self.stop + (index[tail]-self.n)*second - self.start
+        return values
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.values(np.arange(*index.indices(len(self))))
+        if np.ndim(index) == 0:
+            i = int(index)
+            if i < 0:
+                i += len(self)
+            if not 0 <= i < len(self):
+                raise IndexError("time point index out of range")
+            return float(self.values(np.array([i]))[0])
+        index = np.asarray(index)
+        return self.values(np.where(index < 0, index+len(self), index))
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values(np.arange(len(self))).astype(dtype or float, copy=False)
+
+    def searchsorted(self, value, side="left"):
+        """
+        Description
+        -----------
+        Index at which value would be inserted to keep the time points sorted (as np.searchsorted),
+        found by bisection over computed time points
+        """
+        if side == "left":
+            return bisect.bisect_left(self, value)
+        return bisect.bisect_right(self, value)
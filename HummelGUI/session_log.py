@@ -0,0 +1,323 @@
+"""
+Description
+-----------
+Module for the session log: the parameters of each stimulation are saved as records
+(original CSV layout, or one JSON object per line, see util.log_format) with the event (start of a repetition, update, stop),
+wall-clock and monotonic timestamps. CSV files keep the layout of the original save_params byte for byte:
+the events and monotonic timestamps of their records are only in JSON records, and in the index for events. Records are queued and written by a background thread, so that
+logging never delays the signals sent to the DAQ; the records queued meanwhile are written at once.
+
+Each directory of session files holds an index (subject, session, number of records, events, first and last time
+of each file), so that thousands of sessions can be queried without reading them all. The log rewrites it when
+a session file is started, when the log is closed, and otherwise at most every util.log_index_interval seconds;
+files that changed since (eg. after a crash) are indexed again when it is loaded (see load_index)
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+
+import util
+
+INDEX_FILE = "session_index.json"
+EXTENSIONS = {"jsonl": ".jsonl", "csv": ".csv"}
+CSV_FIELDS = ["total_time", "train_stim_time", "train_break_time", "pulse_freq", "burst_freq", "carrier_freq",
+              "ampl_sum", "ampl_ratio", "ampl1", "ampl2", "ramp_up_time", "ramp_down_time"]
+
+
+def session_file(directory, subject, session, log_format=None):
+    """Path of the file logging a session of a subject"""
+    log_format = util.log_format if log_format is None else log_format
+    return os.path.join(directory, subject+"_"+session+EXTENSIONS[log_format])
+
+
+def _csv_block(record):
+    """Record in the original CSV layout of save_params (one "name,value" line per parameter), without its event"""
+    wall = datetime.datetime.fromisoformat(record["time"]).timestamp()
+    lines = ["", "time,"+time.ctime(wall), record["subject"]+","+record["session"]]
+    lines += [name+","+str(record["params"][name]) for name in CSV_FIELDS if name in record["params"]]
+    return "\n".join(lines)+"\n"
+
+
+def _read_records(path, events=None):
+    """
+    Records of a session file (CSV files: one record per parameter block, timestamps only in wall-clock time,
+    events from the index if given, see SessionLog._write)
+    """
+    records = []
+    with open(path, newline="") as file:
+        if path.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    records.append(json.loads(line))
+            return records
+        lines = [line.strip() for line in file]
+    for i, line in enumerate(lines):
+        if line.startswith("time,"):
+            if i+1 >= len(lines):
+                break
+            subject, _, session = lines[i+1].partition(",")
+            record = {"time": datetime.datetime.strptime(line[5:], "%a %b %d %H:%M:%S %Y").isoformat(),
+                      "event": None, "subject": subject, "session": session, "params": {}}
+            for param in lines[i+2:]:
+                name, _, value = param.partition(",")
+                if name not in CSV_FIELDS:
+                    break
+                record["params"][name] = value
+            records.append(record)
+    if events is not None and len(events) == len(records):
+        for record, event in zip(records, events):
+            record["event"] = event
+    return records
+
+
+def _summary(path, entry=None):
+    """Index entry of a session file (CSV files: events of the records indexed in the previous entry, if any)"""
+    records = _read_records(path)
+    csv = not path.endswith(".jsonl")
+    if csv:
+        known = (entry or {}).get("record_events", [])[:len(records)]
+        for record, event in zip(records, known):
+            record["event"] = event
+    events = {}
+    for record in records:
+        events[str(record["event"])] = events.get(str(record["event"]), 0) + 1
+    summary = {"subject": records[0]["subject"] if records else None,
+               "session": records[0]["session"] if records else None,
+               "records": len(records),
+               "events": events,
+               "first": records[0]["time"] if records else None,
+               "last": records[-1]["time"] if records else None,
+               "size": os.path.getsize(path)}
+    if csv:
+        summary["record_events"] = [record["event"] for record in records]
+    return summary
+
+
+def _save_index(directory, index):
+    """Writes the index of a directory atomically (never left half written)"""
+    path = os.path.join(directory, INDEX_FILE)
+    with open(path+".tmp", "w") as file:
+        json.dump(index, file, indent=1)
+    os.replace(path+".tmp", path)
+
+
+def load_index(directory):
+    """
+    Description
+    -----------
+    Returns the index of the session files of a directory, after indexing files that are new
+    or were modified outside of the log (eg. copied from another computer)
+
+    Parameters
+    ----------
+    directory : str
+        the directory of the session files
+
+    Returns
+    -------
+    dict
+        file name -> subject, session, records, events (count per event), first and last time, size,
+        and the event of each record of CSV files (record_events)
+    """
+    try:
+        with open(os.path.join(directory, INDEX_FILE)) as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        index = {}
+    changed = False
+    names = [name for name in os.listdir(directory) if name.endswith(tuple(EXTENSIONS.values()))]
+    for name in names:
+        path = os.path.join(directory, name)
+        if name not in index or index[name]["size"] != os.path.getsize(path):
+            try:
+                index[name] = _summary(path, index.get(name))
+            except (OSError, ValueError):
+                continue # not a session file
+            changed = True
+    for name in set(index) - set(names):
+        del index[name]
+        changed = True
+    if changed:
+        _save_index(directory, index)
+    return index
+
+
+def query(directory, subject=None, session=None, event=None):
+    """
+    Description
+    -----------
+    Returns the records of the sessions matching a subject and/or session; only the matching files are read
+
+    Parameters
+    ----------
+    directory : str
+        the directory of the session files
+
+    subject : str
+        the subject ID (None for all subjects)
+
+    session : str
+        the session (None for all sessions)
+
+    event : str
+        only records of this event, eg. "repetition", "update" or "stop" (None for all events)
+
+    Returns
+    -------
+    list[dict]
+        the records, file by file
+    """
+    records = []
+    for name, entry in sorted(load_index(directory).items()):
+        if subject is not None and entry["subject"] != subject:
+            continue
+        if session is not None and entry["session"] != session:
+            continue
+        records += [record for record in _read_records(os.path.join(directory, name), entry.get("record_events"))
+                    if event is None or record["event"] == event]
+    return records
+
+
+class SessionLog:
+    """
+    Description
+    -----------
+    Queue of records written by a background thread. Logging returns immediately;
+    errors while writing (eg. a full disk) are kept in errors instead of interrupting the stimulation
+    """
+    def __init__(self, log_format=None):
+        """
+        Parameters
+        ----------
+        log_format : str
+            "csv" (original layout) or "jsonl" (one JSON record per line) (default: util.log_format)
+        """
+        self.format = util.log_format if log_format is None else log_format
+        if self.format not in EXTENSIONS:
+            raise ValueError("util.log_format should be either 'csv' or 'jsonl'")
+        self.queue = queue.Queue()
+        self.errors = []
+        self.thread = None
+        self.indexes = {} #directory -> index, loaded once
+        self.saved = {} #directory -> monotonic time of the last rewrite of its index
+        self.unsaved = set() #directories of which the index changed since
+
+    def log(self, directory, subject, session, event, params, **fields):
+        """
+        Description
+        -----------
+        Queues a record, to be written by the background thread
+
+        Parameters
+        ----------
+        directory : str
+            the directory of the session files (created if needed)
+
+        subject : str
+            the subject ID
+
+        session : str
+            the session
+
+        event : str
+            eg. "repetition" (start of a repetition), "update" or "stop"
+
+        params : dict
+            the parameters of the stimulation
+
+        fields : dict
+            additional fields of the record (eg. repetition number)
+        """
+        record = {"time": datetime.datetime.now().isoformat(timespec="microseconds"),
+                  "monotonic": time.monotonic(),
+                  "event": event,
+                  "subject": subject,
+                  "session": session}
+        record.update(fields)
+        record["params"] = dict(params)
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.queue.put((directory, record))
+
+    def flush(self):
+        """Waits until all queued records are written"""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    def close(self):
+        """Writes the queued records and stops the background thread"""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while True: # records queued meanwhile are written at once
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write([item for item in batch if item is not None])
+                if None in batch:
+                    for directory in list(self.unsaved):
+                        self._save(directory)
+            except Exception as error:
+                self.errors.append(error)
+            for _ in batch:
+                self.queue.task_done()
+            if None in batch:
+                return
+
+    def _save(self, directory):
+        """Rewrites the index of a directory"""
+        _save_index(directory, self.indexes[directory])
+        self.saved[directory] = time.monotonic()
+        self.unsaved.discard(directory)
+
+    def _write(self, batch):
+        """
+        Appends records to their session files (one write per file), and updates the indexes
+        (rewritten if a session file was started, or util.log_index_interval seconds after the last rewrite)
+        """
+        files = {}
+        for directory, record in batch:
+            files.setdefault((directory, record["subject"], record["session"]), []).append(record)
+        for (directory, subject, session), records in files.items():
+            os.makedirs(directory, exist_ok=True)
+            path = session_file(directory, subject, session, self.format)
+            if directory not in self.indexes:
+                self.indexes[directory] = load_index(directory) # (before writing: the events of the records are indexed)
+                self.saved[directory] = time.monotonic()
+            if self.format == "jsonl":
+                text = "".join(json.dumps(record)+"\n" for record in records)
+            else:
+                text = "".join(_csv_block(record) for record in records)
+            with open(path, "a", newline="") as file:
+                file.write(text)
+
+            index = self.indexes[directory]
+            started = os.path.basename(path) not in index
+            entry = index.setdefault(os.path.basename(path),
+                {"subject": subject, "session": session, "records": 0, "events": {}, "first": records[0]["time"]})
+            if self.format == "csv":
+                entry.setdefault("record_events", []).extend(record["event"] for record in records)
+            entry["records"] += len(records)
+            for record in records:
+                entry["events"][str(record["event"])] = entry["events"].get(str(record["event"]), 0) + 1
+            entry["last"] = records[-1]["time"]
+            entry["size"] = os.path.getsize(path)
+            self.unsaved.add(directory)
+            if started or time.monotonic() - self.saved[directory] >= util.log_index_interval:
+                self._save(directory)
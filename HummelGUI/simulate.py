@@ -0,0 +1,162 @@
+"""
+Description
+-----------
+Simulates complete stimulation sessions on the fake DAQ backend (see fake_daq.py), without hardware:
+the GUI runs headless, repetitions are sent through the usual worker thread, and updates/stops
+can be requested at given times. Reports write throughput, update/stop latencies and gaps in the
+output (between repetitions and on update). With a fast-forwarded clock, a session takes seconds.
+
+Usage (from the folder containing HummelGUI, like the GUI):
+    python HummelGUI/simulate.py --stim iTBS --duration 60 --repetitions 3 --speed 100 --update-at 20
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen") # headless GUI
+from PyQt6.QtWidgets import QApplication
+
+import util
+import fake_daq
+import channels
+
+
+def simulate(stim="iTBS", duration=util.total_TBS_time, repetitions=util.rep_num, speed=100,
+             update_at=None, stop_at=None, trigger=False, streaming=util.streaming, persistent=util.persistent_task,
+             sample_rate_mode=util.sample_rate_mode):
+    """
+    Description
+    -----------
+    Runs a session on the fake DAQ, as the experimenter would from the GUI
+
+    Parameters
+    ----------
+    stim : str
+        stimulation type, as in the GUI drop-down menu
+
+    duration : int
+        total time in seconds of each stimulation
+
+    repetitions : int
+        number of repetitions
+
+    speed : float
+        virtual seconds elapsing per real second
+
+    update_at : float
+        time in seconds (virtual) after the first output started at which an update is requested, None for no update
+
+    stop_at : float
+        time in seconds (virtual) after the first output started at which a stop is requested, None for no stop
+
+    trigger : bool
+        waits for the PFI0 trigger before each stimulation (see util.fake_trigger_delay)
+
+    streaming : bool
+        streams signals in chunks (see util.streaming)
+
+    persistent : bool
+        reuses one committed task for all repetitions (see util.persistent_task)
+
+    sample_rate_mode : str
+        "fixed" or "planned" sample rates (see util.sample_rate_mode)
+
+    Returns
+    -------
+    dict
+        measurements of the session
+    """
+    util.daq_backend = "fake"
+    util.streaming = streaming
+    util.persistent_task = persistent
+    util.sample_rate_mode = sample_rate_mode
+    fake_daq.clock.set_speed(speed)
+    fake_daq.reset_events()
+
+    import GUI
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = GUI.MainWindow()
+    window.drop_stim_select.setCurrentText(stim)
+    window.total_TBS_time_edit.setText(str(duration))
+    window.rep_num_edit.setText(str(repetitions))
+    window.trigger_toggle.setChecked(trigger)
+    window.use_trigger = trigger
+    window.box_save.setChecked(False)
+
+    begin = time.perf_counter()
+    window.create_signals(compiled=streaming) # (as in blind mode, see MainWindow.run_stimulation)
+    creation_time = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    window.run_stimulation()
+    requests = {"update": update_at, "stop": stop_at}
+    while window.worker_thread.is_alive():
+        app.processEvents()
+        started = [at for at, _, event, _ in list(fake_daq.events) if event == "generating"]
+        if started:
+            elapsed = fake_daq.clock.now() - started[0]
+            for command, at in list(requests.items()):
+                if at is not None and elapsed >= at:
+                    window.request_update() if command == "update" else window.request_stop()
+                    requests[command] = None
+        time.sleep(0.001)
+    real_time = time.perf_counter() - begin
+
+    gaps = fake_daq.output_gaps()
+    stats = fake_daq.write_stats
+    return {"stim": stim,
+            "duration": duration,
+            "repetitions": repetitions,
+            "streaming": streaming,
+            "persistent_task": persistent,
+            "sample_format": util.sample_format,
+            "sample_rate": window.dt.rate,
+            "channels": channels.layout().names,
+            "speed": speed,
+            "creation_time": creation_time,
+            "real_time": real_time,
+            "virtual_time": real_time*speed,
+            "writes": stats["writes"],
+            "samples_written": stats["samples"],
+            "write_throughput": stats["samples"]/stats["seconds"] if stats["seconds"] else None, # samples per channel per real second
+            "latencies": window.control.latency_stats(),
+            "error": window.worker_thread.error or None, # error that aborted the session (eg. buffer underflow)
+            # gaps are caused by the host, so are reported in real seconds (as they would be on the DAQ)
+            "repetition_gaps": [gap["gap"]/speed for gap in gaps if not gap["same_task"]],
+            "update_gaps": [gap["gap"]/speed for gap in gaps if gap["same_task"]]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a stimulation session on the fake DAQ")
+    parser.add_argument("--stim", default="iTBS", help="stimulation type, as in the GUI")
+    parser.add_argument("--duration", type=int, default=util.total_TBS_time, help="time in seconds of each stimulation")
+    parser.add_argument("--repetitions", type=int, default=util.rep_num)
+    parser.add_argument("--speed", type=float, default=100, help="virtual seconds per real second")
+    parser.add_argument("--update-at", type=float, default=None, help="request an update after this time (s)")
+    parser.add_argument("--stop-at", type=float, default=None, help="request a stop after this time (s)")
+    parser.add_argument("--trigger", action="store_true", help="wait for the PFI0 trigger before each stimulation")
+    parser.add_argument("--streaming", action="store_true", default=util.streaming, help="stream signals in chunks")
+    parser.add_argument("--persistent", action="store_true", default=util.persistent_task, help="reuse one committed task for all repetitions")
+    parser.add_argument("--sample-rate-mode", choices=["fixed", "planned"], default=util.sample_rate_mode,
+                        help="sample rate of all stimulations, or planned per stimulation (see rate_planner.py)")
+    parser.add_argument("--output", default=None, help="JSON file receiving the results")
+    args = parser.parse_args(argv)
+
+    result = simulate(args.stim, args.duration, args.repetitions, args.speed,
+                      args.update_at, args.stop_at, args.trigger, args.streaming, args.persistent,
+                      args.sample_rate_mode)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
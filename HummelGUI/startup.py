@@ -0,0 +1,195 @@
+"""
+Description
+-----------
+Startup profiler of the GUI. The time of each phase of the startup (imports, creation of widgets, reading of
+the schedule, plot, ...) is recorded in-process with checkpoints, up to the moment the window is interactive
+(first pass of the event loop). Dependencies only needed to run stimulations (nidaqmx) are imported lazily,
+and preloaded by a background thread once the window is interactive.
+
+Run as a script, launches the GUI headless (see util.startup_runs), reports the time of each phase and the
+slowest imports (from python -X importtime), and fails if time to interactive exceeds util.startup_budget.
+
+Usage (from the folder containing HummelGUI, like the GUI):
+    python HummelGUI/startup.py
+    python HummelGUI/startup.py --budget 1.0 --runs 5 --output startup.json
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+_start = time.perf_counter() # first import of this module (top of main.py)
+_last = _start
+_interactive = None
+timeline = [] #(phase, seconds), in order
+
+PRELOAD = ["nidaqmx", "nidaqmx.constants", "nidaqmx.errors", "nidaqmx.stream_writers"] #imported after startup
+REPORT_ENV = "HUMMELGUI_STARTUP_REPORT" #set by the profiler: the GUI reports its startup and quits once interactive
+
+
+def checkpoint(phase):
+    """
+    Description
+    -----------
+    Records the time elapsed since the previous checkpoint as the time of a phase of the startup
+    """
+    global _last
+    now = time.perf_counter()
+    timeline.append((phase, now-_last))
+    _last = now
+
+
+def elapsed():
+    """Time in seconds since the start of the GUI"""
+    return time.perf_counter() - _start
+
+
+def report():
+    """
+    Description
+    -----------
+    Returns the startup measurements
+
+    Returns
+    -------
+    dict
+        time to interactive (s, None if not interactive yet) and time of each phase (s)
+    """
+    return {"time_to_interactive": None if _interactive is None else _interactive-_start,
+            "phases": [{"phase": phase, "time": seconds} for phase, seconds in timeline]}
+
+
+def preload(modules=PRELOAD):
+    """
+    Description
+    -----------
+    Imports modules in a background thread, so that they are ready when needed (eg. nidaqmx when running)
+    """
+    def run():
+        for module in modules:
+            try:
+                __import__(module)
+            except ImportError:
+                pass # reported when actually used
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def interactive():
+    """
+    Description
+    -----------
+    To be called once the window is shown: records time to interactive at the first pass of the event loop,
+    then preloads lazy dependencies (only for the first window of the process)
+    """
+    from PyQt6.QtCore import QTimer
+    if _interactive is not None:
+        return
+    def ready():
+        global _interactive
+        if _interactive is not None:
+            return
+        checkpoint("event loop")
+        _interactive = time.perf_counter()
+        if os.environ.get(REPORT_ENV):
+            from PyQt6.QtWidgets import QApplication
+            print(REPORT_ENV+" "+json.dumps(report()), flush=True)
+            QApplication.instance().quit()
+            return
+        preload()
+    QTimer.singleShot(0, ready)
+
+
+def parse_importtime(text):
+    """
+    Description
+    -----------
+    Parses the output of python -X importtime
+
+    Returns
+    -------
+    list[dict]
+        module, self and cumulative time (s) and depth (0: imported by main.py) of each import
+    """
+    imports = []
+    for line in text.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        self_us, cumulative_us = int(self_us), int(cumulative_us)
+        depth = (len(name)-len(name.lstrip()) - 1)//2 # (indented by 2 spaces per level)
+        imports.append({"module": name.strip(), "self": self_us/1e6, "cumulative": cumulative_us/1e6, "depth": depth})
+    return imports
+
+
+def measure(timeout=60):
+    """
+    Description
+    -----------
+    Launches the GUI once, headless, in a new process, until it is interactive
+
+    Returns
+    -------
+    dict
+        startup report of the GUI (see report), with the wall time of the process (launch to exit) and its imports
+    """
+    import subprocess
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    env[REPORT_ENV] = "1"
+    begin = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", main], env=env, capture_output=True,
+                             text=True, timeout=timeout)
+    wall = time.perf_counter() - begin
+    lines = [line for line in process.stdout.splitlines() if line.startswith(REPORT_ENV+" ")]
+    if not lines:
+        raise RuntimeError("GUI did not become interactive:\n"+process.stderr[-2000:])
+    result = json.loads(lines[-1][len(REPORT_ENV)+1:])
+    result["process_time"] = wall
+    result["imports"] = parse_importtime(process.stderr)
+    return result
+
+
+def main(argv=None):
+    import argparse
+    import statistics
+    import util
+    parser = argparse.ArgumentParser(description="Profile the startup of the GUI")
+    parser.add_argument("--runs", type=int, default=util.startup_runs, help="launches measured (the median is kept)")
+    parser.add_argument("--budget", type=float, default=util.startup_budget, help="max time to interactive in seconds")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest imports reported")
+    parser.add_argument("--output", default=None, help="JSON file receiving the results")
+    args = parser.parse_args(argv)
+
+    runs = [measure() for _ in range(args.runs)]
+    median = statistics.median(run["time_to_interactive"] for run in runs)
+    best = min(runs, key=lambda run: abs(run["time_to_interactive"]-median))
+
+    print("phases (median run):")
+    for phase in best["phases"]:
+        print("  {:36} {:8.3f}s".format(phase["phase"], phase["time"]))
+    print("slowest imports of main.py and of the modules it imports (cumulative):")
+    top = [imp for imp in best["imports"] if imp["depth"] <= 1]
+    for imp in sorted(top, key=lambda imp: -imp["cumulative"])[:args.top]:
+        print("  {:36} {:8.3f}s".format(imp["module"], imp["cumulative"]))
+    print("time to interactive: {:.3f}s (median of {} runs, budget {:.3f}s); process launch to exit: {:.3f}s".format(
+          median, len(runs), args.budget, best["process_time"]))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"budget": args.budget, "time_to_interactive": median, "runs": runs}, file, indent=2)
+    if median > args.budget:
+        print("OVER BUDGET")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
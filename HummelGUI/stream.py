@@ -0,0 +1,305 @@
+"""
+Description
+-----------
+Module for streaming signals to the DAQ in fixed-size chunks,
+using a continuous, non-regenerating task instead of one full-buffer write
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import numpy as np
+
+import util
+import segments
+import sample_format
+
+
+def _length(signals):
+    """Number of samples per channel of signals (array, or segments.Program)"""
+    return signals.n if isinstance(signals, segments.Program) else np.shape(signals)[1]
+
+
+def _samples(signals, start, stop):
+    """Samples [start, stop) of signals; a segments.Program is only evaluated on this range"""
+    if isinstance(signals, segments.Program):
+        return signals.render(start, stop)
+    return signals[:, start:stop]
+
+
+def _read(signals, start, stop, offsets=None):
+    """
+    Samples [start, stop) of signals, channel c being read from start+offsets[c] (see SignalChunks.splice),
+    continued with zeros past the end of the signals
+    """
+    if offsets is None or not any(offsets):
+        return _samples(signals, start, stop)
+    n = max(min(stop, _length(signals))-start, 0)
+    wide = _samples(signals, start, start+n+max(offsets))
+    out = np.zeros((np.shape(wide)[0], n))
+    for channel, offset in enumerate(offsets):
+        part = wide[channel, offset:offset+n]
+        out[channel, :len(part)] = part
+    return out
+
+
+def _align(old, new, period):
+    """
+    Description
+    -----------
+    Offset (below period) into each channel of new at which it best continues the same channel of old,
+    ie. with the same phase: maximum of their normalised correlation over the samples of old
+
+    Parameters
+    ----------
+    old : np.array
+        the next samples of the current signals, of shape (channels, samples) (eg. one carrier period)
+
+    new : np.array
+        the first samples of the new signals, of shape (channels, samples+period-1)
+
+    period : int
+        number of offsets searched
+
+    Returns
+    -------
+    list[int]
+        the offset of each channel (0 for a channel without signal)
+    """
+    offsets = []
+    for a, b in zip(np.asarray(old, dtype=float), np.asarray(new, dtype=float)):
+        if a.size == 0 or b.size < a.size:
+            offsets.append(0)
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(b, a.size)[:period]
+        norms = np.sqrt(np.einsum("ij,ij->i", windows, windows)*(a @ a))
+        scores = np.divide(windows @ a, norms, out=np.zeros(len(windows)), where=norms > 0)
+        offsets.append(int(np.argmax(scores)))
+    return offsets
+
+
+class SignalChunks:
+    """
+    Description
+    -----------
+    Iterator over consecutive chunks of signals, to be streamed to the DAQ.
+    Signals may be arrays, or compiled protocols (segments.Program) of which only the streamed chunks are evaluated.
+    New signals can be spliced in while streaming (see splice)
+    """
+    def __init__(self, signals, chunk_size=util.stream_chunk_size, rate=None):
+        """
+        Parameters
+        ----------
+        signals : np.array or segments.Program
+            signals of shape (channels, samples) (eg. signal 1 is signals[0])
+
+        chunk_size : int
+            number of samples per channel in each chunk (the last chunk may be shorter)
+
+        rate : float
+            the sample rate in Hz of the signals, and of all signals spliced in (default: util.sampling_f)
+        """
+        self.signals = signals
+        self.chunk_size = chunk_size
+        self.rate = util.sampling_f if rate is None else rate
+        self.position = 0 #next sample of signals to be streamed
+        self.offsets = None #samples of signals skipped on each channel, aligning their phase (see splice)
+        self.transition = None #samples streamed before continuing with signals (see splice)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.transition is not None:
+            chunk, self.transition = self.transition, None
+            return chunk
+        if self.position >= _length(self.signals):
+            raise StopIteration
+        # contiguous copy of one chunk only, as expected by the driver
+        chunk = np.ascontiguousarray(_read(self.signals, self.position, self.position+self.chunk_size, self.offsets))
+        self.position += np.shape(chunk)[1]
+        return chunk
+
+    def splice(self, signals, carrier_f=util.carrier_f, fade_time=util.hot_swap_fade_time):
+        """
+        Description
+        -----------
+        Switches to new signals from the next chunk, and crossfades both signals so that
+        the amplitude is continuous. Every channel of the new signals starts at the sample (within
+        one carrier period) continuing the phase of the same channel of the current signals,
+        so that the carrier phase is continuous on all channels, whatever their frequency and phase
+        (eg. signal 2 shifted in frequency, see channels.py). Channels are then offset by less than a carrier period
+
+        Parameters
+        ----------
+        signals : np.array or segments.Program
+            the new signals (eg. signal 1 is signals[0])
+
+        carrier_f : float
+            the lowest carrier frequency in Hz of the current and new signals (sets the period searched)
+
+        fade_time : float
+            the time in seconds of the crossfade
+        """
+        old, old_offsets = self.signals, self.offsets
+        start = min(self.position, _length(old))
+
+        # phase of each channel aligned on the current signals
+        period = int(np.ceil(self.rate/carrier_f))
+        offsets = _align(_read(old, start, start+period, old_offsets), _samples(signals, 0, 2*period-1), period)
+
+        # crossfade, old signals being continued with zeros if they end during the fade
+        fade = min(int(self.rate*fade_time), _length(signals)-max(offsets), self.chunk_size)
+        available = _read(old, start, start+fade, old_offsets)
+        old_fade = np.zeros((np.shape(available)[0], fade))
+        old_fade[:, :np.shape(available)[1]] = available
+        weight = np.linspace(0, 1, fade)
+        faded = old_fade*(1-weight) + _read(signals, 0, fade, offsets)*weight
+
+        self.transition = np.ascontiguousarray(faded)
+        self.signals = signals
+        self.offsets = offsets
+        self.position = fade
+
+
+def configure_task(task, chunk_size=util.stream_chunk_size, write_ahead=util.stream_write_ahead, rate=None):
+    """
+    Description
+    -----------
+    Configures a task for streaming: continuous sample clock, no regeneration,
+    and an output buffer holding only the write-ahead window
+
+    Parameters
+    ----------
+    task : nidaqmx.Task
+        task with its output channels already added
+
+    chunk_size : int
+        number of samples per channel in each chunk
+
+    write_ahead : int
+        number of chunks written to the DAQ buffer ahead of the generation
+
+    rate : float
+        the sample rate in Hz (default: util.sampling_f)
+    """
+    from nidaqmx.constants import AcquisitionType, RegenerationMode # (loaded on first use, see startup.py)
+    buffer_size = chunk_size*write_ahead
+    rate = util.sampling_f if rate is None else rate
+    task.timing.cfg_samp_clk_timing(rate=rate, sample_mode=AcquisitionType.CONTINUOUS, samps_per_chan=buffer_size)
+    task.out_stream.regen_mode = RegenerationMode.DONT_ALLOW_REGENERATION
+    task.out_stream.output_buf_size = buffer_size
+
+
+class SignalStreamer:
+    """
+    Description
+    -----------
+    Feeds chunks from an iterable to a streaming task (see configure_task).
+    Writes block until buffer space frees up, so the loop is paced by the DAQ sample clock.
+    Once the chunks are exhausted, zeros are written until all signal samples are generated,
+    which avoids buffer underflow before the task is stopped
+    """
+    def __init__(self, task, chunks, chunk_size=util.stream_chunk_size, write_ahead=util.stream_write_ahead, channels=2):
+        """
+        Parameters
+        ----------
+        task : nidaqmx.Task
+            task configured with configure_task()
+
+        chunks : iterable
+            chunks of shape (channels, samples), eg. SignalChunks
+
+        chunk_size : int
+            number of samples per channel in each chunk
+
+        write_ahead : int
+            number of chunks written before starting the task
+
+        channels : int
+            number of output channels of the task
+        """
+        self.task = task
+        self.writer = sample_format.SampleWriter(task, chunk_size=chunk_size)
+        self.chunks = chunks
+        self.source = iter(chunks)
+        self.write_ahead = write_ahead
+        self.zeros = np.zeros((channels, chunk_size))
+        self.written = 0 #samples per channel written so far (including zero padding)
+        self.signal_end = 0 #samples written up to the end of the last signal chunk
+        self.exhausted = False
+
+    def prime(self):
+        """
+        Description
+        -----------
+        Fills the write-ahead window; to be called before starting the task
+        """
+        for _ in range(self.write_ahead):
+            if not self.write_next():
+                break
+
+    def write_next(self):
+        """
+        Description
+        -----------
+        Writes the next chunk, or zero padding once all chunks were written
+
+        Returns
+        -------
+        bool
+            False if only zero padding remains to be written
+        """
+        if not self.exhausted:
+            chunk = next(self.source, None)
+            if chunk is not None:
+                self.writer.write(chunk)
+                self.written += np.shape(chunk)[1]
+                self.signal_end = self.written
+                return True
+            self.exhausted = True
+            return False
+        self.writer.write(self.zeros)
+        self.written += np.shape(self.zeros)[1]
+        return False
+
+    def splice(self, signals, carrier_f=util.carrier_f):
+        """
+        Description
+        -----------
+        Splices new signals into the running stream, without stopping the task (see SignalChunks.splice).
+        They start playing once the write-ahead window already written to the DAQ is generated
+
+        Parameters
+        ----------
+        signals : np.array
+            the new signals (eg. signal 1 is signals[0])
+
+        carrier_f : float
+            the lowest carrier frequency in Hz of the current and new signals
+
+        Returns
+        -------
+        int
+            the sample of the task (see generated) at which the new signals start playing
+        """
+        self.chunks.splice(signals, carrier_f)
+        self.exhausted = False
+        return self.written # (the transition is the next chunk written)
+
+    def generated(self):
+        """
+        Description
+        -----------
+        Returns the number of samples per channel generated by the DAQ so far
+        """
+        return self.task.out_stream.total_samp_per_chan_generated
+
+    def is_done(self):
+        """
+        Description
+        -----------
+        Checks whether all signal samples have been generated by the DAQ
+        """
+        return self.exhausted and self.generated() >= self.signal_end
@@ -0,0 +1,221 @@
+"""
+Description
+-----------
+Low-overhead tracing of the hot path of a session (creation of signals, configuration of the task, writes,
+start, update and stop handling): named spans and counters are recorded in memory (time.perf_counter_ns),
+in a bounded buffer of the most recent events (see util.trace_max_events), and each span updates the
+latency histogram of its name (power-of-two buckets). Recording a span costs about a microsecond,
+so tracing stays on in production (see util.trace).
+
+At the end of each run, its events are exported in the background as Chrome trace JSON
+(open in chrome://tracing or https://ui.perfetto.dev) and its latency histograms as JSON, in util.trace_dir
+
+Usage:
+    with tracing.span("task.start"):
+        task.start()
+    tracing.count("samples_written", n)
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import collections
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+
+import util
+
+_events = collections.deque(maxlen=util.trace_max_events) #(name, thread id, start ns, duration ns or None for counters, args)
+_counters = {} #name -> value
+_histograms = {} #name -> [count, total ns, min ns, max ns, counts per bucket (duration < 2**i ns)]
+_threads = {} #thread id -> thread name
+_lock = threading.Lock()
+_start = time.perf_counter_ns() # start of the current session
+
+
+class span:
+    """
+    Description
+    -----------
+    Context manager recording the duration of a named phase, with optional arguments
+    (eg. with tracing.span("cfg_samp_clk_timing", mode="finite"): ...)
+    """
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, **args):
+        self.name = name
+        self.args = args or None
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, self.start, time.perf_counter_ns()-self.start, self.args)
+        return False
+
+
+def traced(name):
+    """
+    Description
+    -----------
+    Decorator recording each call of a function as a span
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _append(name, start, duration, args):
+    """Appends an event of the current thread, named on its first event (called with _lock held)"""
+    tid = threading.get_ident()
+    if tid not in _threads:
+        _threads[tid] = threading.current_thread().name
+    _events.append((name, tid, start, duration, args))
+
+
+def record(name, start, duration, args=None):
+    """
+    Description
+    -----------
+    Records a span (start and duration in ns of time.perf_counter_ns) and adds it to the histogram of its name
+    """
+    if not util.trace:
+        return
+    bucket = min(duration.bit_length(), 63)
+    with _lock:
+        _append(name, start, duration, args)
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = [0, 0, duration, duration, [0]*64]
+        histogram[0] += 1
+        histogram[1] += duration
+        histogram[2] = min(histogram[2], duration)
+        histogram[3] = max(histogram[3], duration)
+        histogram[4][bucket] += 1
+
+
+def count(name, value=1):
+    """
+    Description
+    -----------
+    Adds value to a counter (eg. samples written), recorded over time in the trace
+    """
+    if not util.trace:
+        return
+    with _lock:
+        total = _counters[name] = _counters.get(name, 0) + value
+        _append(name, time.perf_counter_ns(), None, total)
+
+
+def reset():
+    """
+    Description
+    -----------
+    Starts a new session: discards recorded events, counters and histograms
+    (the buffer of events is sized with the current util.trace_max_events)
+    """
+    global _start, _events
+    with _lock:
+        _events = collections.deque(maxlen=util.trace_max_events)
+        _counters.clear()
+        _histograms.clear()
+        _start = time.perf_counter_ns()
+
+
+def chrome_trace(events=None, start=None):
+    """
+    Description
+    -----------
+    Returns recorded events in the Chrome trace format (times in microseconds from the start of the session)
+
+    Returns
+    -------
+    dict
+        the trace, to be saved as JSON
+    """
+    with _lock:
+        events = list(_events) if events is None else events
+        threads = dict(_threads)
+    start = _start if start is None else start
+    pid = os.getpid()
+    trace_events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                    for tid, name in threads.items()]
+    for name, tid, begin, duration, args in events:
+        ts = (begin-start)/1000
+        if duration is None:
+            trace_events.append({"name": name, "ph": "C", "ts": ts, "pid": pid, "tid": tid, "args": {name: args}})
+        else:
+            event = {"name": name, "cat": "hummelgui", "ph": "X", "ts": ts, "dur": duration/1000, "pid": pid, "tid": tid}
+            if args:
+                event["args"] = args
+            trace_events.append(event)
+    return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+
+def histograms():
+    """
+    Description
+    -----------
+    Returns the latency histogram of each span name, with its statistics in milliseconds
+    (percentiles are upper bounds of the buckets containing them, ie. within a factor 2)
+
+    Returns
+    -------
+    dict
+        span name -> count, total, mean, min, max, p50, p90, p99, and count per bucket ("<= x ms")
+    """
+    with _lock:
+        recorded = {name: (h[0], h[1], h[2], h[3], list(h[4])) for name, h in _histograms.items()}
+    result = {}
+    for name, (n, total, low, high, buckets) in sorted(recorded.items()):
+        def percentile(q):
+            seen = 0
+            for i, bucket_count in enumerate(buckets):
+                seen += bucket_count
+                if seen >= q*n:
+                    return min(2**i, high)/1e6
+            return high/1e6
+        result[name] = {"count": n, "total": total/1e6, "mean": total/n/1e6, "min": low/1e6, "max": high/1e6,
+                        "p50": percentile(0.5), "p90": percentile(0.9), "p99": percentile(0.99),
+                        "buckets": {"<= {:g} ms".format(2**i/1e6): c for i, c in enumerate(buckets) if c}}
+    return result
+
+
+def export(directory=None, name="session"):
+    """
+    Description
+    -----------
+    Saves the trace and latency histograms of the session in the background
+    (files "<date>_<name>_trace.json" and "<date>_<name>_latency.json" in directory, default: util.trace_dir)
+
+    Returns
+    -------
+    threading.Thread
+        the thread writing the files
+    """
+    directory = util.trace_dir if directory is None else directory
+    with _lock:
+        events = list(_events)
+    start = _start
+    latencies = histograms()
+    counters = dict(_counters)
+    base = os.path.join(os.getcwd(), directory, datetime.datetime.now().strftime("%Y%m%d-%H%M%S")+"_"+name)
+    def write():
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        with open(base+"_trace.json", "w") as file:
+            json.dump(chrome_trace(events, start), file)
+        with open(base+"_latency.json", "w") as file:
+            json.dump({"latencies": latencies, "counters": counters}, file, indent=1)
+    thread = threading.Thread(target=write) # (not a daemon: the files are complete even if the GUI is closed meanwhile)
+    thread.start()
+    return thread
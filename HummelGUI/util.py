@@ -7,14 +7,69 @@ Author
 ------
 Gregor Dederichs, EPFL School of Life Sciences
 '''
+import math
+
 # Defaults for reading EXCEL FILE
 excel_file_name = "book1.xlsx" #FILE MUST BE IN GUI DIRECTORY
 
 # Defaults for GUI
 default_mode = "Settings" #should be "Blind" or "Settings"
+startup_budget = 1.5 #max time in seconds from launch until the window is interactive (checked by startup.py)
+startup_runs = 3 #launches measured by startup.py (the median is kept)
+
+# Defaults for parameter saving
+log_format = "csv" #"csv" (original layout, with the event of each record), or "jsonl" (one JSON record per line, with event and timestamps); see session_log.py
+log_index_interval = 60 #max time in seconds between rewrites of the index of session files while logging (also rewritten when a session file is started and when the log is closed)
+
+# Defaults for waveform plot
+plot_lod_base = 64 #samples per block at the finest level of detail of the plot
+
+# Defaults for waveform creation
+generation_workers = 2 #threads creating waveforms in the background
+oscillator = "cos" #"cos": np.cos over time points as np.linspace (original signals), "wavetable": phase-exact oscillators on the sampling grid (see oscillator.py)
+plan_cache_size = 16 #compiled stimulations kept (see protocols.py), eg. the waveform and its updates
+sample_rate_mode = "fixed" #"fixed": all stimulations sampled at sampling_f, "planned": lowest exact rate up to sampling_f within rate_max_error (see rate_planner.py)
+rate_max_error = 0.01 #"planned" sample rates: max relative amplitude error of the highest frequency of a stimulation (zero-order hold of the DAC)
+ramp_shape = "linear" #shape of ramps: "linear" (original), "raised_cosine", "exponential", or piecewise-linear points ((0, 0), ..., (1, 1)) of (time, amplitude) fractions (see envelope.py)
+ramp_exp_rate = 4 #"exponential" ramps: growth rate k of (exp(k*x)-1)/(exp(k)-1)
+envelope_cache_bytes = 64*1024**2 #memory budget of the envelope tables shared by ramps (bytes)
+wavetable_max_size = 2**16 #max samples of a precomputed carrier period; longer periods have their phase computed from sample indices
+
+# Defaults for waveform cache
+cache_max_bytes = 2*1024**3 #memory budget of cached waveforms (bytes)
+cache_dir = "" #directory of cached waveforms on disk (eg. "waveform_cache"); empty for memory only
+cache_max_disk_bytes = 20*1024**3 #disk budget of cached waveforms (bytes)
+prerender_dir = "prerendered_waveforms" #directory of waveforms rendered ahead of sessions by prerender.py (never evicted); empty to disable
+memmap_min_bytes = 1024**3 #waveforms of at least this size (bytes) are created in files (memory maps) and streamed from them
+memmap_dir = "waveform_files" #directory of the files of large waveforms (evicted beyond cache_max_disk_bytes); empty to always create in memory
 
 # Defaults for DAQ
 device = "Dev4"
+daq_timebase = 100e6 #Hz, divided by an integer to give the sample clock (100 MHz timebase of X Series devices); "planned" sample rates divide it exactly
+channels = ["ao0", "ao1"] #output channels, on device unless given as "DevX/aoN"; one task drives all of them, with a shared sample clock and start trigger (several devices: must be synchronizable by DAQmx, eg. same PXIe chassis or RTSI cable)
+channel_signals = [1, 2] #signal output by each channel: 1 (carrier_f, ampli1) or 2 (shifted frequency, ampli2); eg. [1, 2, 1, 2] for two stimulator pairs
+channel_phases = [0, math.pi] #phase in radians of each channel
+channel_gains = [1, 1] #factor applied to the amplitude of each channel
+daq_backend = "nidaqmx" #"nidaqmx" (hardware), or "fake" (in-process stand-in, see fake_daq.py)
+fake_daq_speed = 1 #fake backend: virtual seconds elapsing per real second (eg. 100 to fast-forward sessions)
+fake_trigger_delay = 1 #fake backend: virtual seconds from start until the PFI0 trigger fires; None to fire it manually
+persistent_task = False #True: one task per run, committed once and restarted for each repetition (waveform rewritten only if changed)
+streaming = False #True: stream signals in chunks (continuous task), False: write entire signal at once
+stream_chunk_size = 10000 #samples per channel in each streamed chunk
+stream_write_ahead = 5 #chunks written to the DAQ buffer ahead of the output
+hot_swap = True #in streaming mode: splice updates into the running output instead of restarting the task
+hot_swap_fade_time = 0.005 #time in seconds of the crossfade between old and new signals when hot-swapping
+sample_format = "float64" #"float64", "float32" (signals stored in single precision), or "int16" (signals stored as with "float32", written to the DAQ as device-native codes)
+control_timeout = 1 #max time in seconds between two checks of the task state while waiting for requests
+trace = True #record the time of each phase of the hot path (see tracing.py), exported at the end of each run
+trace_dir = "traces" #directory of the exported traces (Chrome trace JSON) and latency histograms
+trace_max_events = 200000 #most recent spans and counter values kept per run
+monitor = False #True: read the outputs back on analog inputs while stimulating, and show them live (see monitor.py)
+monitor_channels = ["ai0", "ai1"] #analog input wired to each output channel (in the order of channels), on the device of that output unless given as "DevX/aiN"
+monitor_block = 1000 #samples per channel read at each callback of the driver
+monitor_buffer_time = 10 #seconds of read-back kept in the ring buffer
+monitor_refresh_rate = 20 #refreshes per second of the live view
+monitor_view_time = 0.05 #seconds of read-back shown in the live view (the most recent)
 
 # Defaults for iTBS (units: seconds and Hz)
 total_TBS_time = 20 #time of entire signal
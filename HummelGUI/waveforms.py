@@ -0,0 +1,190 @@
+"""
+Description
+-----------
+Module describing the waveform of a stimulation from its type and parameters: the key identifying it
+(for caching, see cache.py) and the function creating it. Shared by the GUI and by the batch renderer
+(see prerender.py), so that waveforms rendered ahead of a session are found by the GUI.
+Signals larger than util.memmap_min_bytes are created directly in files (memory maps), not in memory
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import functools
+import os
+import numpy as np
+
+import util
+import cache
+import channels
+import protocols
+import rate_planner
+import envelope
+
+
+def default_params():
+    """
+    Description
+    -----------
+    Parameters of a stimulation with the defaults of util.py, as read by the GUI from its fields
+    (see MainWindow.assign_values), eg. the parameters of stimulations in blind mode
+
+    Returns
+    -------
+    dict
+        the parameters, named as the attributes of the GUI
+    """
+    A_sum = float(util.A_sum)
+    A_ratio = float(util.A_ratio)
+    return {"total_TBS_time": int(util.total_TBS_time),
+            "train_stim_time": util.train_stim_time,
+            "train_break_time": util.train_break_time,
+            "freq_of_pulse": int(util.freq_of_pulse),
+            "burst_freq": int(util.burst_freq),
+            "carrier_f": int(util.carrier_f),
+            "A1": A_sum/(1+A_ratio),
+            "A2": A_ratio*A_sum/(1+A_ratio),
+            "ramp_up_time": float(util.ramp_up_time),
+            "ramp_down_time": float(util.ramp_down_time)}
+
+
+def _in_file(generate, program, key, directory, progress=None):
+    """
+    Description
+    -----------
+    Creates signals in a .npy file of a directory (see cache.waveform_files), written through a memory map,
+    if they take at least util.memmap_min_bytes; in memory otherwise
+
+    Parameters
+    ----------
+    generate : callable
+        the function creating the signals (eg. protocols.create with the stimulation and its parameters)
+
+    program : callable
+        the function compiling the same signals (eg. protocols.plan), giving their length
+
+    key : tuple
+        the key identifying the signals
+
+    directory : str
+        the directory of the files (created if needed)
+
+    progress : callable
+        called with the fraction of the signal created (see segments.compose)
+
+    Returns
+    -------
+    tuple[segments.TimeAxis, np.array]
+        the time points and the signals (np.memmap, read-only, if in a file)
+    """
+    n = len(program())
+    dtype = np.dtype(np.float64 if util.sample_format == "float64" else np.float32)
+    if n*channels.count()*dtype.itemsize < util.memmap_min_bytes:
+        return generate(progress=progress)
+
+    os.makedirs(directory, exist_ok=True)
+    signals_file = cache.waveform_files(directory, key)[1]
+    out = np.lib.format.open_memmap(signals_file+".tmp", mode="w+", dtype=dtype, shape=(channels.count(), n))
+    try:
+        dt, _ = generate(progress=progress, out=out)
+        out.flush()
+    except BaseException:
+        del out
+        try:
+            os.remove(signals_file+".tmp")
+        except OSError:
+            pass
+        raise
+    del out # (closes the file)
+    # renamed once complete, so that no partial file is ever loaded
+    os.replace(signals_file+".tmp", signals_file)
+    cache.save_waveform(directory, key, dt)
+    return cache.load_waveform(directory, key)
+
+
+def job(stim_type, params, rampup=True, directory=None, rate=None):
+    """
+    Description
+    -----------
+    Describes the signals of a stimulation
+
+    Parameters
+    ----------
+    stim_type : str
+        the stimulation type (see protocols.names)
+
+    params : dict
+        the parameters of the stimulation (see default_params)
+
+    rampup: bool
+        decides whether a ramping signal with no shift is added to the main signal
+
+    directory : str
+        directory of the files receiving signals of at least util.memmap_min_bytes, played back from the files
+        in chunks (None: always in memory)
+
+    rate : float
+        imposed sample rate (eg. of a running continuous task); None for the rate of the stimulation
+        (see rate_planner.py)
+
+    Returns
+    -------
+    tuple[tuple, callable]
+        the key identifying the signals (for caching), and the function creating them
+        (None if the stimulation type creates no signals)
+    """
+    p = params
+    if protocols.get(stim_type) is not None:
+        rate = rate_planner.plan(stim_type, p, rampup, rate).rate
+    key = (stim_type,
+           p["total_TBS_time"],
+           p["train_stim_time"],
+           p["train_break_time"],
+           p["freq_of_pulse"],
+           p["burst_freq"],
+           p["carrier_f"],
+           p["A1"], p["A2"],
+           p["ramp_up_time"],
+           p["ramp_down_time"],
+           rampup,
+           util.sampling_f if rate is None else rate,
+           util.sample_format,
+           util.oscillator,
+           envelope.shape(util.ramp_shape),
+           channels.layout().key)
+
+    # blank signal
+    if protocols.get(stim_type) is None:
+        return key, None
+
+    generate = functools.partial(protocols.create, stim_type, p, rampup, rate=rate)
+    if directory:
+        generate = functools.partial(_in_file, generate, functools.partial(protocols.plan, stim_type, p, rampup, rate),
+                                     key, directory)
+
+    return key, generate
+
+
+def program(stim_type, params, rampup=True, rate=None):
+    """
+    Description
+    -----------
+    Compiles the signals of a stimulation without creating them, eg. for streamed tasks: the samples are
+    evaluated chunk by chunk while the task runs (see stream.SignalChunks), at the rate job would create them.
+    What the segments reuse is computed here, before streaming (see segments.Program.prepare)
+
+    Parameters
+    ----------
+    stim_type, params, rampup, rate :
+        as for job
+
+    Returns
+    -------
+    tuple[segments.TimeAxis, segments.Program]
+        the time points and the compiled signals (None if the stimulation type creates no signals)
+    """
+    if protocols.get(stim_type) is None:
+        return None
+    plan = protocols.plan(stim_type, params, rampup, rate_planner.plan(stim_type, params, rampup, rate).rate)
+    return plan.axis, plan.program.prepare()
@@ -0,0 +1,33 @@
+"""
+Description
+-----------
+Tests of HummelGUI, run from the folder containing HummelGUI (like the GUI):
+    python -m pytest -q tests
+
+Modules of HummelGUI are imported by name, as they import each other
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import os
+import shutil
+import sys
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen") # headless GUI
+GUI_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "HummelGUI")
+sys.path.insert(0, GUI_DIR)
+
+import util
+
+
+@pytest.fixture
+def gui_folder(tmp_path, monkeypatch):
+    """Runs the test from a temporary folder holding the example schedule as the excel file of the study, like the GUI"""
+    os.makedirs(tmp_path/"HummelGUI")
+    shutil.copy(os.path.join(GUI_DIR, "example.xlsx"), tmp_path/"HummelGUI"/util.excel_file_name)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
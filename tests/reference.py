@@ -0,0 +1,143 @@
+"""
+Description
+-----------
+Original signal generators (fbase.TBS, fbase.ramp, iTBS, cTBS, TI, TBS_control), as they were before
+signals were composed from segments, kept as the reference of the regression tests: with the default
+settings (util.oscillator "cos", util.ramp_shape "linear", util.sample_format "float64", fixed sample rate),
+the generators must return the same samples and time points, bit for bit.
+
+The operations are those of the original generators, in the same order (the results depend on it);
+parameters without a value are read from util at call time
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import numpy as np
+
+import util
+
+
+def _defaults(values):
+    """Parameters of a generator, completed with the defaults of util"""
+    defaults = {"high_f": util.carrier_f, "carrier_f": util.carrier_f, "pulse_f": util.freq_of_pulse,
+                "shift_f": util.freq_of_pulse, "burst_f": util.burst_freq, "A1": util.ampli1, "A2": util.ampli2,
+                "total_time": util.total_TBS_time, "stim_time": util.train_stim_time,
+                "break_time": util.train_break_time, "ramp_up_time": util.ramp_up_time,
+                "ramp_down_time": util.ramp_down_time}
+    return {name: defaults[name] if value is None else value for name, value in values.items()}
+
+
+def TBS(high_f=None, pulse_f=None, burst_f=None, duration=None, A1=None, A2=None):
+    """Theta-burst signals (fbase.TBS)"""
+    p = _defaults(dict(high_f=high_f, pulse_f=pulse_f, burst_f=burst_f, A1=A1, A2=A2))
+    duration = util.train_stim_time if duration is None else duration
+    cycle_t = 1/p["burst_f"]
+    pulse_t = 3/p["pulse_f"]
+    no_pulses = int(duration/cycle_t)
+    f1 = p["high_f"]
+    f2 = p["high_f"] + p["pulse_f"]
+    pulse_dt = np.linspace(0, pulse_t, int(util.sampling_f*pulse_t))
+    I1 = p["A1"]*np.cos(2*np.pi*f1*pulse_dt)
+    I2 = p["A2"]*np.cos(2*np.pi*f2*pulse_dt+np.pi)
+    break_dt = pulse_dt[-1] + np.linspace(1/util.sampling_f, cycle_t-pulse_t, int(util.sampling_f*(cycle_t-pulse_t)))
+    I1b = p["A1"]*np.cos(2*np.pi*f1*break_dt)
+    I2b = p["A2"]*np.cos(2*np.pi*f1*break_dt+np.pi)
+    signals = np.vstack((np.concatenate((I1, I1b)), np.concatenate((I2, I2b))))
+    return np.tile(signals, no_pulses)
+
+
+def ramp(direction="up", carrier_f=None, ramp_time=None, A1_max=None, A2_max=None):
+    """Carrier of linearly increasing/decreasing amplitudes (fbase.ramp)"""
+    p = _defaults(dict(carrier_f=carrier_f, A1=A1_max, A2=A2_max))
+    ramp_time = util.ramp_up_time if ramp_time is None else ramp_time
+    dt = np.linspace(0, ramp_time, int(util.sampling_f*ramp_time))
+    ramp1 = np.linspace(0, p["A1"], int(util.sampling_f*ramp_time))
+    ramp2 = np.linspace(0, p["A2"], int(util.sampling_f*ramp_time))
+    if direction == "down":
+        ramp1 = ramp1[::-1]
+        ramp2 = ramp2[::-1]
+    I1 = ramp1*np.cos(2*np.pi*p["carrier_f"]*dt)
+    I2 = ramp2*np.cos(2*np.pi*p["carrier_f"]*dt+np.pi)
+    return np.vstack((I1, I2))
+
+
+def _end(signals, dt, p):
+    """Ramp down, 100 zero samples and their time points, ending every stimulation"""
+    down = ramp("down", carrier_f=p["carrier_f"], ramp_time=p["ramp_down_time"], A1_max=p["A1"], A2_max=p["A2"])
+    signals = np.concatenate((signals, down, np.zeros((2, 100))), axis=1)
+    dt = np.concatenate((dt, dt[-1] + np.arange(0, 100) * dt[1]-dt[0]))
+    return dt, signals
+
+
+def _time(p, rampup):
+    """Time points of the stimulation and its ramps"""
+    total = p["total_time"]+p["ramp_up_time"]+p["ramp_down_time"] if rampup else p["total_time"]+p["ramp_down_time"]
+    return np.linspace(0, total, int(util.sampling_f*total))
+
+
+def _start(signals, p, rampup):
+    """Signals preceded by the ramp up"""
+    if not rampup:
+        return signals
+    up = ramp("up", carrier_f=p["carrier_f"], ramp_time=p["ramp_up_time"], A1_max=p["A1"], A2_max=p["A2"])
+    return np.concatenate((up, signals), axis=1)
+
+
+def _carrier(p, dt):
+    """Carrier of both signals, without interference"""
+    return np.vstack((p["A1"]*np.cos(2*np.pi*p["carrier_f"]*dt), p["A2"]*np.cos(2*np.pi*p["carrier_f"]*dt+np.pi)))
+
+
+def iTBS(total_time=None, stim_time=None, break_time=None, pulse_f=None, burst_f=None, carrier_f=None,
+         A1=None, A2=None, ramp_up_time=None, ramp_down_time=None, rampup=True):
+    """Intermittent theta-burst stimulation (iTBS.iTBS)"""
+    p = _defaults(dict(total_time=total_time, stim_time=stim_time, break_time=break_time, pulse_f=pulse_f,
+                       burst_f=burst_f, carrier_f=carrier_f, A1=A1, A2=A2, ramp_up_time=ramp_up_time,
+                       ramp_down_time=ramp_down_time))
+    no_cycles = np.floor(p["total_time"]/(p["stim_time"]+p["break_time"])-0.001)
+    dt = _time(p, rampup)
+    break_dt = np.linspace(0, p["break_time"], int(util.sampling_f*p["break_time"]))
+    train = lambda: TBS(high_f=p["carrier_f"], pulse_f=p["pulse_f"], burst_f=p["burst_f"], duration=p["stim_time"],
+                        A1=p["A1"], A2=p["A2"])
+    signals = np.concatenate((_start(train(), p, rampup), _carrier(p, break_dt)), axis=1)
+    for i in np.arange(no_cycles):
+        signals = np.concatenate((signals, train()), axis=1)
+        if i != no_cycles-1:
+            signals = np.concatenate((signals, _carrier(p, break_dt)), axis=1)
+        else:
+            remaining = np.size(dt)-int(util.sampling_f*p["ramp_down_time"]) - np.shape(signals)[1]
+            if remaining > 0:
+                signals = np.concatenate((signals, _carrier(p, np.arange(0, remaining) * (dt[1]-dt[0]))), axis=1)
+    return _end(signals, dt, p)
+
+
+def cTBS(total_time=None, pulse_f=None, burst_f=None, carrier_f=None, A1=None, A2=None,
+         ramp_up_time=None, ramp_down_time=None, rampup=True):
+    """Continuous theta-burst stimulation (cTBS.cTBS)"""
+    p = _defaults(dict(total_time=total_time, pulse_f=pulse_f, burst_f=burst_f, carrier_f=carrier_f, A1=A1, A2=A2,
+                       ramp_up_time=ramp_up_time, ramp_down_time=ramp_down_time))
+    signals = TBS(high_f=p["carrier_f"], pulse_f=p["pulse_f"], burst_f=p["burst_f"], duration=p["total_time"],
+                  A1=p["A1"], A2=p["A2"])
+    return _end(_start(signals, p, rampup), _time(p, rampup), p)
+
+
+def TI(total_time=None, shift_f=None, carrier_f=None, A1=None, A2=None,
+       ramp_up_time=None, ramp_down_time=None, rampup=True):
+    """Temporal interference (TI.TI)"""
+    p = _defaults(dict(total_time=total_time, shift_f=shift_f, carrier_f=carrier_f, A1=A1, A2=A2,
+                       ramp_up_time=ramp_up_time, ramp_down_time=ramp_down_time))
+    main_dt = np.linspace(0, p["total_time"], int(util.sampling_f*p["total_time"]))
+    signals = np.vstack((p["A1"]*np.cos(2*np.pi*p["carrier_f"]*main_dt),
+                         p["A2"]*np.cos(2*np.pi*(p["carrier_f"]+p["shift_f"])*main_dt+np.pi)))
+    return _end(_start(signals, p, rampup), _time(p, rampup), p)
+
+
+def TBS_control(total_time=None, carrier_f=None, A1=None, A2=None, ramp_up_time=None, ramp_down_time=None,
+                rampup=True):
+    """Carrier only, without interference (TBS_ctrl.TBS_control)"""
+    p = _defaults(dict(total_time=total_time, carrier_f=carrier_f, A1=A1, A2=A2,
+                       ramp_up_time=ramp_up_time, ramp_down_time=ramp_down_time))
+    signals = _carrier(p, np.linspace(0, p["total_time"], int(util.sampling_f*p["total_time"])))
+    return _end(_start(signals, p, rampup), _time(p, rampup), p)
@@ -0,0 +1,73 @@
+"""
+Description
+-----------
+Tests of the background creation of waveforms (see generation.py, segments.compose), and of their plot
+(see lod_plot.py)
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+import segments
+import protocols
+import waveforms
+import lod_plot
+
+
+def test_cancel_long_segment():
+    """A 30-minute TI (one carrier segment) is cancelled within about one block of samples of its carrier"""
+    params = dict(waveforms.default_params(), total_TBS_time=1800)
+    plan = protocols.plan("TI", params)
+    block = 2**20
+    carrier = plan.program.segments[1]
+    carrier_start = plan.program.segments[0].n
+    assert isinstance(carrier, segments.Carrier) and carrier.n > 100*block
+    calls = []
+
+    def progress(fraction):
+        filled = round(fraction*len(plan))
+        if calls and calls[0][1] >= carrier_start:
+            raise segments.GenerationCancelled() # superseded once the carrier started
+        if filled >= carrier_start:
+            calls.append((time.perf_counter(), filled))
+
+    with pytest.raises(segments.GenerationCancelled):
+        segments.compose(plan.program.segments, progress, block=block)
+    cancelled = time.perf_counter()
+    assert len(calls) == 1 # (next check of progress: after one block)
+
+    # within about the time of one block
+    begin = time.perf_counter()
+    plan.program.render(carrier_start, carrier_start+block)
+    block_time = time.perf_counter() - begin
+    assert cancelled - calls[0][0] < 5*block_time + 0.05
+
+
+def test_pyramid_built_with_signals(monkeypatch):
+    """The pyramid of the plot is built by the thread creating the signals, and found again while they live"""
+    threads = []
+    build = lod_plot.MinMaxPyramid.__init__
+    def record(pyramid, signals, *args, **kwargs):
+        threads.append(threading.current_thread())
+        build(pyramid, signals, *args, **kwargs)
+    monkeypatch.setattr(lod_plot.MinMaxPyramid, "__init__", record)
+
+    _, generate = waveforms.job("cTBS", dict(waveforms.default_params(), total_TBS_time=5))
+    with ThreadPoolExecutor(1) as pool:
+        dt, signals = pool.submit(lod_plot.with_pyramid, generate).result()
+    assert len(threads) == 1 and threads[0] is not threading.current_thread()
+    assert lod_plot.has_pyramid(signals)
+    pyramid = lod_plot.pyramid(signals)
+    assert len(threads) == 1 and pyramid.n == signals.shape[1] == len(dt)
+    assert pyramid.bounds() == (signals.sum(axis=0).min(), signals.sum(axis=0).max())
+
+    # forgotten with the signals
+    key = id(signals)
+    del signals
+    assert key not in lod_plot._pyramids
@@ -0,0 +1,226 @@
+"""
+Description
+-----------
+Regression tests of the signal generation and output paths, against the original generators (see reference.py):
+    - the generators, compiled protocols and random access to their samples return the original signals
+    - carrier oscillators are phase-exact after hours
+    - planned sample rates stay within their error bound
+    - hot-swapped signals play right after the write-ahead window
+    - a session runs on the fake DAQ in each output mode (finite, update, streaming, persistent task)
+The time to interactive of the GUI is checked by test_startup.py
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import math
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+import util
+import fbase
+import iTBS
+import cTBS
+import TI
+import TBS_ctrl
+import protocols
+import waveforms
+import oscillator
+import rate_planner
+import channels
+import daq
+import fake_daq
+import stream
+import reference
+
+
+@pytest.fixture
+def original_settings(monkeypatch):
+    """Settings with which the generators return the original signals"""
+    monkeypatch.setattr(util, "oscillator", "cos")
+    monkeypatch.setattr(util, "ramp_shape", "linear")
+    monkeypatch.setattr(util, "sample_format", "float64")
+    monkeypatch.setattr(util, "sample_rate_mode", "fixed")
+
+
+GENERATORS = [(iTBS.iTBS, reference.iTBS, dict(total_time=20)),
+              (iTBS.iTBS, reference.iTBS, dict(total_time=33, rampup=False)),
+              (iTBS.iTBS, reference.iTBS, dict(total_time=25.3, stim_time=1.3, break_time=3.1)),
+              (cTBS.cTBS, reference.cTBS, dict(total_time=7)),
+              (cTBS.cTBS, reference.cTBS, dict(total_time=7.3, rampup=False, ramp_down_time=2.5)),
+              (TI.TI, reference.TI, dict(total_time=6.3, ramp_up_time=1.7)),
+              (TI.TI, reference.TI, dict(total_time=6, rampup=False, shift_f=130)),
+              (TBS_ctrl.TBS_control, reference.TBS_control, dict(total_time=4.1)),
+              (TBS_ctrl.TBS_control, reference.TBS_control, dict(total_time=4, rampup=False, A1=1.5))]
+
+
+@pytest.mark.parametrize("generator, original, kwargs", GENERATORS)
+def test_generators_match_original(original_settings, generator, original, kwargs):
+    """Generators return the original signals and time points, bit for bit"""
+    dt, signals = generator(**kwargs)
+    original_dt, original_signals = original(**kwargs)
+    assert signals.dtype == original_signals.dtype
+    assert np.array_equal(signals, original_signals)
+    assert np.array_equal(np.asarray(dt), original_dt)
+
+
+def test_base_functions_match_original(original_settings):
+    """fbase.TBS and fbase.ramp return the original signals, bit for bit"""
+    assert np.array_equal(fbase.TBS(duration=2.3, pulse_f=90), reference.TBS(duration=2.3, pulse_f=90))
+    for direction in ("up", "down"):
+        assert np.array_equal(fbase.ramp(direction, ramp_time=1.3, A1_max=1.2), reference.ramp(direction, ramp_time=1.3, A1_max=1.2))
+
+
+def _original(name, params, rampup):
+    """Original signals of a stimulation type with the parameters of the GUI"""
+    common = dict(total_time=params["total_TBS_time"], carrier_f=params["carrier_f"], A1=params["A1"], A2=params["A2"],
+                  ramp_up_time=params["ramp_up_time"], ramp_down_time=params["ramp_down_time"], rampup=rampup)
+    if name == "iTBS":
+        return reference.iTBS(stim_time=params["train_stim_time"], break_time=params["train_break_time"],
+                              pulse_f=params["freq_of_pulse"], burst_f=params["burst_freq"], **common)
+    if name == "cTBS":
+        return reference.cTBS(pulse_f=params["freq_of_pulse"], burst_f=params["burst_freq"], **common)
+    if name == "TI":
+        return reference.TI(shift_f=params["freq_of_pulse"], **common)
+    return reference.TBS_control(**common)
+
+
+@pytest.mark.parametrize("name", protocols.names())
+@pytest.mark.parametrize("rampup", [True, False])
+def test_protocols_match_original(original_settings, name, rampup):
+    """Compiled protocols return the original signals, also composed in small blocks and read at random"""
+    params = dict(waveforms.default_params(), total_TBS_time=12, carrier_f=2100)
+    dt, signals = protocols.create(name, params, rampup)
+    original_dt, original_signals = _original(name, params, rampup)
+    assert np.array_equal(signals, original_signals)
+    assert np.array_equal(np.asarray(dt), original_dt)
+
+    plan = protocols.plan(name, params, rampup)
+    assert len(plan) == np.shape(original_signals)[1]
+    rng = np.random.default_rng(0)
+    for start in rng.integers(0, len(plan), 20):
+        stop = min(start + rng.integers(1, 300000), len(plan))
+        assert np.array_equal(plan.program.render(start, stop), original_signals[:, start:stop]), (start, stop)
+
+
+@pytest.mark.parametrize("f", [2000, 2100, 2000.3, 2137.77])
+def test_oscillator_phase_exact(f):
+    """Carrier samples after one hour have the exact phase 2*pi*f*k/fs (within float precision), wavetable or not"""
+    fs = 100000
+    ratio = Fraction(str(f))/fs
+    osc = oscillator.Oscillator(f, fs)
+    assert Fraction(osc.p, osc.q) == ratio
+    for start in (0, 3600*fs + 17, 4*3600*fs - 999):
+        out = np.empty(5000)
+        osc.render(start, start+len(out), out)
+        k = np.arange(start, start+len(out))
+        exact = np.cos(2*np.pi*np.array([float((int(i)*ratio) % 1) for i in k]))
+        assert np.max(np.abs(out-exact)) < 1e-9, start
+
+
+def test_wavetable_carrier_continues_phase(monkeypatch):
+    """With wavetable oscillators, the carrier of a 60-minute stimulation is in phase with its first samples until its end"""
+    monkeypatch.setattr(util, "oscillator", "wavetable")
+    params = dict(waveforms.default_params(), total_TBS_time=3600)
+    program = protocols.plan("TBS_control", params).program
+    period = int(util.sampling_f/params["carrier_f"])
+    carrier_start = program.segments[0].n
+    carrier_end = carrier_start + program.segments[1].n
+    first = program.render(carrier_start, carrier_start+period)
+    k = carrier_end - period - (carrier_end - carrier_start) % period
+    assert np.array_equal(program.render(k, k+period), first)
+
+
+@pytest.mark.parametrize("name", protocols.names())
+@pytest.mark.parametrize("max_error", [0.001, 0.01, 0.05])
+def test_planned_rate_within_error_bound(monkeypatch, name, max_error):
+    """Planned sample rates are exact divisions of the timebase, and keep the error of the highest frequency within the bound"""
+    monkeypatch.setattr(util, "sample_rate_mode", "planned")
+    monkeypatch.setattr(util, "rate_max_error", max_error)
+    params = waveforms.default_params()
+    plan = rate_planner.plan(name, params)
+    assert plan.rate <= util.sampling_f
+    assert util.daq_timebase % plan.rate == 0
+    x = math.pi*plan.highest_f/plan.rate
+    assert 1 - math.sin(x)/x <= max_error # (zero-order hold of the DAC)
+    # same timings as at util.sampling_f
+    reference_program = protocols.plan(name, params).program
+    program = protocols.plan(name, params, rate=plan.rate).program
+    for seg, ref in zip(program.segments, reference_program.segments):
+        assert seg.n*util.sampling_f == ref.n*plan.rate or type(seg).__name__ == "Zeros"
+
+
+def test_switch_after_write_ahead(monkeypatch):
+    """Hot-swapped signals (with their crossfade) play from the sample returned by splice, at most one write-ahead window later"""
+    monkeypatch.setattr(util, "daq_backend", "fake")
+    speed = fake_daq.clock.speed
+    fake_daq.clock.set_speed(50)
+    params = waveforms.default_params()
+    old = protocols.plan("TI", dict(params, total_TBS_time=10)).program
+    new = protocols.plan("TI", dict(params, total_TBS_time=10, A1=0.8*params["A1"]), rampup=False).program
+    written = {} # first sample -> chunk
+    try:
+        with daq.new_task() as task:
+            for name in channels.layout().names:
+                task.ao_channels.add_ao_voltage_chan(name)
+            stream.configure_task(task)
+            chunks = stream.SignalChunks(old)
+            streamer = stream.SignalStreamer(task, chunks, channels=len(task.ao_channels))
+            write = streamer.writer.write
+            def record(signals):
+                written[streamer.written] = np.array(signals)
+                write(signals)
+            streamer.writer.write = record
+            streamer.prime()
+            task.start()
+            for _ in range(30):
+                streamer.write_next()
+            handled = streamer.generated()
+            switch = streamer.splice(new, params["carrier_f"])
+            transition = chunks.transition
+            while streamer.generated() < switch:
+                streamer.write_next()
+            task.stop()
+    finally:
+        fake_daq.clock.set_speed(speed)
+    assert 0 <= switch - handled <= util.stream_chunk_size*util.stream_write_ahead
+    assert np.array_equal(written[switch], transition)
+
+
+MODES = {"finite": {},
+         "update": dict(update_at=3),
+         "streaming": dict(streaming=True, update_at=3),
+         "persistent": dict(persistent=True)}
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_session_on_fake_daq(gui_folder, monkeypatch, mode):
+    """A session of 2 repetitions runs on the fake DAQ in each output mode, writing the expected samples"""
+    import simulate
+    for setting in ("daq_backend", "streaming", "persistent_task", "sample_rate_mode"):
+        monkeypatch.setattr(util, setting, getattr(util, setting)) # (set by simulate, restored after the test)
+    speed = fake_daq.clock.speed
+    try:
+        result = simulate.simulate(stim="iTBS", duration=10, repetitions=2, speed=20,
+                                   **dict(dict(streaming=False, persistent=False), **MODES[mode]))
+    finally:
+        fake_daq.clock.set_speed(speed)
+    n = len(protocols.plan("iTBS", dict(waveforms.default_params(), total_TBS_time=10)))
+    latencies = result["latencies"]
+    assert result["error"] is None
+    assert latencies["setup"]["count"] == 2
+    if mode == "finite":
+        assert result["samples_written"] == 2*n
+        assert len(result["repetition_gaps"]) == 1
+    elif mode == "update":
+        assert latencies["update"]["count"] == 1
+        assert len(result["update_gaps"]) == 1
+    elif mode == "streaming":
+        assert latencies["update"]["count"] == 1
+        assert latencies["switch"]["count"] == 1 and latencies["switch"]["max"] > 0
+        assert result["update_gaps"] == [] # (hot-swapped, without restarting the task)
+    else:
+        assert result["samples_written"] == n # (written once, restarted for the second repetition)
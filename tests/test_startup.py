@@ -0,0 +1,22 @@
+"""
+Description
+-----------
+Test of the time to interactive of the GUI, launched headless (see startup.py)
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import statistics
+
+import util
+import startup
+
+
+def test_time_to_interactive(gui_folder):
+    """Median time to interactive of util.startup_runs headless launches is within util.startup_budget"""
+    runs = [startup.measure() for _ in range(util.startup_runs)]
+    median = statistics.median(run["time_to_interactive"] for run in runs)
+    assert median <= util.startup_budget, "time to interactive {:.3f}s over budget ({:.3f}s)".format(median, util.startup_budget)
+    assert "nidaqmx" not in {imp["module"] for run in runs for imp in run["imports"]} # (loaded after startup)
@@ -0,0 +1,45 @@
+"""
+Description
+-----------
+Tests of streaming and hot-swaps (see stream.py)
+
+Author
+------
+Gregor Dederichs, EPFL School of Life Sciences
+"""
+
+import numpy as np
+import pytest
+
+import util
+import protocols
+import waveforms
+import stream
+
+
+@pytest.mark.parametrize("name", ["TI", "TBS_control"])
+def test_splice_keeps_phase_of_all_channels(monkeypatch, name):
+    """
+    A hot-swap keeps the carrier of every channel in phase through the crossfade (no dip of amplitude),
+    including signal 2 shifted in frequency and channels with their own phase
+    (protocols of constant frequencies: within theta-bursts, the frequency of signal 2 changes anyway)
+    """
+    monkeypatch.setattr(util, "channels", ["ao0", "ao1", "ao2"])
+    monkeypatch.setattr(util, "channel_signals", [1, 2, 1])
+    monkeypatch.setattr(util, "channel_phases", [0.0, np.pi, np.pi/2])
+    monkeypatch.setattr(util, "channel_gains", [1.0, 1.0, 1.0])
+    p = waveforms.default_params()
+    old = protocols.plan(name, dict(p, total_TBS_time=10)).program
+    new = protocols.plan(name, dict(p, total_TBS_time=10, A1=0.8*p["A1"], A2=1.2*p["A2"],
+                                    freq_of_pulse=p["freq_of_pulse"]+7), rampup=False).program
+    period = int(np.ceil(util.sampling_f/p["carrier_f"]))
+    lowest = np.array([0.8*p["A1"], p["A2"], 0.8*p["A1"]]) # (of old and new signals)
+    for chunk_size in range(1000, 1300, 23): # (switch at any phase)
+        chunks = stream.SignalChunks(old, chunk_size=chunk_size)
+        before = [next(chunks) for _ in range(int(p["ramp_up_time"]*util.sampling_f)//chunk_size+50)]
+        switch = sum(np.shape(chunk)[1] for chunk in before)
+        chunks.splice(new, p["carrier_f"])
+        x = np.concatenate(before + [next(chunks) for _ in range(2)], axis=1)[:, switch-period:]
+        # peak amplitude over each carrier period
+        envelope = np.lib.stride_tricks.sliding_window_view(np.abs(x), period, axis=1).max(axis=2)
+        assert np.all(envelope.min(axis=1) > 0.95*lowest), chunk_size